@@ -12,6 +12,7 @@ from collections import defaultdict
 import requests
 from six import string_types
 
+from datadog_checks.base.utils.cache import LRUCache
 from datadog_checks.checks import AgentCheck
 from datadog_checks.couchbase.couchbase_consts import (
     BUCKET_STATS,
@@ -38,6 +39,9 @@ class Couchbase(AgentCheck):
 
     HTTP_CONFIG_REMAPPER = {'user': {'name': 'username'}, 'ssl_verify': {'name': 'tls_verify'}}
 
+    # Maximum number of stat names memoized by `camel_case_to_joined_lower`
+    JOINED_LOWER_NAMES_CACHE_SIZE = 1000
+
     class CouchbaseInstanceState(object):
         def __init__(self):
             self.previous_status = None
@@ -48,6 +52,9 @@ class Couchbase(AgentCheck):
         # Keep track of all instances
         self._instance_states = defaultdict(lambda: self.CouchbaseInstanceState())
 
+        # The stat names don't go through `normalize`, they are memoized separately
+        self._joined_lower_names = LRUCache(self.JOINED_LOWER_NAMES_CACHE_SIZE)
+
     def _create_metrics(self, data, instance_state, server, tags=None):
         # Get storage metrics
         storage_totals = data['stats']['storageTotals']
@@ -308,6 +315,14 @@ class Couchbase(AgentCheck):
     # Takes a camelCased variable and returns a joined_lower equivalent.
     # Returns input if non-camelCase variable is detected.
     def camel_case_to_joined_lower(self, variable):
+        converted_variable = self._joined_lower_names.get(variable)
+        if converted_variable is None:
+            converted_variable = self._camel_case_to_joined_lower(variable)
+            self._joined_lower_names.set(variable, converted_variable)
+
+        return converted_variable
+
+    def _camel_case_to_joined_lower(self, variable):
         # replace non-word with _
         converted_variable = re.sub(r'\W+', '_', variable)
 
@@ -34,6 +34,16 @@ def test_camel_case_to_joined_lower():
         )
 
 
+def test_camel_case_to_joined_lower_memoized():
+    couchbase = Couchbase('couchbase', {}, [{}])
+
+    with mock.patch.object(couchbase, '_camel_case_to_joined_lower', wraps=couchbase._camel_case_to_joined_lower) as m:
+        for _ in range(3):
+            assert couchbase.camel_case_to_joined_lower('camelCase') == 'camel_case'
+
+    assert m.call_count == 1
+
+
 def test_extract_seconds_value():
     couchbase = Couchbase('couchbase', {}, [{}])
 
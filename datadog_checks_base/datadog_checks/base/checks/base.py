@@ -17,12 +17,15 @@ from six import PY3, iteritems, text_type
 
 from ..config import is_affirmative
 from ..constants import ServiceCheck
+from ..utils.agent.timing import NOOP_SPAN, RunProfiler
 from ..utils.agent.utils import should_profile_memory
+from ..utils.cache import LRUCache
 from ..utils.common import ensure_bytes, ensure_unicode, to_string
 from ..utils.http import RequestsWrapper
-from ..utils.limiter import Limiter
+from ..utils.limiter import ContextLimiter, Limiter
 from ..utils.metadata import MetadataManager
 from ..utils.proxy import config_proxy_skip
+from ..utils.tagging import NormalizedTags
 
 try:
     import datadog_agent
@@ -54,6 +57,133 @@ if datadog_agent.get_config('disable_unsafe_yaml'):
 # Metric types for which it's only useful to submit once per set of tags
 ONE_PER_CONTEXT_METRIC_TYPES = [aggregator.GAUGE, aggregator.RATE, aggregator.MONOTONIC_COUNT]
 
+# Type of the `MetricBatch` rows holding a histogram bucket,
+# their value is `(value, lower_bound, upper_bound, monotonic)`
+HISTOGRAM_BUCKET = 'histogram_bucket'
+
+# Estimated number of distinct contexts submitted by a run, when `LIMIT_METRIC_CONTEXTS` is enabled
+METRIC_CONTEXTS_TELEMETRY = 'datadog.agent.check.metric_contexts'
+
+# Stats of the metric names memoized by `normalize`, when `METRIC_NAME_CACHE_SIZE` is set and
+# `metric_name_cache_telemetry` is enabled
+METRIC_NAME_CACHE_TELEMETRY = 'datadog.agent.check.metric_name_cache'
+
+# Older Agents can only receive metrics one at a time
+BULK_SUBMISSION_SUPPORTED = hasattr(aggregator, 'submit_metrics')
+
+
+class MetricBatch(object):
+    """
+    Buffers metric submissions of a check so that they are normalized and sent to the
+    aggregator in bulk, see :py:meth:`AgentCheck.submit_metrics_batch`.
+    """
+
+    __slots__ = ('check', 'mtype', 'raw', 'rows', 'size', '_active', '_recordings')
+
+    def __init__(self, check, mtype=None, raw=False, size=1000):
+        self.check = check
+        self.mtype = mtype
+        self.raw = raw
+        self.size = size
+        self.rows = []
+        self._active = False
+        self._recordings = []
+
+    def add(self, name, value, tags=None, hostname=None, mtype=None, device_name=None, raw=None):
+        """Buffer a metric, flushing the batch once it is full.
+
+        :param str name: the name of the metric.
+        :param float value: the value for the metric.
+        :param list tags: (optional) a list of tags to associate with this metric.
+        :param str hostname: (optional) a hostname to associate with this metric. Defaults to the current host.
+        :param mtype: (optional) the aggregator metric type, defaults to the one of the batch.
+        :param str device_name: **deprecated** add a tag in the form :code:`device:<device_name>` to the :code:`tags`
+            list instead.
+        :param bool raw: (optional) whether to ignore any defined namespace prefix, defaults to the one of the batch.
+        """
+        if value is None:
+            # ignore metric sample
+            return
+
+        # Callers commonly reuse and modify the list of tags after submitting a metric,
+        # `NormalizedTags` are immutable and keep their type to skip the normalization
+        if tags is not None and type(tags) is not NormalizedTags:
+            tags = tuple(tags)
+
+        row = (
+            self.mtype if mtype is None else mtype,
+            name,
+            value,
+            tags,
+            hostname,
+            device_name,
+            self.raw if raw is None else raw,
+        )
+        self.rows.append(row)
+        if self._recordings:
+            for recording in self._recordings:
+                recording.append(row)
+
+        if len(self.rows) >= self.size:
+            self.flush()
+
+    def add_histogram_bucket(self, name, value, lower_bound, upper_bound, monotonic, hostname, tags):
+        """Buffer a histogram bucket, see :py:meth:`AgentCheck.submit_histogram_bucket`."""
+        if value is None:
+            # ignore metric sample
+            return
+
+        if tags is not None and type(tags) is not NormalizedTags:
+            tags = tuple(tags)
+
+        row = (HISTOGRAM_BUCKET, name, (value, lower_bound, upper_bound, monotonic), tags, hostname, None, True)
+        self.extend([row])
+
+    def extend(self, rows):
+        """Buffer rows previously recorded with :py:meth:`start_recording`, flushing the batch once it is full."""
+        for row in rows:
+            self.rows.append(row)
+            if self._recordings:
+                for recording in self._recordings:
+                    recording.append(row)
+
+            if len(self.rows) >= self.size:
+                self.flush()
+
+    def start_recording(self):
+        """Keep a copy of every metric added to the batch until :py:meth:`stop_recording` is called.
+
+        :returns: the list the rows are recorded in, they can be added again to a batch with :py:meth:`extend`.
+        """
+        recording = []
+        self._recordings.append(recording)
+        return recording
+
+    def stop_recording(self, recording):
+        for i, current in enumerate(self._recordings):
+            if current is recording:
+                del self._recordings[i]
+                break
+
+    def flush(self):
+        if self.rows:
+            rows = self.rows
+            self.rows = []
+            self.check._submit_metric_rows(rows)
+
+    def __enter__(self):
+        # Nested batches are merged into the outermost one
+        if self.check._metric_batch is None:
+            self.check._metric_batch = self
+            self._active = True
+        return self.check._metric_batch
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._active:
+            self.check._metric_batch = None
+            self._active = False
+            self.flush()
+
 
 class __AgentCheck(object):
     """The base class for any Agent based integrations.
@@ -65,6 +195,16 @@ class __AgentCheck(object):
         sets of tags for other metric types. The first N sets of tags in submission order will
         be sent to the aggregator, the rest are dropped. The state is reset after each run.
         See https://github.com/DataDog/integrations-core/pull/2093 for more informations.
+    :cvar LIMIT_METRIC_CONTEXTS: counts the distinct sets of tags of all metric types towards
+        `DEFAULT_METRIC_LIMIT`, including gauges/rates/monotonic_counts, instead of one per call.
+        The sets of tags are estimated with a HyperLogLog of fixed size rather than an exact set,
+        and their number is submitted at the end of each run as `datadog.agent.check.metric_contexts`.
+        Can be overridden with the `limit_metric_contexts` option of the instance.
+    :cvar METRIC_NAME_CACHE_SIZE: memoizes up to this many names returned by `normalize` and
+        `convert_to_underscore_separated`, for checks normalizing the same few names on every run.
+        The least recently used names are evicted first. The size, hits, misses and evictions of
+        the cache are submitted at the end of each run as `datadog.agent.check.metric_name_cache.*`
+        when the `metric_name_cache_telemetry` option of the instance is enabled.
     :ivar log: is a logger instance that prints to the Agent's main log file. You can set the
         log level in the Agent config file 'datadog.yaml'.
     """
@@ -100,6 +240,11 @@ class __AgentCheck(object):
     METRIC_REPLACEMENT = re.compile(br'([^a-zA-Z0-9_.]+)|(^[^a-zA-Z]+)')
     DOT_UNDERSCORE_CLEANUP = re.compile(br'_*\._*')
     DEFAULT_METRIC_LIMIT = 0
+    LIMIT_METRIC_CONTEXTS = False
+    METRIC_NAME_CACHE_SIZE = 0
+
+    # Maximum number of metrics buffered by a batch before it is flushed to the aggregator
+    METRIC_BATCH_SIZE = 1000
 
     def __init__(self, *args, **kwargs):
         """In general, you don't need to and you should not override anything from the base
@@ -143,6 +288,16 @@ class __AgentCheck(object):
         self.agentConfig = kwargs.get('agentConfig', {})
         self.warnings = []
         self.metric_limiter = None
+        self._limit_metric_contexts = False
+
+        # Names returned by `normalize` and `convert_to_underscore_separated`, see `METRIC_NAME_CACHE_SIZE`
+        self._metric_name_cache = LRUCache(self.METRIC_NAME_CACHE_SIZE) if self.METRIC_NAME_CACHE_SIZE > 0 else None
+
+        # The batch metric submissions are buffered into, if any
+        self._metric_batch = None
+
+        # Times the phases of the current run when `profile_timing` is enabled, see `profile`
+        self._run_profiler = None
 
         if len(args) > 0:
             self.name = args[0]
@@ -227,10 +382,26 @@ class __AgentCheck(object):
                     'Setting max_returned_metrics to zero is not allowed, reverting to the default of %s metrics',
                     self.DEFAULT_METRIC_LIMIT,
                 )
+            limit_contexts = is_affirmative(self.instances[0].get('limit_metric_contexts', self.LIMIT_METRIC_CONTEXTS))
         except Exception:
             metric_limit = self.DEFAULT_METRIC_LIMIT
+            limit_contexts = self.LIMIT_METRIC_CONTEXTS
         if metric_limit > 0:
-            self.metric_limiter = Limiter(self.name, 'metrics', metric_limit, self.warning)
+            if limit_contexts:
+                self.metric_limiter = ContextLimiter(self.name, 'metrics', metric_limit, self.warning)
+                self._limit_metric_contexts = True
+            else:
+                self.metric_limiter = Limiter(self.name, 'metrics', metric_limit, self.warning)
+
+        # Only submit the stats of the metric name cache on demand, they are of no use to most users
+        self._metric_name_cache_telemetry = False
+        if self._metric_name_cache is not None:
+            try:
+                self._metric_name_cache_telemetry = is_affirmative(
+                    self.instances[0].get('metric_name_cache_telemetry', False)
+                )
+            except Exception:
+                pass
 
         # Functions that will be called exactly once (if successful) before the first check run
         self.check_initializations = deque([self.send_config_metadata])
@@ -245,7 +416,9 @@ class __AgentCheck(object):
     @property
     def http(self):
         if self._http is None:
-            self._http = RequestsWrapper(self.instance or {}, self.init_config, self.HTTP_CONFIG_REMAPPER, self.log)
+            self._http = RequestsWrapper(
+                self.instance or {}, self.init_config, self.HTTP_CONFIG_REMAPPER, self.log, profile=self.profile
+            )
 
         return self._http
 
@@ -292,7 +465,17 @@ class __AgentCheck(object):
     def _context_uid(self, mtype, name, tags=None, hostname=None):
         return '{}-{}-{}-{}'.format(mtype, name, tags if tags is None else hash(frozenset(tags)), hostname)
 
+    def _context_hash(self, mtype, name, tags=None, hostname=None):
+        return hash((mtype, name, None if tags is None else frozenset(tags), hostname))
+
     def submit_histogram_bucket(self, name, value, lower_bound, upper_bound, monotonic, hostname, tags):
+        if self._metric_batch is not None:
+            self._metric_batch.add_histogram_bucket(name, value, lower_bound, upper_bound, monotonic, hostname, tags)
+            return
+
+        self._submit_histogram_bucket(name, value, lower_bound, upper_bound, monotonic, hostname, tags)
+
+    def _submit_histogram_bucket(self, name, value, lower_bound, upper_bound, monotonic, hostname, tags):
         if value is None:
             # ignore metric sample
             return
@@ -322,12 +505,27 @@ class __AgentCheck(object):
             # ignore metric sample
             return
 
+        if self._metric_batch is not None:
+            self._metric_batch.add(name, value, tags, hostname, mtype=mtype, device_name=device_name, raw=raw)
+            return
+
+        metric = self._prepare_metric(mtype, name, value, tags, hostname, device_name, raw)
+        if metric is not None:
+            aggregator.submit_metric(self, self.check_id, *metric)
+
+    def _prepare_metric(self, mtype, name, value, tags, hostname, device_name, raw, formatted_name=None):
+        """
+        Normalize a metric before its submission, returns `None` if it must be dropped.
+        """
         tags = self._normalize_tags_type(tags, device_name, name)
         if hostname is None:
             hostname = ''
 
         if self.metric_limiter:
-            if mtype in ONE_PER_CONTEXT_METRIC_TYPES:
+            if self._limit_metric_contexts:
+                if self.metric_limiter.is_reached(self._context_hash(mtype, name, tags, hostname)):
+                    return
+            elif mtype in ONE_PER_CONTEXT_METRIC_TYPES:
                 # Fast path for gauges, rates, monotonic counters, assume one set of tags per call
                 if self.metric_limiter.is_reached():
                     return
@@ -348,7 +546,104 @@ class __AgentCheck(object):
             self.warning(err_msg)
             return
 
-        aggregator.submit_metric(self, self.check_id, mtype, self._format_namespace(name, raw), value, tags, hostname)
+        if formatted_name is None:
+            formatted_name = self._format_namespace(name, raw)
+
+        return mtype, formatted_name, value, tags, hostname
+
+    def _submit_metric_rows(self, rows):
+        """
+        Normalize buffered metrics and send them to the aggregator in a single call.
+
+        :param list rows: tuples of `(mtype, name, value, tags, hostname, device_name, raw)`
+        """
+        metrics = []
+        # Metric names are usually repeated many times in a batch
+        formatted_names = {}
+        for mtype, name, value, tags, hostname, device_name, raw in rows:
+            if mtype == HISTOGRAM_BUCKET:
+                self._submit_histogram_bucket(name, *value, hostname=hostname, tags=tags)
+                continue
+
+            try:
+                formatted_name = formatted_names[(name, raw)]
+            except KeyError:
+                formatted_name = formatted_names[(name, raw)] = self._format_namespace(name, raw)
+
+            metric = self._prepare_metric(mtype, name, value, tags, hostname, device_name, raw, formatted_name)
+            if metric is not None:
+                metrics.append(metric)
+
+        with self.profile('submit') as span:
+            span.count(len(metrics))
+            if BULK_SUBMISSION_SUPPORTED:
+                aggregator.submit_metrics(self, self.check_id, metrics)
+            else:
+                for metric in metrics:
+                    aggregator.submit_metric(self, self.check_id, *metric)
+
+    def submit_metrics_batch(self, mtype=None, rows=None, raw=False):
+        """Submit many metrics at once, amortizing their normalization and the calls to the aggregator.
+
+        When ``rows`` are passed they are submitted right away. The returned batch can also be used
+        as a context manager, in which case every metric submitted inside the block, including with
+        :py:meth:`gauge` and the like, is buffered and flushed in bulk. The output is the same as
+        submitting each metric individually.
+
+        .. code:: python
+
+            self.submit_metrics_batch(aggregator.GAUGE, [('foo', 1, ['tag:value'], None)])
+
+            with self.submit_metrics_batch(aggregator.GAUGE) as batch:
+                batch.add('foo', 1, tags=['tag:value'])
+                self.rate('bar', 2)
+
+        :param mtype: (optional) the aggregator metric type of the rows, e.g. :code:`aggregator.GAUGE`.
+        :param list rows: (optional) tuples of `(name, value, tags, hostname)`.
+        :param bool raw: (optional) whether to ignore any defined namespace prefix
+        :returns: a :py:class:`MetricBatch`
+        """
+        batch = MetricBatch(self, mtype=mtype, raw=raw, size=self.METRIC_BATCH_SIZE)
+        if rows is not None:
+            # Join the batch currently open, if any
+            with batch as current_batch:
+                for name, value, tags, hostname in rows:
+                    current_batch.add(name, value, tags, hostname, mtype=mtype, raw=raw)
+
+        return batch
+
+    def profile(self, phase):
+        """Time a phase of the check run, e.g. fetching or parsing a payload, when `profile_timing` is enabled.
+
+        .. code:: python
+
+            with self.profile('parse') as span:
+                for item in self.parse(payload):
+                    span.count()
+
+        The time spent in each phase, the number of times it was entered and the number of samples
+        counted are submitted at the end of the run as `datadog.agent.profile.timing.*` metrics,
+        tagged by `phase`. Nothing is timed when profiling is disabled.
+
+        :param str phase: the name of the phase.
+        :returns: a context manager whose ``count(samples=1)`` method records handled samples.
+        """
+        if self._run_profiler is None:
+            return NOOP_SPAN
+        return self._run_profiler.span(phase)
+
+    def profile_iter(self, phase, iterable, count=None):
+        """Time the production of the items of an iterable, e.g. a generator parsing a payload,
+        without the time spent consuming them, see :py:meth:`profile`.
+
+        :param str phase: the name of the phase.
+        :param iterable: the iterable to time.
+        :param count: (optional) a callable returning the number of samples of an item, defaults to one per item.
+        :returns: an iterable of the same items.
+        """
+        if self._run_profiler is None:
+            return iterable
+        return self._run_profiler.iterate(phase, iterable, count)
 
     def gauge(self, name, value, tags=None, hostname=None, device_name=None, raw=False):
         """Sample a gauge metric.
@@ -544,6 +839,20 @@ class __AgentCheck(object):
         Convert from CamelCase to camel_case
         And substitute illegal metric characters
         """
+        cache = self._metric_name_cache
+        if cache is None:
+            return self._convert_to_underscore_separated(name)
+
+        # A 1-tuple, so as not to collide with the keys of `normalize`
+        key = (name,)
+        metric_name = cache.get(key)
+        if metric_name is None:
+            metric_name = self._convert_to_underscore_separated(name)
+            cache.set(key, metric_name)
+
+        return metric_name
+
+    def _convert_to_underscore_separated(self, name):
         metric_name = self.FIRST_CAP_RE.sub(br'\1_\2', ensure_bytes(name))
         metric_name = self.ALL_CAP_RE.sub(br'\1_\2', metric_name).lower()
         metric_name = self.METRIC_REPLACEMENT.sub(br'_', metric_name)
@@ -609,13 +918,26 @@ class __AgentCheck(object):
         :param prefix A prefix to to add to the normalized name, default None
         :param fix_case A boolean, indicating whether to make sure that the metric name returned is in "snake_case"
         """
+        cache = self._metric_name_cache
+        if cache is None:
+            return self._normalize_metric_name(metric, prefix, fix_case)
+
+        key = (metric, prefix, fix_case)
+        name = cache.get(key)
+        if name is None:
+            name = self._normalize_metric_name(metric, prefix, fix_case)
+            cache.set(key, name)
+
+        return name
+
+    def _normalize_metric_name(self, metric, prefix, fix_case):
         if isinstance(metric, text_type):
             metric = unicodedata.normalize('NFKD', metric).encode('ascii', 'ignore')
 
         if fix_case:
-            name = self.convert_to_underscore_separated(metric)
+            name = self._convert_to_underscore_separated(metric)
             if prefix is not None:
-                prefix = self.convert_to_underscore_separated(prefix)
+                prefix = self._convert_to_underscore_separated(prefix)
         else:
             name = re.sub(br"[,\+\*\-/()\[\]{}\s]", b"_", metric)
         # Eliminate multiple _
@@ -635,6 +957,30 @@ class __AgentCheck(object):
     def check(self, instance):
         raise NotImplementedError
 
+    def _submit_metric_contexts(self):
+        # Bypass the limiter, the telemetry must be sent even when the limit is reached
+        tags = ['check_name:{}'.format(self.name), 'check_version:{}'.format(self.check_version)]
+        aggregator.submit_metric(
+            self, self.check_id, aggregator.GAUGE, METRIC_CONTEXTS_TELEMETRY, float(self.metric_limiter.count), tags, ''
+        )
+
+    def _submit_metric_name_cache_telemetry(self):
+        cache = self._metric_name_cache
+        if not (cache.hits or cache.misses):
+            return
+
+        tags = ['check_name:{}'.format(self.name), 'check_version:{}'.format(self.check_version)]
+        for stat, mtype, value in (
+            ('size', aggregator.GAUGE, len(cache)),
+            ('hits', aggregator.COUNT, cache.hits),
+            ('misses', aggregator.COUNT, cache.misses),
+            ('evictions', aggregator.COUNT, cache.evictions),
+        ):
+            aggregator.submit_metric(
+                self, self.check_id, mtype, '{}.{}'.format(METRIC_NAME_CACHE_TELEMETRY, stat), float(value), tags, ''
+            )
+        cache.reset_stats()
+
     def run(self):
         try:
             while self.check_initializations:
@@ -664,6 +1010,18 @@ class __AgentCheck(object):
                 tags.extend(instance.get('__memory_profiling_tags', []))
                 for m in metrics:
                     self.gauge(m.name, m.value, tags=tags, raw=True)
+            elif is_affirmative(self.init_config.get('profile_timing', False)):
+                self._run_profiler = RunProfiler()
+                try:
+                    with self.profile('check'):
+                        self.check(instance)
+                finally:
+                    profiler = self._run_profiler
+                    self._run_profiler = None
+
+                tags = ['check_name:{}'.format(self.name), 'check_version:{}'.format(self.check_version)]
+                for m in profiler.get_metrics():
+                    self.gauge(m.name, m.value, tags=tags + ['phase:{}'.format(m.phase)], raw=True)
             else:
                 self.check(instance)
 
@@ -672,7 +1030,11 @@ class __AgentCheck(object):
             result = json.dumps([{'message': str(e), 'traceback': traceback.format_exc()}])
         finally:
             if self.metric_limiter:
+                if self._limit_metric_contexts:
+                    self._submit_metric_contexts()
                 self.metric_limiter.reset()
+            if self._metric_name_cache_telemetry:
+                self._submit_metric_name_cache_telemetry()
 
         return result
 
@@ -737,6 +1099,9 @@ class __AgentCheckPy3(__AgentCheck):
         - normalize tags type
         - doesn't mutate the passed list, returns a new list
         """
+        if type(tags) is NormalizedTags and not device_name:
+            return list(tags)
+
         normalized_tags = []
 
         if device_name:
@@ -799,6 +1164,9 @@ class __AgentCheckPy2(__AgentCheck):
         - normalize tags type
         - doesn't mutate the passed list, returns a new list
         """
+        if type(tags) is NormalizedTags and not device_name:
+            return list(tags)
+
         normalized_tags = []
 
         if device_name:
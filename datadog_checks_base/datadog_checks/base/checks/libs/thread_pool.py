@@ -485,6 +485,8 @@ class CollectorIterator(object):
         assert apply_result.ready()
         return apply_result.get(0)
 
+    __next__ = next
+
 
 class UnorderedResultCollector(AbstractResultCollector):
     """An AbstractResultCollector implementation that collects the
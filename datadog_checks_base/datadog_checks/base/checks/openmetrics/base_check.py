@@ -3,6 +3,7 @@
 # Licensed under a 3-clause BSD style license (see LICENSE)
 from ...errors import CheckException
 from .. import AgentCheck
+from ..libs.thread_pool import Pool
 from .mixins import OpenMetricsScraperMixin
 
 
@@ -20,6 +21,10 @@ class OpenMetricsBaseCheck(OpenMetricsScraperMixin, AgentCheck):
             - bar
             - foo
 
+    Several endpoints sharing the same settings can be listed with `prometheus_urls` instead of
+    `prometheus_url`. They are requested concurrently by up to `concurrent_scrapes` worker threads
+    and each payload is parsed and submitted as soon as it is received.
+
 
     Agent 5 signature:
 
@@ -33,6 +38,7 @@ class OpenMetricsBaseCheck(OpenMetricsScraperMixin, AgentCheck):
     """
 
     DEFAULT_METRIC_LIMIT = 2000
+    DEFAULT_CONCURRENT_SCRAPES = 4
 
     def __init__(self, *args, **kwargs):
         args = list(args)
@@ -67,19 +73,103 @@ class OpenMetricsBaseCheck(OpenMetricsScraperMixin, AgentCheck):
 
         if instances is not None:
             for instance in instances:
-                self.get_scraper_config(instance)
+                self.get_scraper_configs(instance)
 
     def check(self, instance):
-        # Get the configuration for this specific instance
-        scraper_config = self.get_scraper_config(instance)
+        # Get the configurations for this specific instance
+        scraper_configs = self.get_scraper_configs(instance)
 
         # We should be specifying metrics for checks that are vanilla OpenMetricsBaseCheck-based
-        if not scraper_config['metrics_mapper']:
+        for scraper_config in scraper_configs:
+            if not scraper_config['metrics_mapper']:
+                raise CheckException(
+                    "You have to collect at least one metric from the endpoint: {}".format(
+                        scraper_config['prometheus_url']
+                    )
+                )
+
+        if len(scraper_configs) == 1:
+            self.process(scraper_configs[0])
+            return
+
+        errors = self._process_endpoints(instance, scraper_configs)
+        self._raise_for_scrape_errors(errors, scraper_configs)
+
+    def _process_endpoints(self, instance, scraper_configs, metric_transformers=None):
+        """
+        Process several endpoints, concurrently unless `concurrent_scrapes` is 1.
+        A failing endpoint doesn't prevent the others from being processed.
+
+        :return: list of (endpoint, exception) for the endpoints that could not be processed
+        """
+        concurrent_scrapes = int(instance.get('concurrent_scrapes', self.DEFAULT_CONCURRENT_SCRAPES))
+        if concurrent_scrapes > 1:
+            return self._process_concurrently(scraper_configs, concurrent_scrapes, metric_transformers)
+
+        errors = []
+        for scraper_config in scraper_configs:
+            error = self._process_endpoint(scraper_config, metric_transformers=metric_transformers)
+            if error is not None:
+                errors.append(error)
+
+        return errors
+
+    def _raise_for_scrape_errors(self, errors, scraper_configs):
+        if errors:
             raise CheckException(
-                "You have to collect at least one metric from the endpoint: {}".format(scraper_config['prometheus_url'])
+                'Unable to scrape {} of {} endpoints: {}'.format(
+                    len(errors), len(scraper_configs), ', '.join('{} ({})'.format(*error) for error in errors)
+                )
             )
 
-        self.process(scraper_config)
+    def _process_concurrently(self, scraper_configs, concurrent_scrapes, metric_transformers=None):
+        """
+        Request the endpoints from a bounded pool of worker threads, and parse and submit
+        each payload from the check's thread as soon as it is received.
+
+        :return: list of (endpoint, exception) for the endpoints that could not be processed
+        """
+        errors = []
+        pool = Pool(min(concurrent_scrapes, len(scraper_configs)), name='{}-scrapes'.format(self.name))
+        try:
+            for scraper_config in pool.imap_unordered(self.prefetch_response, scraper_configs):
+                error = self._process_endpoint(scraper_config, metric_transformers=metric_transformers)
+                if error is not None:
+                    errors.append(error)
+        finally:
+            pool.terminate()
+            # Don't let a payload that wasn't processed be used by the next run
+            for scraper_config in scraper_configs:
+                scraper_config['_prefetched_response'] = None
+
+        return errors
+
+    def _process_endpoint(self, scraper_config, metric_transformers=None):
+        """
+        :return: (endpoint, exception) if the endpoint could not be processed, None otherwise
+        """
+        try:
+            self.process(scraper_config, metric_transformers=metric_transformers)
+        except Exception as e:
+            self.log.warning('Unable to scrape endpoint %s: %s', scraper_config['prometheus_url'], e)
+            return scraper_config['prometheus_url'], e
+
+    def get_scraper_configs(self, instance):
+        """
+        Return the scraper configurations of the instance, one for each endpoint of `prometheus_urls`
+        if set, the one for `prometheus_url` otherwise.
+        """
+        endpoints = instance.get('prometheus_urls')
+        if not endpoints:
+            return [self.get_scraper_config(instance)]
+
+        scraper_configs = []
+        for endpoint in endpoints:
+            endpoint_instance = dict(instance, prometheus_url=endpoint)
+            endpoint_instance.pop('prometheus_urls')
+            scraper_configs.append(self.get_scraper_config(endpoint_instance))
+
+        return scraper_configs
 
     def get_scraper_config(self, instance):
         endpoint = instance.get('prometheus_url')
@@ -98,16 +188,3 @@ class OpenMetricsBaseCheck(OpenMetricsScraperMixin, AgentCheck):
         self.config_map[endpoint] = config
 
         return config
-
-    def _finalize_tags_to_submit(self, _tags, metric_name, val, metric, custom_tags=None, hostname=None):
-        """
-        Format the finalized tags
-        This is generally a noop, but it can be used to change the tags before sending metrics
-        """
-        return _tags
-
-    def _filter_metric(self, metric, scraper_config):
-        """
-        Used to filter metrics at the begining of the processing, by default no metric is filtered
-        """
-        return False
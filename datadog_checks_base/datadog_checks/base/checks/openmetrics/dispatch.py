@@ -0,0 +1,82 @@
+# (C) Datadog, Inc. 2019
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+from collections import namedtuple
+from fnmatch import fnmatchcase
+
+from six import iteritems
+
+# How `process_metric` routes a metric family:
+# - ignored: whether the family is in `ignore_metrics`
+# - mapped_name: the name from `metrics_mapper`, if any
+# - transformer: the function from the metric transformers, if any
+# - wildcard: whether the family matches a wildcard of `metrics_mapper`
+MetricDispatch = namedtuple('MetricDispatch', ('ignored', 'mapped_name', 'transformer', 'wildcard'))
+
+
+class MetricDispatchPlan(object):
+    """
+    Memoizes the routing decision of `process_metric` for each metric family name.
+
+    The decisions are computed the first time a name is seen and are only discarded when
+    the `metrics_mapper`, `ignore_metrics` or metric transformers they were based on change,
+    even in place. Their content is compared once per scrape, see `validate`, and at every
+    call outside of a scrape.
+    """
+
+    __slots__ = ('_entries', '_fingerprint', '_transformers')
+
+    def __init__(self):
+        self._entries = {}
+        # The configuration the entries were computed from
+        self._fingerprint = None
+        # The metric transformers the fingerprint was last checked with
+        self._transformers = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, name, scraper_config, metric_transformers=None):
+        if not scraper_config['_dispatch_plan_validated'] or metric_transformers is not self._transformers:
+            self.validate(scraper_config, metric_transformers)
+
+        try:
+            return self._entries[name]
+        except KeyError:
+            dispatch = self._entries[name] = self._compute(name, scraper_config, metric_transformers)
+            return dispatch
+
+    def validate(self, scraper_config, metric_transformers=None):
+        """
+        Discard the decisions if the configuration they were computed from changed since the last call.
+        """
+        metrics_mapper = scraper_config['metrics_mapper']
+        ignore_metrics = scraper_config['ignore_metrics']
+
+        fingerprint = (
+            frozenset(iteritems(metrics_mapper)),
+            frozenset(ignore_metrics),
+            frozenset(iteritems(metric_transformers)) if metric_transformers else frozenset(),
+        )
+        if fingerprint != self._fingerprint:
+            self._entries.clear()
+            self._fingerprint = fingerprint
+            scraper_config['_metrics_wildcards'] = [x for x in metrics_mapper if '*' in x]
+
+        self._transformers = metric_transformers
+
+    @staticmethod
+    def _compute(name, scraper_config, metric_transformers):
+        if name in scraper_config['ignore_metrics']:
+            return MetricDispatch(True, None, None, False)
+
+        mapped_name = scraper_config['metrics_mapper'].get(name)
+        transformer = metric_transformers.get(name) if metric_transformers else None
+
+        wildcard = False
+        for pattern in scraper_config['_metrics_wildcards']:
+            if fnmatchcase(name, pattern):
+                wildcard = True
+                break
+
+        return MetricDispatch(False, mapped_name, transformer, wildcard)
@@ -0,0 +1,82 @@
+# (C) Datadog, Inc. 2019
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+from six import iteritems
+
+
+class LabelJoinIndex(object):
+    """
+    Index of the labels to add to the samples carrying a given label value, for `label_joins`.
+
+    Every entry records the generation, i.e. the scrape, it was last stored or looked up in.
+    Entries that were neither stored nor looked up during a scrape are removed by `collect`.
+    """
+
+    __slots__ = ('generation', 'mapping', '_generations')
+
+    def __init__(self):
+        self.generation = 0
+        # The labels to add by watched label name and value, example:
+        # {
+        #     'pod': {
+        #         'dd-agent-9s1l1': {'node': 'yolo', 'host_ip': 'yey'}
+        #     }
+        # }
+        self.mapping = {}
+        # The generation of each entry of `mapping`, by watched label name and value
+        self._generations = {}
+
+    def __len__(self):
+        return sum(len(values) for values in self.mapping.values())
+
+    def store(self, label_name, label_value, labels):
+        """
+        Add labels to the samples whose `label_name` label is `label_value`.
+        """
+        try:
+            values = self.mapping[label_name]
+        except KeyError:
+            values = self.mapping[label_name] = {}
+            self._generations[label_name] = {}
+
+        try:
+            values[label_value].update(labels)
+        except KeyError:
+            values[label_value] = labels
+
+        self._generations[label_name][label_value] = self.generation
+
+    def join(self, sample_labels, watched_labels):
+        """
+        Add the stored labels to the labels of a sample.
+
+        :param sample_labels: the labels of the sample, modified in place
+        :param watched_labels: the names of the labels that can be joined on
+        """
+        for label_name in watched_labels:
+            label_value = sample_labels.get(label_name)
+            if label_value is None:
+                continue
+
+            try:
+                labels = self.mapping[label_name][label_value]
+            except KeyError:
+                continue
+
+            self._generations[label_name][label_value] = self.generation
+            sample_labels.update(labels)
+
+    def collect(self):
+        """
+        Remove the entries unused since the last call, and start a new generation.
+        """
+        generation = self.generation
+        for label_name, generations in iteritems(self._generations):
+            stale_values = [value for value, last_used in iteritems(generations) if last_used != generation]
+            if stale_values:
+                values = self.mapping[label_name]
+                for value in stale_values:
+                    del values[value]
+                    del generations[value]
+
+        self.generation += 1
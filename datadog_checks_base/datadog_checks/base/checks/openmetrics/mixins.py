@@ -2,24 +2,62 @@
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
 
-from fnmatch import fnmatchcase
+import hashlib
+import sys
+from collections import namedtuple
 from math import isinf, isnan
 from os.path import isfile
+from time import time
 
 import requests
+from google.protobuf.message import DecodeError
 from prometheus_client.parser import text_fd_to_metric_families
-from six import PY3, iteritems, itervalues, string_types
+from requests.utils import stream_decode_response_unicode
+from six import PY3, get_unbound_function, iteritems, itervalues, reraise, string_types
 from urllib3 import disable_warnings
-from urllib3.exceptions import InsecureRequestWarning
+from urllib3.exceptions import InsecureRequestWarning, ProtocolError
 
 from ...config import is_affirmative
 from ...errors import CheckException
-from ...utils.common import to_string
+from ...utils.cache import LRUCache
+from ...utils.common import ensure_bytes, to_string
+from ...utils.http import ConnectionStats, PooledHTTPAdapter
+from ...utils.tagging import NormalizedTags
 from .. import AgentCheck
+from .dispatch import MetricDispatchPlan
+from .label_joins import LabelJoinIndex
+from .parser import iter_chunk_lines, text_lines_to_metric_families
+from .protobuf_parser import protobuf_chunks_to_metric_families
 
 if PY3:
     long = int
 
+# The submissions computed from a payload, see `replay_unchanged_payloads`:
+# - etag, last_modified: the validators sent by the server, if any
+# - digest: the hash of the payload
+# - rows: the metrics submitted while processing the payload, as recorded by `MetricBatch`
+# - timestamp: when the payload was processed
+CachedPayload = namedtuple('CachedPayload', ('etag', 'last_modified', 'digest', 'rows', 'timestamp'))
+
+
+def _count_samples(metric):
+    return len(metric.samples)
+
+
+def _is_dropped_connection_error(error):
+    """
+    Whether a request failed because its connection was closed by the endpoint, rather than
+    because a new connection could not be established: requests raises the `ProtocolError`
+    of urllib3 as is in the first case, and wraps the error in a `MaxRetryError` otherwise.
+    """
+    return bool(error.args) and isinstance(error.args[0], ProtocolError)
+
+
+def _hash_chunks(chunks, payload_hash):
+    for chunk in chunks:
+        payload_hash.update(chunk)
+        yield chunk
+
 
 class OpenMetricsScraperMixin(object):
     # pylint: disable=E1101
@@ -39,9 +77,35 @@ class OpenMetricsScraperMixin(object):
     TELEMETRY_COUNTER_METRICS_INPUT_COUNT = "metrics.input.count"
     TELEMETRY_COUNTER_METRICS_IGNORE_COUNT = "metrics.ignored.count"
     TELEMETRY_COUNTER_METRICS_PROCESS_COUNT = "metrics.processed.count"
+    TELEMETRY_GAUGE_TAGS_CACHE_SIZE = "tags.cache.size"
+    TELEMETRY_COUNTER_TAGS_CACHE_HITS = "tags.cache.hits"
+    TELEMETRY_COUNTER_TAGS_CACHE_MISSES = "tags.cache.misses"
+    TELEMETRY_COUNTER_TAGS_CACHE_EVICTIONS = "tags.cache.evictions"
+    TELEMETRY_COUNTER_CONNECTIONS_OPENED = "connections.opened.count"
+    TELEMETRY_GAUGE_CONNECTIONS_REUSE_RATIO = "connections.reuse.ratio"
+    TELEMETRY_GAUGE_CONNECTIONS_HANDSHAKE_TIME = "connections.handshake.time"
+    TELEMETRY_COUNTER_PAYLOAD_REPLAYED = "payload.replayed.count"
+    TELEMETRY_GAUGE_TAGGER_CACHE_HIT_RATIO = "tagger.cache.hit_ratio"
+    TELEMETRY_COUNTER_TAGGER_CACHE_HITS = "tagger.cache.hits"
+    TELEMETRY_COUNTER_TAGGER_CACHE_MISSES = "tagger.cache.misses"
+
+    DEFAULT_LABEL_TAGS_CACHE_SIZE = 10000
+    DEFAULT_CONNECTION_POOL_SIZE = 10
+    DEFAULT_CONNECTION_IDLE_TIMEOUT = 60
+    DEFAULT_PAYLOAD_CACHE_MAX_AGE = 300
 
     METRIC_TYPES = ['counter', 'gauge', 'summary', 'histogram']
 
+    PROTOBUF_CONTENT_TYPE = 'application/vnd.google.protobuf'
+    # Prefer the protobuf format, the text format is used by endpoints that don't support it
+    PROTOBUF_ACCEPT_HEADER = (
+        'application/vnd.google.protobuf;proto=io.prometheus.client.MetricFamily;encoding=delimited;q=0.7,'
+        'text/plain;version=0.0.4;q=0.3,*/*;q=0.1'
+    )
+    # Number of successful scrapes in the text format before the protobuf format is requested again,
+    # after a protobuf payload could not be decoded
+    PROTOBUF_FORMAT_RETRY_RUNS = 100
+
     KUBERNETES_TOKEN_PATH = '/var/run/secrets/kubernetes.io/serviceaccount/token'
 
     def __init__(self, *args, **kwargs):
@@ -98,6 +162,11 @@ class OpenMetricsScraperMixin(object):
         # `_metrics_wildcards` holds the potential wildcards to match for metrics
         config['_metrics_wildcards'] = None
 
+        # `_dispatch_plan` memoizes how each metric family name is handled by `process_metric`
+        config['_dispatch_plan'] = MetricDispatchPlan()
+        # Set during a scrape, the plan is only validated against the configuration once per scrape
+        config['_dispatch_plan_validated'] = False
+
         # `prometheus_metrics_prefix` allows to specify a prefix that all
         # prometheus metrics should have. This can be used when the prometheus
         # endpoint we are scrapping allows to add a custom prefix to it's
@@ -117,27 +186,22 @@ class OpenMetricsScraperMixin(object):
         config['label_joins'] = default_instance.get('label_joins', {})
         config['label_joins'].update(instance.get('label_joins', {}))
 
-        # `_label_mapping` holds the additionals label info to add for a specific
-        # label value, example:
+        # `_label_join_index` holds the additionals label info to add for a specific
+        # label value, see `LabelJoinIndex`
+        config['_label_join_index'] = LabelJoinIndex()
+        # `_label_mapping` is the mapping of the index, example:
         # self._label_mapping = {
         #     'pod': {
-        #         'dd-agent-9s1l1': [("node","yolo"),("host_ip","yey")]
+        #         'dd-agent-9s1l1': {"node": "yolo", "host_ip": "yey"}
         #     }
         # }
-        config['_label_mapping'] = {}
-
-        # `_active_label_mapping` holds a dictionary of label values found during the run
-        # to cleanup the label_mapping of unused values, example:
-        # self._active_label_mapping = {
-        #     'pod': {
-        #         'dd-agent-9s1l1': True
-        #     }
-        # }
-        config['_active_label_mapping'] = {}
+        config['_label_mapping'] = config['_label_join_index'].mapping
 
         # `_watched_labels` holds the list of label to watch for enrichment
         config['_watched_labels'] = set()
 
+        # Until the index is filled by a first run, the label joins sources are only stored
+        # as they might be found after the metrics they apply to
         config['_dry_run'] = True
 
         # Some metrics are ignored because they are duplicates or introduce a
@@ -239,6 +303,64 @@ class OpenMetricsScraperMixin(object):
             'prometheus_timeout', default_instance.get('prometheus_timeout', 10)
         )
 
+        # Maximum time in seconds to fetch the whole payload when endpoints are scraped concurrently,
+        # so that an endpoint trickling its response cannot hold a worker past the end of the run
+        config['scrape_deadline'] = float(
+            instance.get('scrape_deadline', default_instance.get('scrape_deadline', config['prometheus_timeout']))
+        )
+
+        # Whether or not to keep the connections to the endpoint open between runs
+        config['persist_connections'] = is_affirmative(
+            instance.get('persist_connections', default_instance.get('persist_connections', False))
+        )
+
+        # Maximum number of connections kept open per host
+        config['connection_pool_size'] = int(
+            instance.get(
+                'connection_pool_size', default_instance.get('connection_pool_size', self.DEFAULT_CONNECTION_POOL_SIZE)
+            )
+        )
+
+        # Connections that haven't been used for that many seconds are closed instead of being reused
+        config['connection_idle_timeout'] = float(
+            instance.get(
+                'connection_idle_timeout',
+                default_instance.get('connection_idle_timeout', self.DEFAULT_CONNECTION_IDLE_TIMEOUT),
+            )
+        )
+
+        # The session holding the connections when `persist_connections` is enabled, and when it was last used
+        config['_session'] = None
+        config['_session_last_used'] = None
+        config['_connection_stats'] = ConnectionStats()
+        # Set when the session is used by several threads: it's then only created or replaced by `_get_session`,
+        # to be called by the check before sharing it, never by `send_request`
+        config['_shared_session'] = False
+
+        # Whether or not to replay the submissions of the previous run instead of processing the payload again
+        # when it is unchanged, as told by a conditional request or by its hash. Only the metrics submitted
+        # while processing the payload are replayed, histogram buckets included, not the service checks or metadata.
+        config['replay_unchanged_payloads'] = is_affirmative(
+            instance.get('replay_unchanged_payloads', default_instance.get('replay_unchanged_payloads', False))
+        )
+
+        # Maximum age in seconds of the replayed submissions, the payload is processed again past it
+        config['payload_cache_max_age'] = float(
+            instance.get(
+                'payload_cache_max_age',
+                default_instance.get('payload_cache_max_age', self.DEFAULT_PAYLOAD_CACHE_MAX_AGE),
+            )
+        )
+
+        # `_payload_cache` holds the `CachedPayload` of the last processed payload
+        config['_payload_cache'] = None
+        # Whether the last processed payload was the same as the one before. The payload is then read
+        # in memory to be hashed before being parsed, otherwise it is hashed as it is parsed.
+        config['_payload_unchanged'] = False
+
+        # `_prefetched_response` holds the outcome of a request made ahead of `poll` by `prefetch_response`
+        config['_prefetched_response'] = None
+
         # Authentication used when polling endpoint
         config['username'] = instance.get('username', default_instance.get('username', None))
         config['password'] = instance.get('password', default_instance.get('password', None))
@@ -249,11 +371,54 @@ class OpenMetricsScraperMixin(object):
         # Additional tags to be sent with each metric
         config['_metric_tags'] = []
 
+        # Maximum number of label sets whose rendered tags are kept between samples and runs,
+        # the least recently used ones are evicted first. Set to 0 to disable the cache.
+        config['label_tags_cache_size'] = int(
+            instance.get(
+                'label_tags_cache_size',
+                default_instance.get('label_tags_cache_size', self.DEFAULT_LABEL_TAGS_CACHE_SIZE),
+            )
+        )
+
+        # `_label_tags_cache` maps frozen label items to the tuple of all the tags of a sample with these labels
+        config['_label_tags_cache'] = (
+            LRUCache(config['label_tags_cache_size']) if config['label_tags_cache_size'] > 0 else None
+        )
+        # The `exclude_labels`, `labels_mapper`, `custom_tags` and `_metric_tags` the cached tags were rendered with
+        config['_label_tags_cache_fingerprint'] = None
+        # `custom_tags` and `_metric_tags`, normalized, at the start of all the cached tags
+        config['_constant_tags'] = ()
+        # Set during a scrape, the settings above are only compared to the fingerprint once per scrape
+        config['_label_tags_cache_validated'] = False
+        # Tags are only passed as a list to the checks that override `_finalize_tags_to_submit`
+        config['_finalize_tags_overridden'] = get_unbound_function(
+            type(self)._finalize_tags_to_submit
+        ) is not get_unbound_function(OpenMetricsScraperMixin._finalize_tags_to_submit)
+
         # List of strings to filter the input text payload on. If any line contains
         # one of these strings, it will be filtered out before being parsed.
         # INTERNAL FEATURE, might be removed in future versions
         config['_text_filter_blacklist'] = []
 
+        # Whether or not to parse text payloads with the built-in streaming parser instead of
+        # `prometheus_client`. It works on raw bytes and skips the metric families that would
+        # not be submitted anyway, without parsing their samples.
+        config['use_streaming_parser'] = is_affirmative(
+            instance.get('use_streaming_parser', default_instance.get('use_streaming_parser', False))
+        )
+
+        # Whether or not to ask the endpoint for the protobuf format, which is cheaper to parse. The text
+        # format is still parsed when the endpoint doesn't support it. The metric families that would not
+        # be submitted are skipped without being parsed, as with the streaming parser.
+        config['use_protobuf_format'] = is_affirmative(
+            instance.get('use_protobuf_format', default_instance.get('use_protobuf_format', False))
+        )
+
+        # Set when the protobuf payload of the endpoint could not be decoded, the text format is requested instead
+        # for the next `PROTOBUF_FORMAT_RETRY_RUNS` successful scrapes, counted in `_text_format_runs`
+        config['_protobuf_format_failed'] = False
+        config['_text_format_runs'] = 0
+
         # Whether or not to use the service account bearer token for authentication
         # if 'bearer_token_path' is not set, we use /var/run/secrets/kubernetes.io/serviceaccount/token
         # as a default path to get the token.
@@ -287,18 +452,25 @@ class OpenMetricsScraperMixin(object):
 
         return config
 
-    def parse_metric_family(self, response, scraper_config):
+    def parse_metric_family(self, response, scraper_config, metric_transformers=None):
         """
         Parse the MetricFamily from a valid requests.Response object to provide a MetricFamily object (see [0])
         The text format uses iter_lines() generator.
+
+        When the streaming parser or the protobuf format is enabled and `metric_transformers` is passed,
+        metric families that `process_metric` would not submit are skipped without parsing their samples.
         :param response: requests.Response
+        :param metric_transformers: the transformers `process_metric` will be called with, if any
         :return: core.Metric
         """
-        input_gen = response.iter_lines(chunk_size=self.REQUESTS_CHUNK_SIZE, decode_unicode=True)
-        if scraper_config['_text_filter_blacklist']:
-            input_gen = self._text_filter_input(input_gen, scraper_config)
+        if scraper_config['use_protobuf_format'] and self.PROTOBUF_CONTENT_TYPE in response.headers.get(
+            'Content-Type', ''
+        ):
+            metric_families = self._parse_metric_family_protobuf(response, scraper_config, metric_transformers)
+        else:
+            metric_families = self._parse_metric_family_text(response, scraper_config, metric_transformers)
 
-        for metric in text_fd_to_metric_families(input_gen):
+        for metric in metric_families:
             self._send_telemetry_counter(
                 self.TELEMETRY_COUNTER_METRICS_INPUT_COUNT, len(metric.samples), scraper_config
             )
@@ -308,16 +480,151 @@ class OpenMetricsScraperMixin(object):
             metric.name = self._remove_metric_prefix(metric.name, scraper_config)
             yield metric
 
-    def _text_filter_input(self, input_gen, scraper_config):
+    def _parse_metric_family_text(self, response, scraper_config, metric_transformers=None):
+        """
+        Parse the text payload, see `parse_metric_family`.
+        """
+        if scraper_config['use_streaming_parser']:
+            return self._parse_metric_family_stream(response, scraper_config, metric_transformers)
+
+        input_gen = response.iter_lines(chunk_size=self.REQUESTS_CHUNK_SIZE, decode_unicode=True)
+        if scraper_config['_text_filter_blacklist']:
+            input_gen = self._text_filter_input(input_gen, scraper_config)
+
+        return text_fd_to_metric_families(input_gen)
+
+    def _parse_metric_family_stream(self, response, scraper_config, metric_transformers=None):
+        """
+        Parse the text payload with the streaming parser, see `parse_metric_family`.
+        """
+        input_gen = iter_chunk_lines(response.iter_content(chunk_size=self.REQUESTS_CHUNK_SIZE))
+        if scraper_config['_text_filter_blacklist']:
+            input_gen = self._text_filter_input(input_gen, scraper_config, binary=True)
+
+        family_filter, on_skipped_family = self._get_metric_family_filter(scraper_config, metric_transformers)
+        return text_lines_to_metric_families(input_gen, family_filter, on_skipped_family)
+
+    def _parse_metric_family_protobuf(self, response, scraper_config, metric_transformers=None):
+        """
+        Parse the protobuf payload, see `parse_metric_family`. The `_text_filter_blacklist` is matched
+        against the name and labels of each metric, as rendered in the text format.
+        """
+        family_filter, on_skipped_family = self._get_metric_family_filter(scraper_config, metric_transformers)
+
+        blacklist = scraper_config['_text_filter_blacklist']
+        metric_families = protobuf_chunks_to_metric_families(
+            response.iter_content(chunk_size=self.REQUESTS_CHUNK_SIZE),
+            family_filter,
+            on_skipped_family,
+            blacklist,
+            self._get_on_blacklisted(scraper_config) if blacklist else None,
+        )
+
+        parsed_families = set()
+        try:
+            for metric in metric_families:
+                parsed_families.add(metric.name)
+                yield metric
+        except DecodeError:
+            self.log.warning(
+                'Unable to decode the protobuf payload of %s, requesting the text format for the next %s runs',
+                scraper_config['prometheus_url'],
+                self.PROTOBUF_FORMAT_RETRY_RUNS,
+            )
+            scraper_config['_protobuf_format_failed'] = True
+            scraper_config['_text_format_runs'] = 0
+        else:
+            return
+
+        # The retry must not be answered with a conditional response about the protobuf payload
+        scraper_config['_payload_cache'] = None
+        response = self.poll(scraper_config)
+        try:
+            for metric in self._parse_metric_family_text(response, scraper_config, metric_transformers):
+                # The families parsed before the error were already processed
+                if metric.name not in parsed_families:
+                    yield metric
+        finally:
+            response.close()
+
+    def _get_on_blacklisted(self, scraper_config):
+        """
+        Return the callback counting the samples filtered out by the `_text_filter_blacklist` of the protobuf parser.
+        """
+        if not scraper_config['telemetry']:
+            return None
+
+        def on_blacklisted(sample_count):
+            self._send_telemetry_counter(self.TELEMETRY_COUNTER_METRICS_BLACKLIST_COUNT, sample_count, scraper_config)
+
+        return on_blacklisted
+
+    def _get_metric_family_filter(self, scraper_config, metric_transformers=None):
+        """
+        Return the `family_filter` and `on_skipped_family` callbacks of the streaming parsers.
+        """
+        # Without transformers we don't know how the metrics will be handled, so everything is parsed
+        if metric_transformers is None:
+            return None, None
+
+        def family_filter(name, metric_type):
+            return self._should_parse_metric_family(name, metric_type, scraper_config, metric_transformers)
+
+        if not scraper_config['telemetry']:
+            return family_filter, None
+
+        def on_skipped_family(name, metric_type, sample_count):
+            self._send_skipped_metric_family_telemetry(name, metric_type, sample_count, scraper_config)
+
+        return family_filter, on_skipped_family
+
+    def _should_parse_metric_family(self, name, metric_type, scraper_config, metric_transformers):
+        """
+        Whether or not `process_metric` could submit anything for the given metric family.
+        `name` and `metric_type` are the ones found in the payload.
+        """
+        if scraper_config['type_overrides'].get(name, metric_type) not in self.METRIC_TYPES:
+            return False
+
+        name = self._remove_metric_prefix(name, scraper_config)
+
+        # Label joins sources must always be processed
+        if name in scraper_config['label_joins']:
+            return True
+
+        dispatch = scraper_config['_dispatch_plan'].get(name, scraper_config, metric_transformers)
+        return not dispatch.ignored and (
+            dispatch.mapped_name is not None or dispatch.transformer is not None or dispatch.wildcard
+        )
+
+    def _send_skipped_metric_family_telemetry(self, name, metric_type, sample_count, scraper_config):
+        """
+        Send the telemetry `parse_metric_family` and `process_metric` would have sent for a skipped metric family.
+        """
+        self._send_telemetry_counter(self.TELEMETRY_COUNTER_METRICS_INPUT_COUNT, sample_count, scraper_config)
+        if scraper_config['type_overrides'].get(name, metric_type) not in self.METRIC_TYPES:
+            return
+
+        if self._remove_metric_prefix(name, scraper_config) in scraper_config['ignore_metrics']:
+            self._send_telemetry_counter(self.TELEMETRY_COUNTER_METRICS_IGNORE_COUNT, sample_count, scraper_config)
+        else:
+            self._send_telemetry_counter(self.TELEMETRY_COUNTER_METRICS_PROCESS_COUNT, sample_count, scraper_config)
+
+    def _text_filter_input(self, input_gen, scraper_config, binary=False):
         """
         Filters out the text input line by line to avoid parsing and processing
         metrics we know we don't want to process. This only works on `text/plain`
         payloads, and is an INTERNAL FEATURE implemented for the kubelet check
         :param input_get: line generator
+        :param binary: whether or not the lines are bytes
         :output: generator of filtered lines
         """
+        blacklist = scraper_config['_text_filter_blacklist']
+        if binary:
+            blacklist = [ensure_bytes(item) for item in blacklist]
+
         for line in input_gen:
-            for item in scraper_config['_text_filter_blacklist']:
+            for item in blacklist:
                 if item in line:
                     self._send_telemetry_counter(self.TELEMETRY_COUNTER_METRICS_BLACKLIST_COUNT, 1, scraper_config)
                     break
@@ -329,17 +636,19 @@ class OpenMetricsScraperMixin(object):
         prometheus_metrics_prefix = scraper_config['prometheus_metrics_prefix']
         return metric[len(prometheus_metrics_prefix) :] if metric.startswith(prometheus_metrics_prefix) else metric
 
-    def scrape_metrics(self, scraper_config):
+    def scrape_metrics(self, scraper_config, metric_transformers=None):
         """
         Poll the data from prometheus and return the metrics as a generator.
         """
-        response = self.poll(scraper_config)
+        with self.profile('openmetrics.fetch'):
+            response = self.poll(scraper_config)
         if scraper_config['telemetry']:
             if 'content-length' in response.headers:
                 content_len = int(response.headers['content-length'])
             else:
                 content_len = len(response.content)
             self._send_telemetry_gauge(self.TELEMETRY_GAUGE_MESSAGE_SIZE, content_len, scraper_config)
+            self._send_connection_telemetry(scraper_config)
         try:
             # no dry run if no label joins
             if not scraper_config['label_joins']:
@@ -349,20 +658,120 @@ class OpenMetricsScraperMixin(object):
                 for val in itervalues(scraper_config['label_joins']):
                     scraper_config['_watched_labels'].add(val['label_to_match'])
 
-            for metric in self.parse_metric_family(response, scraper_config):
-                yield metric
+            # The submissions can only be recorded when they are buffered
+            batch = self._metric_batch if scraper_config['replay_unchanged_payloads'] else None
+            recording = digest = payload_hash = None
+            if batch is not None:
+                # Unchanged payloads are expected to stay so, don't parse them before knowing
+                if scraper_config['_payload_unchanged']:
+                    digest = self._get_payload_digest(response)
+                if self._replay_cached_payload(response, digest, batch, scraper_config):
+                    return
+
+                # Submissions of a dry run are not representative of the next runs
+                if not scraper_config['_dry_run']:
+                    recording = batch.start_recording()
+                    if digest is None:
+                        payload_hash = self._hash_payload_stream(response)
+
+            # The tags rendering settings might have been changed in place since the last run
+            self._validate_label_tags_cache(scraper_config)
+            scraper_config['_label_tags_cache_validated'] = True
+            # So might the metrics mapper and the ignored metrics
+            scraper_config['_dispatch_plan'].validate(scraper_config, metric_transformers)
+            scraper_config['_dispatch_plan_validated'] = True
+
+            try:
+                metrics = self.parse_metric_family(response, scraper_config, metric_transformers=metric_transformers)
+                for metric in self.profile_iter('openmetrics.parse', metrics, count=_count_samples):
+                    yield metric
+            finally:
+                scraper_config['_label_tags_cache_validated'] = False
+                scraper_config['_dispatch_plan_validated'] = False
+                if recording is not None:
+                    batch.stop_recording(recording)
+
+            if recording is not None:
+                if payload_hash is not None:
+                    digest = payload_hash.hexdigest()
+                cached_payload = scraper_config['_payload_cache']
+                scraper_config['_payload_unchanged'] = cached_payload is not None and cached_payload.digest == digest
+                scraper_config['_payload_cache'] = CachedPayload(
+                    response.headers.get('ETag'), response.headers.get('Last-Modified'), digest, recording, time()
+                )
+
+            self._send_label_tags_cache_telemetry(scraper_config)
+
+            if scraper_config['_protobuf_format_failed']:
+                scraper_config['_text_format_runs'] += 1
+                if scraper_config['_text_format_runs'] >= self.PROTOBUF_FORMAT_RETRY_RUNS:
+                    # The payload might have been truncated, or the endpoint fixed
+                    scraper_config['_protobuf_format_failed'] = False
 
             # Set dry run off
             scraper_config['_dry_run'] = False
-            # Garbage collect unused mapping and reset active labels
-            for metric, mapping in list(iteritems(scraper_config['_label_mapping'])):
-                for key in list(mapping):
-                    if key not in scraper_config['_active_label_mapping'][metric]:
-                        del scraper_config['_label_mapping'][metric][key]
-            scraper_config['_active_label_mapping'] = {}
+            # Garbage collect the label values that weren't found during the run
+            scraper_config['_label_join_index'].collect()
         finally:
             response.close()
 
+    def _get_payload_digest(self, response):
+        """
+        Hash the payload of the response, reading it in memory. Responses to conditional requests
+        telling that the payload is unchanged have no digest.
+        """
+        if response.status_code == 304:
+            return None
+        return hashlib.sha256(ensure_bytes(response.content)).hexdigest()
+
+    def _hash_payload_stream(self, response):
+        """
+        Hash the payload of the response as it is read by the parser, without keeping it in memory.
+        The hexdigest of the returned hash is the one of `_get_payload_digest` once the payload is read.
+        """
+        payload_hash = hashlib.sha256()
+        iter_content = response.iter_content
+
+        def hashed_iter_content(chunk_size=1, decode_unicode=False):
+            # Hash the bytes, before they are decoded
+            chunks = _hash_chunks(iter_content(chunk_size=chunk_size), payload_hash)
+            if decode_unicode:
+                chunks = stream_decode_response_unicode(chunks, response)
+            return chunks
+
+        # `iter_lines` also reads the payload through `iter_content`
+        response.iter_content = hashed_iter_content
+        return payload_hash
+
+    def _replay_cached_payload(self, response, digest, batch, scraper_config):
+        """
+        Add the submissions of the previous run to the batch if the payload hasn't changed since then
+        and the submissions aren't older than `payload_cache_max_age`.
+
+        :return: whether or not the submissions were replayed
+        """
+        if response.status_code == 304:
+            # The conditional request was only sent with fresh submissions
+            cached_payload = scraper_config['_payload_cache']
+        else:
+            cached_payload = self._get_fresh_payload_cache(scraper_config)
+            if cached_payload is not None and digest != cached_payload.digest:
+                cached_payload = None
+
+        if cached_payload is None:
+            return False
+
+        batch.extend(cached_payload.rows)
+        self._send_telemetry_counter(self.TELEMETRY_COUNTER_PAYLOAD_REPLAYED, 1, scraper_config)
+        return True
+
+    def _get_fresh_payload_cache(self, scraper_config):
+        cached_payload = scraper_config['_payload_cache']
+        if cached_payload is not None and time() - cached_payload.timestamp > scraper_config['payload_cache_max_age']:
+            cached_payload = scraper_config['_payload_cache'] = None
+
+        return cached_payload
+
     def process(self, scraper_config, metric_transformers=None):
         """
         Polls the data from prometheus and pushes them as gauges
@@ -375,8 +784,12 @@ class OpenMetricsScraperMixin(object):
         if metric_transformers:
             transformers.update(metric_transformers)
 
-        for metric in self.scrape_metrics(scraper_config):
-            self.process_metric(metric, scraper_config, metric_transformers=transformers)
+        # Buffer the submissions to send them to the aggregator in bulk
+        with self.submit_metrics_batch():
+            for metric in self.scrape_metrics(scraper_config, metric_transformers=transformers):
+                with self.profile('openmetrics.process') as span:
+                    span.count(len(metric.samples))
+                    self.process_metric(metric, scraper_config, metric_transformers=transformers)
 
     def transform_metadata(self, metric, scraper_config):
         labels = metric.samples[0][self.SAMPLE_LABELS]
@@ -407,51 +820,76 @@ class OpenMetricsScraperMixin(object):
                 tags.extend(extra_tags)
             self.count(metric_name_with_namespace, val, tags=tags)
 
+    def _send_label_tags_cache_telemetry(self, scraper_config):
+        cache = scraper_config['_label_tags_cache']
+        if cache is None or not scraper_config['telemetry']:
+            return
+
+        self._send_telemetry_gauge(self.TELEMETRY_GAUGE_TAGS_CACHE_SIZE, len(cache), scraper_config)
+        self._send_telemetry_counter(self.TELEMETRY_COUNTER_TAGS_CACHE_HITS, cache.hits, scraper_config)
+        self._send_telemetry_counter(self.TELEMETRY_COUNTER_TAGS_CACHE_MISSES, cache.misses, scraper_config)
+        self._send_telemetry_counter(self.TELEMETRY_COUNTER_TAGS_CACHE_EVICTIONS, cache.evictions, scraper_config)
+        cache.reset_stats()
+
+    def _send_tagger_cache_telemetry(self, cache, scraper_config):
+        """
+        Submit the stats of a `TaggerCache` used by the check.
+        """
+        if not scraper_config['telemetry'] or not (cache.hits or cache.misses):
+            return
+
+        self._send_telemetry_gauge(self.TELEMETRY_GAUGE_TAGGER_CACHE_HIT_RATIO, cache.hit_ratio, scraper_config)
+        self._send_telemetry_counter(self.TELEMETRY_COUNTER_TAGGER_CACHE_HITS, cache.hits, scraper_config)
+        self._send_telemetry_counter(self.TELEMETRY_COUNTER_TAGGER_CACHE_MISSES, cache.misses, scraper_config)
+        cache.reset_stats()
+
+    def _send_connection_telemetry(self, scraper_config):
+        stats = scraper_config['_connection_stats']
+        if not scraper_config['persist_connections'] or not stats.requests:
+            return
+
+        self._send_telemetry_counter(self.TELEMETRY_COUNTER_CONNECTIONS_OPENED, stats.connections, scraper_config)
+        self._send_telemetry_gauge(self.TELEMETRY_GAUGE_CONNECTIONS_REUSE_RATIO, stats.reuse_ratio, scraper_config)
+        self._send_telemetry_gauge(
+            self.TELEMETRY_GAUGE_CONNECTIONS_HANDSHAKE_TIME, stats.handshake_time, scraper_config
+        )
+        stats.reset()
+
     def _store_labels(self, metric, scraper_config):
         # If targeted metric, store labels
-        if metric.name in scraper_config['label_joins']:
-            matching_label = scraper_config['label_joins'][metric.name]['label_to_match']
-            for sample in metric.samples:
-                # metadata-only metrics that are used for label joins are always equal to 1
-                # this is required for metrics where all combinations of a state are sent
-                # but only the active one is set to 1 (others are set to 0)
-                # example: kube_pod_status_phase in kube-state-metrics
-                if sample[self.SAMPLE_VALUE] != 1:
-                    continue
-                label_dict = dict()
-                matching_value = None
-                for label_name, label_value in iteritems(sample[self.SAMPLE_LABELS]):
-                    if label_name == matching_label:
-                        matching_value = label_value
-                    elif label_name in scraper_config['label_joins'][metric.name]['labels_to_get']:
-                        label_dict[label_name] = label_value
-                try:
-                    if scraper_config['_label_mapping'][matching_label].get(matching_value):
-                        scraper_config['_label_mapping'][matching_label][matching_value].update(label_dict)
-                    else:
-                        scraper_config['_label_mapping'][matching_label][matching_value] = label_dict
-                except KeyError:
-                    if matching_value is not None:
-                        scraper_config['_label_mapping'][matching_label] = {matching_value: label_dict}
+        label_join = scraper_config['label_joins'].get(metric.name)
+        if label_join is None:
+            return
+
+        matching_label = label_join['label_to_match']
+        labels_to_get = label_join['labels_to_get']
+        index = scraper_config['_label_join_index']
+        for sample in metric.samples:
+            # metadata-only metrics that are used for label joins are always equal to 1
+            # this is required for metrics where all combinations of a state are sent
+            # but only the active one is set to 1 (others are set to 0)
+            # example: kube_pod_status_phase in kube-state-metrics
+            if sample[self.SAMPLE_VALUE] != 1:
+                continue
+
+            sample_labels = sample[self.SAMPLE_LABELS]
+            matching_value = sample_labels.get(matching_label)
+            if matching_value is None:
+                continue
+
+            index.store(
+                matching_label,
+                matching_value,
+                {label_name: sample_labels[label_name] for label_name in labels_to_get if label_name in sample_labels},
+            )
 
     def _join_labels(self, metric, scraper_config):
         # Filter metric to see if we can enrich with joined labels
         if scraper_config['label_joins']:
+            index = scraper_config['_label_join_index']
+            watched_labels = scraper_config['_watched_labels']
             for sample in metric.samples:
-                watched_labels = scraper_config['_watched_labels'].intersection(set(sample[self.SAMPLE_LABELS].keys()))
-                for label_name in watched_labels:
-                    # Set this label value as active
-                    if label_name not in scraper_config['_active_label_mapping']:
-                        scraper_config['_active_label_mapping'][label_name] = {}
-                    scraper_config['_active_label_mapping'][label_name][sample[self.SAMPLE_LABELS][label_name]] = True
-                    # If mapping found add corresponding labels
-                    try:
-                        for name, val in iteritems(
-                            scraper_config['_label_mapping'][label_name][sample[self.SAMPLE_LABELS][label_name]]
-                        ):
-                            sample[self.SAMPLE_LABELS][name] = val
-                    except KeyError:
-                        pass
+                index.join(sample[self.SAMPLE_LABELS], watched_labels)
 
     def process_metric(self, metric, scraper_config, metric_transformers=None):
         """
@@ -465,7 +903,9 @@ class OpenMetricsScraperMixin(object):
         # If targeted metric, store labels
         self._store_labels(metric, scraper_config)
 
-        if metric.name in scraper_config['ignore_metrics']:
+        dispatch = scraper_config['_dispatch_plan'].get(metric.name, scraper_config, metric_transformers)
+
+        if dispatch.ignored:
             self._send_telemetry_counter(
                 self.TELEMETRY_COUNTER_METRICS_IGNORE_COUNT, len(metric.samples), scraper_config
             )
@@ -476,40 +916,37 @@ class OpenMetricsScraperMixin(object):
         if self._filter_metric(metric, scraper_config):
             return  # Ignore the metric
 
-        # Filter metric to see if we can enrich with joined labels
-        self._join_labels(metric, scraper_config)
-
         if scraper_config['_dry_run']:
             return
 
-        try:
-            self.submit_openmetric(scraper_config['metrics_mapper'][metric.name], metric, scraper_config)
-        except KeyError:
-            if metric_transformers is not None and metric.name in metric_transformers:
-                try:
-                    # Get the transformer function for this specific metric
-                    transformer = metric_transformers[metric.name]
-                    transformer(metric, scraper_config)
-                except Exception as err:
-                    self.log.warning('Error handling metric: %s - error: %s', metric.name, err)
+        # Filter metric to see if we can enrich with joined labels
+        self._join_labels(metric, scraper_config)
 
+        if dispatch.mapped_name is not None:
+            try:
+                self.submit_openmetric(dispatch.mapped_name, metric, scraper_config)
                 return
+            except KeyError:
+                pass
 
-            # build the wildcard list if first pass
-            if scraper_config['_metrics_wildcards'] is None:
-                scraper_config['_metrics_wildcards'] = [x for x in scraper_config['metrics_mapper'] if '*' in x]
+        if dispatch.transformer is not None:
+            try:
+                # Get the transformer function for this specific metric
+                dispatch.transformer(metric, scraper_config)
+            except Exception as err:
+                self.log.warning('Error handling metric: %s - error: %s', metric.name, err)
 
-            # try matching wildcard
-            for wildcard in scraper_config['_metrics_wildcards']:
-                if fnmatchcase(metric.name, wildcard):
-                    self.submit_openmetric(metric.name, metric, scraper_config)
-                    return
+            return
 
-            self.log.debug(
-                'Skipping metric `%s` as it is not defined in the metrics mapper, '
-                'has no transformer function, nor does it match any wildcards.',
-                metric.name,
-            )
+        if dispatch.wildcard:
+            self.submit_openmetric(metric.name, metric, scraper_config)
+            return
+
+        self.log.debug(
+            'Skipping metric `%s` as it is not defined in the metrics mapper, '
+            'has no transformer function, nor does it match any wildcards.',
+            metric.name,
+        )
 
     def poll(self, scraper_config, headers=None):
         """
@@ -533,7 +970,9 @@ class OpenMetricsScraperMixin(object):
         service_check_tags.extend(scraper_config['custom_tags'])
 
         try:
-            response = self.send_request(endpoint, scraper_config, headers)
+            response = self._pop_prefetched_response(scraper_config)
+            if response is None:
+                response = self.send_request(endpoint, scraper_config, headers)
         except requests.exceptions.SSLError:
             self.log.error("Invalid SSL settings for requesting %s endpoint", endpoint)
             raise
@@ -552,14 +991,78 @@ class OpenMetricsScraperMixin(object):
                 self.service_check(service_check_name, AgentCheck.CRITICAL, tags=service_check_tags)
             raise
 
+    def prefetch_response(self, scraper_config):
+        """
+        Request the endpoint and read the whole payload ahead of `poll`, which will use it instead of
+        sending a new request. It is meant to be called from worker threads: nothing is submitted here,
+        the outcome is stored in the scraper configuration, errors included, and `poll` handles it.
+
+        Reading the payload takes at most `scrape_deadline` seconds.
+
+        :return: the scraper configuration
+        """
+        endpoint = scraper_config['prometheus_url']
+        deadline = time() + scraper_config['scrape_deadline']
+
+        try:
+            response = self.send_request(endpoint, scraper_config)
+            try:
+                chunks = []
+                for chunk in response.iter_content(chunk_size=self.REQUESTS_CHUNK_SIZE):
+                    chunks.append(chunk)
+                    if time() > deadline:
+                        raise requests.exceptions.Timeout(
+                            'Reading the payload of {} took more than {} seconds'.format(
+                                endpoint, scraper_config['scrape_deadline']
+                            )
+                        )
+            except Exception:
+                response.close()
+                raise
+
+            # The payload is kept on the response so that `iter_lines` and `iter_content` read it from memory
+            response._content = b''.join(chunks)
+            response._content_consumed = True
+            scraper_config['_prefetched_response'] = (response, None)
+        except Exception:
+            scraper_config['_prefetched_response'] = (None, sys.exc_info())
+
+        return scraper_config
+
+    def _pop_prefetched_response(self, scraper_config):
+        """
+        Return the response stored by `prefetch_response`, if any, raising the error it failed with.
+        """
+        prefetched = scraper_config['_prefetched_response']
+        if prefetched is None:
+            return None
+
+        scraper_config['_prefetched_response'] = None
+        response, exc_info = prefetched
+        if exc_info is not None:
+            reraise(*exc_info)
+
+        return response
+
     def send_request(self, endpoint, scraper_config, headers=None):
         # Determine the headers
         if headers is None:
             headers = {}
         if 'accept-encoding' not in headers:
             headers['accept-encoding'] = 'gzip'
+        if scraper_config['use_protobuf_format'] and not scraper_config['_protobuf_format_failed']:
+            headers['accept'] = self.PROTOBUF_ACCEPT_HEADER
         headers.update(scraper_config['extra_headers'])
 
+        # Ask for the payload only if it changed since the submissions we could replay
+        if scraper_config['replay_unchanged_payloads']:
+            cached_payload = self._get_fresh_payload_cache(scraper_config)
+            if cached_payload is not None:
+                if cached_payload.etag is not None:
+                    headers['If-None-Match'] = cached_payload.etag
+                if cached_payload.last_modified is not None:
+                    headers['If-Modified-Since'] = cached_payload.last_modified
+
         # Add the bearer token to headers
         bearer_token = scraper_config['_bearer_token']
         if bearer_token is not None:
@@ -589,15 +1092,83 @@ class OpenMetricsScraperMixin(object):
         password = scraper_config['password']
         auth = (username, password) if username is not None and password is not None else None
 
-        return requests.get(
-            endpoint,
-            headers=headers,
-            stream=True,
-            timeout=scraper_config['prometheus_timeout'],
-            cert=cert,
-            verify=verify,
-            auth=auth,
-        )
+        options = {
+            'headers': headers,
+            'stream': True,
+            'timeout': scraper_config['prometheus_timeout'],
+            'cert': cert,
+            'verify': verify,
+            'auth': auth,
+        }
+
+        if not scraper_config['persist_connections']:
+            return requests.get(endpoint, **options)
+
+        session = scraper_config['_session'] if scraper_config['_shared_session'] else None
+        if session is None:
+            session = self._get_session(scraper_config)
+        scraper_config['_connection_stats'].add_request()
+        try:
+            return session.get(endpoint, **options)
+        except requests.exceptions.SSLError:
+            raise
+        except requests.exceptions.ConnectionError as e:
+            # The endpoint might have closed a connection we were keeping, try again with new ones.
+            # Endpoints that can't be connected to, e.g. refused or timed out, are not requested twice.
+            if not _is_dropped_connection_error(e):
+                raise
+
+            self.log.debug('Request to %s failed, retrying with a new connection: %s', endpoint, e)
+            # A shared session might be in use by other threads so it's kept,
+            # the connection that failed was discarded by its pool anyway
+            if not scraper_config['_shared_session']:
+                self._close_session(scraper_config)
+                session = self._get_session(scraper_config)
+            scraper_config['_connection_stats'].add_request()
+            return session.get(endpoint, **options)
+
+    def _get_session(self, scraper_config):
+        """
+        Return the session keeping the connections to the endpoint open between runs. The connections
+        are closed when they have not been used for `connection_idle_timeout` seconds.
+        """
+        now = time()
+        session = scraper_config['_session']
+        if session is not None:
+            idle_time = now - scraper_config['_session_last_used']
+            if idle_time > scraper_config['connection_idle_timeout']:
+                self._close_session(scraper_config)
+                session = None
+
+        if session is None:
+            adapter = PooledHTTPAdapter(
+                stats=scraper_config['_connection_stats'], pool_maxsize=scraper_config['connection_pool_size']
+            )
+            session = scraper_config['_session'] = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+
+        scraper_config['_session_last_used'] = now
+        return session
+
+    def _close_session(self, scraper_config):
+        session = scraper_config['_session']
+        if session is not None:
+            scraper_config['_session'] = None
+            session.close()
+
+    def _finalize_tags_to_submit(self, _tags, metric_name, val, metric, custom_tags=None, hostname=None):
+        """
+        Format the finalized tags
+        This is generally a noop, but it can be used to change the tags before sending metrics
+        """
+        return _tags
+
+    def _filter_metric(self, metric, scraper_config):
+        """
+        Used to filter metrics at the begining of the processing, by default no metric is filtered
+        """
+        return False
 
     def get_hostname_for_sample(self, sample, scraper_config):
         """
@@ -717,6 +1288,7 @@ class OpenMetricsScraperMixin(object):
             elif sample[self.SAMPLE_NAME].endswith("_count") and not scraper_config['send_distribution_buckets']:
                 tags = self._metric_tags(metric_name, val, sample, scraper_config, hostname)
                 if scraper_config['send_histograms_buckets']:
+                    tags = list(tags)
                     tags.append("upper_bound:none")
                 self._submit_distribution_count(
                     scraper_config['send_distribution_counts_as_monotonic'],
@@ -739,73 +1311,52 @@ class OpenMetricsScraperMixin(object):
                         hostname=custom_hostname,
                     )
 
-    def _compute_bucket_hash(self, tags):
-        # we need the unique context for all the buckets
-        # hence we remove the "le" tag
-        return hash(frozenset(sorted((k, v) for k, v in iteritems(tags) if k != 'le')))
-
     def _decumulate_histogram_buckets(self, metric):
         """
         Decumulate buckets in a given histogram metric and adds the lower_bound label (le being upper_bound)
         """
-        bucket_values_by_context_upper_bound = {}
-        for sample in metric.samples:
+        samples = metric.samples
+
+        # Group the buckets of each context in a single pass, as lists of (upper_bound, sample index)
+        buckets_by_context = {}
+        # (upper bound, label item to remove from the context) by `le` label value
+        bounds = {}
+        for i, sample in enumerate(samples):
             if sample[self.SAMPLE_NAME].endswith("_bucket"):
-                context_key = self._compute_bucket_hash(sample[self.SAMPLE_LABELS])
-                if context_key not in bucket_values_by_context_upper_bound:
-                    bucket_values_by_context_upper_bound[context_key] = {}
-                bucket_values_by_context_upper_bound[context_key][float(sample[self.SAMPLE_LABELS]["le"])] = sample[
-                    self.SAMPLE_VALUE
-                ]
-
-        sorted_buckets_by_context = {}
-        for context in bucket_values_by_context_upper_bound:
-            sorted_buckets_by_context[context] = sorted(bucket_values_by_context_upper_bound[context])
-
-        # Tuples (lower_bound, upper_bound, value)
-        bucket_tuples_by_context_upper_bound = {}
-        for context in sorted_buckets_by_context:
-            for i, upper_b in enumerate(sorted_buckets_by_context[context]):
-                if i == 0:
-                    if context not in bucket_tuples_by_context_upper_bound:
-                        bucket_tuples_by_context_upper_bound[context] = {}
-                    if upper_b > 0:
-                        # positive buckets start at zero
-                        bucket_tuples_by_context_upper_bound[context][upper_b] = (
-                            0,
-                            upper_b,
-                            bucket_values_by_context_upper_bound[context][upper_b],
-                        )
-                    else:
-                        # negative buckets start at -inf
-                        bucket_tuples_by_context_upper_bound[context][upper_b] = (
-                            self.MINUS_INF,
-                            upper_b,
-                            bucket_values_by_context_upper_bound[context][upper_b],
-                        )
-                    continue
-                tmp = (
-                    bucket_values_by_context_upper_bound[context][upper_b]
-                    - bucket_values_by_context_upper_bound[context][sorted_buckets_by_context[context][i - 1]]
-                )
-                bucket_tuples_by_context_upper_bound[context][upper_b] = (
-                    sorted_buckets_by_context[context][i - 1],
-                    upper_b,
-                    tmp,
-                )
+                labels = sample[self.SAMPLE_LABELS]
+                le = labels['le']
+                try:
+                    upper_bound, le_item = bounds[le]
+                except KeyError:
+                    upper_bound, le_item = bounds[le] = (float(le), frozenset((('le', le),)))
 
-        # modify original metric to inject lower_bound & modified value
-        for i, sample in enumerate(metric.samples):
-            if not sample[self.SAMPLE_NAME].endswith("_bucket"):
-                continue
+                # we need the unique context for all the buckets
+                # hence we remove the "le" tag
+                context = frozenset(iteritems(labels)) - le_item
+                try:
+                    buckets_by_context[context].append((upper_bound, i))
+                except KeyError:
+                    buckets_by_context[context] = [(upper_bound, i)]
+
+        # The same bounds are usually shared by all the contexts
+        bound_strings = {}
+        for buckets in itervalues(buckets_by_context):
+            buckets.sort()
+
+            # positive buckets start at zero, negative buckets start at -inf
+            lower_bound = str(0 if buckets[0][0] > 0 else self.MINUS_INF)
+            previous_value = 0
+            for upper_bound, i in buckets:
+                name, labels, value = samples[i]
+                labels['lower_bound'] = lower_bound
+                # Replacing the sample tuple with the modified value
+                samples[i] = (name, labels, value - previous_value)
 
-            context_key = self._compute_bucket_hash(sample[self.SAMPLE_LABELS])
-            matching_bucket_tuple = bucket_tuples_by_context_upper_bound[context_key][
-                float(sample[self.SAMPLE_LABELS]["le"])
-            ]
-            # Replacing the sample tuple
-            sample[self.SAMPLE_LABELS]["lower_bound"] = str(matching_bucket_tuple[0])
-            metric.samples[i] = (sample[self.SAMPLE_NAME], sample[self.SAMPLE_LABELS], matching_bucket_tuple[2])
+                try:
+                    lower_bound = bound_strings[upper_bound]
+                except KeyError:
+                    lower_bound = bound_strings[upper_bound] = str(upper_bound)
+                previous_value = value
 
     def _submit_sample_histogram_buckets(self, metric_name, sample, scraper_config, hostname=None):
         if "lower_bound" not in sample[self.SAMPLE_LABELS] or "le" not in sample[self.SAMPLE_LABELS]:
@@ -841,17 +1392,73 @@ class OpenMetricsScraperMixin(object):
             self.gauge(metric_name, value, tags=tags, hostname=hostname)
 
     def _metric_tags(self, metric_name, val, sample, scraper_config, hostname=None):
+        """
+        Return the tags of a sample. With the cache enabled, they are a `NormalizedTags` tuple
+        shared by all the samples with the same labels, that must not be modified.
+        """
         custom_tags = scraper_config['custom_tags']
-        _tags = list(custom_tags)
-        _tags.extend(scraper_config['_metric_tags'])
-        for label_name, label_value in iteritems(sample[self.SAMPLE_LABELS]):
-            if label_name not in scraper_config['exclude_labels']:
-                tag_name = scraper_config['labels_mapper'].get(label_name, label_name)
-                _tags.append('{}:{}'.format(to_string(tag_name), to_string(label_value)))
+        if scraper_config['_label_tags_cache'] is None:
+            _tags = list(custom_tags)
+            _tags.extend(scraper_config['_metric_tags'])
+            _tags.extend(self._render_label_tags(sample[self.SAMPLE_LABELS], scraper_config))
+        else:
+            _tags = self._get_sample_tags(sample[self.SAMPLE_LABELS], scraper_config)
+            if scraper_config['_finalize_tags_overridden']:
+                _tags = list(_tags)
+
         return self._finalize_tags_to_submit(
             _tags, metric_name, val, sample, custom_tags=custom_tags, hostname=hostname
         )
 
+    def _get_sample_tags(self, labels, scraper_config):
+        """
+        Return the cached tags of a sample with the given labels, including the constant tags.
+        """
+        # Outside of a scrape, e.g. when `process_metric` is called directly, the settings
+        # might have been changed since the previous call
+        if not scraper_config['_label_tags_cache_validated']:
+            self._validate_label_tags_cache(scraper_config)
+
+        cache = scraper_config['_label_tags_cache']
+        key = frozenset(iteritems(labels))
+        tags = cache.get(key)
+        if tags is None:
+            tags = NormalizedTags(scraper_config['_constant_tags'] + self._render_label_tags(labels, scraper_config))
+            cache.set(key, tags)
+
+        return tags
+
+    def _render_label_tags(self, labels, scraper_config):
+        exclude_labels = scraper_config['exclude_labels']
+        labels_mapper = scraper_config['labels_mapper']
+        return tuple(
+            '{}:{}'.format(to_string(labels_mapper.get(label_name, label_name)), to_string(label_value))
+            for label_name, label_value in iteritems(labels)
+            if label_name not in exclude_labels
+        )
+
+    def _validate_label_tags_cache(self, scraper_config):
+        """
+        Clear the cached tags if they were rendered with different settings, including
+        settings changed in place.
+        """
+        cache = scraper_config['_label_tags_cache']
+        if cache is None:
+            return
+
+        custom_tags = scraper_config['custom_tags']
+        metric_tags = scraper_config['_metric_tags']
+        fingerprint = (
+            frozenset(scraper_config['exclude_labels']),
+            frozenset(iteritems(scraper_config['labels_mapper'])),
+            tuple(custom_tags),
+            tuple(metric_tags),
+        )
+        if fingerprint != scraper_config['_label_tags_cache_fingerprint']:
+            cache.clear()
+            scraper_config['_label_tags_cache_fingerprint'] = fingerprint
+            scraper_config['_constant_tags'] = tuple(self._normalize_tags_type(list(custom_tags) + list(metric_tags)))
+
     def _is_value_valid(self, val):
         return not (isnan(val) or isinf(val))
 
@@ -0,0 +1,251 @@
+# (C) Datadog, Inc. 2019
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+"""
+Streaming parser for the Prometheus text exposition format.
+
+It yields the same `core.Metric` objects as `prometheus_client.parser.text_fd_to_metric_families`,
+but works on raw bytes lines and resolves the name and type of every metric family before parsing
+its samples. This lets callers skip families they have no use for without decoding lines or
+allocating label dictionaries.
+"""
+from prometheus_client.core import Metric
+
+from ...utils.common import ensure_unicode
+
+# Sample name suffixes that belong to a family, by family type
+ALLOWED_SUFFIXES = {
+    'counter': ('',),
+    'gauge': ('',),
+    'summary': ('_count', '_sum', ''),
+    'histogram': ('_count', '_sum', '_bucket'),
+}
+DEFAULT_SUFFIXES = ('',)
+
+
+def iter_chunk_lines(chunks):
+    """
+    Split an iterable of bytes chunks, e.g. `requests.Response.iter_content()`, into bytes lines.
+    """
+    pending = b''
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if pending:
+            chunk = pending + chunk
+        lines = chunk.split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line
+
+    if pending:
+        yield pending
+
+
+def text_lines_to_metric_families(lines, family_filter=None, on_skipped_family=None):
+    """
+    Parse Prometheus text format from an iterable of bytes lines.
+
+    :param lines: iterable of bytes lines
+    :param family_filter: optional callable `(name, type) -> bool`, called once per family
+        with the first sample of the family. Samples of rejected families are only counted.
+    :param on_skipped_family: optional callable `(name, type, sample_count)`, called when a
+        family rejected by `family_filter` is complete
+    :return: generator of core.Metric
+    """
+    name = ''
+    documentation = ''
+    typ = 'untyped'
+    samples = []
+    allowed_names = ()
+    # None until the first sample of the family, then whether or not samples should be parsed
+    keep = None
+    skipped = 0
+
+    for line in lines:
+        line = line.strip()
+
+        if not line:
+            continue
+
+        if line[:1] == b'#':
+            parts = line.split(None, 3)
+            if len(parts) < 3:
+                continue
+
+            kind = parts[1]
+            if kind != b'HELP' and kind != b'TYPE':
+                # Ignore other comment tokens
+                continue
+
+            family_name = ensure_unicode(parts[2])
+            if family_name != name:
+                if name != '':
+                    if keep is False:
+                        if on_skipped_family is not None:
+                            on_skipped_family(name, typ, skipped)
+                    else:
+                        yield _build_metric(name, documentation, typ, samples)
+
+                # New metric
+                name = family_name
+                samples = []
+                keep = None
+                skipped = 0
+                if kind == b'HELP':
+                    typ = 'untyped'
+                    allowed_names = (name,)
+                else:
+                    documentation = ''
+
+            if kind == b'HELP':
+                documentation = _replace_help_escaping(ensure_unicode(parts[3])) if len(parts) == 4 else ''
+            else:
+                typ = ensure_unicode(parts[3])
+                allowed_names = tuple(name + suffix for suffix in ALLOWED_SUFFIXES.get(typ, DEFAULT_SUFFIXES))
+
+            continue
+
+        sample_name = _parse_sample_name(line)
+        if sample_name not in allowed_names:
+            if name != '':
+                if keep is False:
+                    if on_skipped_family is not None:
+                        on_skipped_family(name, typ, skipped)
+                else:
+                    yield _build_metric(name, documentation, typ, samples)
+
+            name = ''
+            documentation = ''
+            typ = 'untyped'
+            samples = []
+            allowed_names = ()
+            keep = None
+            skipped = 0
+
+            # New metric, yield immediately as untyped singleton
+            if family_filter is None or family_filter(sample_name, 'untyped'):
+                yield _build_metric(sample_name, '', 'untyped', [_parse_sample(ensure_unicode(line))])
+            elif on_skipped_family is not None:
+                on_skipped_family(sample_name, 'untyped', 1)
+
+            continue
+
+        if keep is None:
+            keep = family_filter is None or family_filter(name, typ)
+
+        if keep:
+            samples.append(_parse_sample(ensure_unicode(line)))
+        else:
+            skipped += 1
+
+    if name != '':
+        if keep is False:
+            if on_skipped_family is not None:
+                on_skipped_family(name, typ, skipped)
+        else:
+            yield _build_metric(name, documentation, typ, samples)
+
+
+def _build_metric(name, documentation, typ, samples):
+    metric = Metric(name, documentation, typ)
+    metric.samples = samples
+    return metric
+
+
+def _replace_help_escaping(s):
+    return s.replace('\\n', '\n').replace('\\\\', '\\')
+
+
+def _replace_escaping(s):
+    return s.replace('\\n', '\n').replace('\\\\', '\\').replace('\\"', '"')
+
+
+def _parse_sample_name(line):
+    """
+    Extract the sample name of a stripped bytes line without parsing its labels or value.
+    """
+    label_start = line.find(b'{')
+    if label_start != -1 and line.rfind(b'}') != -1:
+        return ensure_unicode(line[:label_start].strip())
+
+    separator = b' ' if b' ' in line else b'\t'
+    name_end = line.find(separator)
+    if name_end == -1:
+        raise ValueError('Invalid sample: {}'.format(ensure_unicode(line)))
+
+    return ensure_unicode(line[:name_end])
+
+
+def _parse_labels(labels_string):
+    labels = {}
+    # Return if we don't have valid labels
+    if '=' not in labels_string:
+        return labels
+
+    escaping = '\\' in labels_string
+
+    sub_labels = labels_string
+    try:
+        # Process one label at a time
+        while sub_labels:
+            # The label name is before the equal
+            value_start = sub_labels.index('=')
+            label_name = sub_labels[:value_start]
+            sub_labels = sub_labels[value_start + 1 :].lstrip()
+            # Find the first quote after the equal
+            quote_start = sub_labels.index('"') + 1
+            value_substr = sub_labels[quote_start:]
+
+            # Find the last unescaped quote
+            i = 0
+            while i < len(value_substr):
+                i = value_substr.index('"', i)
+                if value_substr[i - 1] != '\\':
+                    break
+                i += 1
+
+            # The label value is in between the first and last quote
+            quote_end = i + 1
+            label_value = sub_labels[quote_start:quote_end]
+            if escaping:
+                label_value = _replace_escaping(label_value)
+            labels[label_name.strip()] = label_value.strip()
+
+            # Remove the processed label from the sub-slice for next iteration
+            sub_labels = sub_labels[quote_end + 1 :]
+            next_comma = sub_labels.find(',') + 1
+            sub_labels = sub_labels[next_comma:].lstrip()
+
+        return labels
+    except ValueError:
+        raise ValueError('Invalid labels: {}'.format(labels_string))
+
+
+def _parse_value(s):
+    # If we have multiple values only consider the first
+    s = s.lstrip()
+    separator = ' ' if ' ' in s else '\t'
+    i = s.find(separator)
+    if i == -1:
+        return s
+    return s[:i]
+
+
+def _parse_sample(text):
+    try:
+        label_start, label_end = text.index('{'), text.rindex('}')
+        # The name is before the labels
+        name = text[:label_start].strip()
+        label = text[label_start + 1 : label_end]
+        # The value is after the label end (ignoring curly brace and space)
+        value = float(_parse_value(text[label_end + 2 :]))
+        return name, _parse_labels(label), value
+
+    # We don't have labels
+    except ValueError:
+        separator = ' ' if ' ' in text else '\t'
+        name_end = text.index(separator)
+        name = text[:name_end]
+        value = float(_parse_value(text[name_end:]))
+        return name, {}, value
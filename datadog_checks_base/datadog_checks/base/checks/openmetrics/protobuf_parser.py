@@ -0,0 +1,185 @@
+# (C) Datadog, Inc. 2019
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+"""
+Streaming parser for the Prometheus protobuf exposition format.
+
+It yields `core.Metric` objects holding the samples the text format would hold for the same metrics,
+so that they are processed exactly like the ones of the text parsers. The delimited MetricFamily
+messages are read as the payload is received, and the name and type of each family are resolved
+before parsing it, so that families the caller has no use for are skipped.
+"""
+from math import isinf, isnan
+
+from prometheus_client.core import Metric
+from six import PY3
+
+from ...utils.prometheus import metrics_pb2
+from ...utils.prometheus.functions import iter_delimited_messages, peek_metric_family
+
+# Indexed by the `type` field of MetricFamily
+METRIC_TYPES = ('counter', 'gauge', 'summary', 'untyped', 'histogram')
+
+POSITIVE_INF = float('inf')
+
+
+def protobuf_chunks_to_metric_families(
+    chunks, family_filter=None, on_skipped_family=None, blacklist=None, on_blacklisted=None
+):
+    """
+    Parse Prometheus protobuf format from an iterable of bytes chunks, e.g. `requests.Response.iter_content()`.
+
+    :param chunks: iterable of bytes chunks
+    :param family_filter: optional callable `(name, type) -> bool`, called once per family.
+        Rejected families are only decoded if `on_skipped_family` is set, to count their samples.
+    :param on_skipped_family: optional callable `(name, type, sample_count)`, called for each
+        family rejected by `family_filter`
+    :param blacklist: optional list of strings, the metrics whose name and labels rendered in the
+        text format contain one of them are filtered out
+    :param on_blacklisted: optional callable `(sample_count)`, called for each metric filtered out
+    :return: generator of core.Metric
+    """
+    for buf in iter_delimited_messages(chunks):
+        if family_filter is not None:
+            name, metric_type = peek_metric_family(buf)
+            if name is not None:
+                metric_type = _get_metric_type(metric_type)
+                if not family_filter(name, metric_type):
+                    if on_skipped_family is not None:
+                        sample_count = count_samples(_parse_metric_family(buf), blacklist, on_blacklisted)
+                        on_skipped_family(name, metric_type, sample_count)
+                    continue
+
+        yield metric_family_to_metric(_parse_metric_family(buf), blacklist, on_blacklisted)
+
+
+def metric_family_to_metric(message, blacklist=None, on_blacklisted=None):
+    """
+    Convert a MetricFamily message to a core.Metric with the samples of the text format: the quantiles
+    and buckets are samples labeled by `quantile` and `le`, along with the `_sum` and `_count` samples.
+    """
+    name = message.name
+    metric_type = _get_metric_type(message.type)
+    metric = Metric(name, message.help, metric_type)
+
+    for pb_metric in message.metric:
+        labels = [(label.name, label.value) for label in pb_metric.label]
+        if blacklist and _is_blacklisted(name, labels, blacklist):
+            if on_blacklisted is not None:
+                on_blacklisted(len(_get_samples(name, metric_type, labels, pb_metric)))
+            continue
+
+        metric.samples.extend(_get_samples(name, metric_type, labels, pb_metric))
+
+    return metric
+
+
+def count_samples(message, blacklist=None, on_blacklisted=None):
+    """
+    Count the samples `metric_family_to_metric` would return for a MetricFamily message, without building them.
+    """
+    name = message.name
+    metric_type = _get_metric_type(message.type)
+    if not blacklist and metric_type not in ('summary', 'histogram'):
+        return len(message.metric)
+
+    count = 0
+    for pb_metric in message.metric:
+        sample_count = _count_metric_samples(metric_type, pb_metric)
+        if blacklist and _is_blacklisted(name, [(label.name, label.value) for label in pb_metric.label], blacklist):
+            if on_blacklisted is not None:
+                on_blacklisted(sample_count)
+            continue
+
+        count += sample_count
+
+    return count
+
+
+def _count_metric_samples(metric_type, pb_metric):
+    # The `_sum` and `_count` samples come with the quantiles and buckets
+    if metric_type == 'summary':
+        return len(pb_metric.summary.quantile) + 2
+
+    if metric_type == 'histogram':
+        buckets = pb_metric.histogram.bucket
+        # The +Inf bucket is implicit in the protobuf format
+        if buckets and buckets[-1].upper_bound == POSITIVE_INF:
+            return len(buckets) + 2
+        return len(buckets) + 3
+
+    return 1
+
+
+def _get_samples(name, metric_type, labels, pb_metric):
+    if metric_type == 'summary':
+        summary = pb_metric.summary
+        samples = [
+            (name, _with_label(labels, 'quantile', _format_float(quantile.quantile)), quantile.value)
+            for quantile in summary.quantile
+        ]
+        samples.append(('{}_sum'.format(name), dict(labels), summary.sample_sum))
+        samples.append(('{}_count'.format(name), dict(labels), float(summary.sample_count)))
+        return samples
+
+    if metric_type == 'histogram':
+        histogram = pb_metric.histogram
+        bucket_name = '{}_bucket'.format(name)
+        samples = []
+        upper_bound = None
+        for bucket in histogram.bucket:
+            upper_bound = bucket.upper_bound
+            samples.append(
+                (bucket_name, _with_label(labels, 'le', _format_float(upper_bound)), float(bucket.cumulative_count))
+            )
+
+        # The +Inf bucket is implicit in the protobuf format
+        if upper_bound != POSITIVE_INF:
+            samples.append((bucket_name, _with_label(labels, 'le', '+Inf'), float(histogram.sample_count)))
+
+        samples.append(('{}_sum'.format(name), dict(labels), histogram.sample_sum))
+        samples.append(('{}_count'.format(name), dict(labels), float(histogram.sample_count)))
+        return samples
+
+    return [(name, dict(labels), getattr(pb_metric, metric_type).value)]
+
+
+def _parse_metric_family(buf):
+    message = metrics_pb2.MetricFamily()
+    message.ParseFromString(buf if PY3 else buf.tobytes())
+    return message
+
+
+def _get_metric_type(type_number):
+    return METRIC_TYPES[type_number] if type_number < len(METRIC_TYPES) else 'untyped'
+
+
+def _with_label(labels, label_name, label_value):
+    labels = dict(labels)
+    labels[label_name] = label_value
+    return labels
+
+
+def _format_float(value):
+    if isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if isnan(value):
+        return 'NaN'
+    return repr(value)
+
+
+def _is_blacklisted(name, labels, blacklist):
+    if labels:
+        line = '{}{{{}}}'.format(name, ','.join('{}="{}"'.format(k, _escape_label_value(v)) for k, v in labels))
+    else:
+        line = name
+
+    for item in blacklist:
+        if item in line:
+            return True
+
+    return False
+
+
+def _escape_label_value(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
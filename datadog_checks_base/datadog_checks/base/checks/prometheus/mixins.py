@@ -3,18 +3,17 @@
 # Licensed under a 3-clause BSD style license (see LICENSE)
 
 import logging
-from collections import defaultdict
 from fnmatch import fnmatchcase
 from math import isinf, isnan
 
 import requests
-from google.protobuf.internal.decoder import _DecodeVarint32  # pylint: disable=E0611,E0401
 from prometheus_client.parser import text_fd_to_metric_families
 from six import PY3, iteritems, itervalues, string_types
 from urllib3 import disable_warnings
 from urllib3.exceptions import InsecureRequestWarning
 
 from ...utils.prometheus import metrics_pb2
+from ...utils.prometheus.functions import iter_delimited_messages, peek_metric_family
 from .. import AgentCheck
 
 if PY3:
@@ -168,10 +167,12 @@ class PrometheusScraperMixin(object):
         """
         Parse the MetricFamily from a valid requests.Response object to provide a MetricFamily object (see [0])
 
-        The text format uses iter_lines() generator.
+        The text format uses iter_lines() generator, and builds the MetricFamily objects straight from the parsed
+        samples.
 
-        The protobuf format directly parse the response.content property searching for Prometheus messages of type
+        The protobuf format streams the response with iter_content(), searching for Prometheus messages of type
         MetricFamily [0] delimited by a varint32 [1] when the content-type is a `application/vnd.google.protobuf`.
+        The name of each message is read before parsing it, so that ignored metrics are skipped.
 
         [0] https://github.com/prometheus/client_model/blob/086fe7ca28bde6cec2acd5223423c1475a362858/metrics.proto#L76-%20%20L81  # noqa: E501
         [1] https://developers.google.com/protocol-buffers/docs/reference/java/com/google/protobuf/AbstractMessageLite#writeDelimitedTo(java.io.OutputStream)  # noqa: E501
@@ -180,16 +181,14 @@ class PrometheusScraperMixin(object):
         :return: metrics_pb2.MetricFamily()
         """
         if 'application/vnd.google.protobuf' in response.headers['Content-Type']:
-            n = 0
-            buf = response.content
-            while n < len(buf):
-                msg_len, new_pos = _DecodeVarint32(buf, n)
-                n = new_pos
-                msg_buf = buf[n : n + msg_len]
-                n += msg_len
+            chunks = response.iter_content(chunk_size=self.REQUESTS_CHUNK_SIZE)
+            for msg_buf in iter_delimited_messages(chunks):
+                name, _ = peek_metric_family(msg_buf)
+                if name is not None and self._is_metric_family_ignored(self.remove_metric_prefix(name)):
+                    continue
 
                 message = metrics_pb2.MetricFamily()
-                message.ParseFromString(msg_buf)
+                message.ParseFromString(msg_buf if PY3 else msg_buf.tobytes())
                 message.name = self.remove_metric_prefix(message.name)
 
                 # Lookup type overrides:
@@ -206,36 +205,31 @@ class PrometheusScraperMixin(object):
             if self._text_filter_blacklist:
                 input_gen = self._text_filter_input(input_gen)
 
-            messages = defaultdict(list)  # map with the name of the element (before the labels)
-            # and the list of occurrences with labels and values
-
-            obj_map = {}  # map of the types of each metrics
-            obj_help = {}  # help for the metrics
             for metric in text_fd_to_metric_families(input_gen):
-                metric.name = self.remove_metric_prefix(metric.name)
-                metric_name = "%s_bucket" % metric.name if metric.type == "histogram" else metric.name
-                metric_type = self.type_overrides.get(metric_name, metric.type)
-                if metric_type == "untyped" or metric_type not in self.METRIC_TYPES:
+                metric_name = self.remove_metric_prefix(metric.name)
+                if self._is_metric_family_ignored(metric_name):
                     continue
 
-                for sample in metric.samples:
-                    if (sample[0].endswith("_sum") or sample[0].endswith("_count")) and metric_type in [
-                        "histogram",
-                        "summary",
-                    ]:
-                        messages[sample[0]].append({"labels": sample[1], 'value': sample[2]})
-                    else:
-                        messages[metric_name].append({"labels": sample[1], 'value': sample[2]})
-
-                obj_map[metric.name] = metric_type
-                obj_help[metric.name] = metric.documentation
+                type_override_name = "%s_bucket" % metric_name if metric.type == "histogram" else metric_name
+                metric_type = self.type_overrides.get(type_override_name, metric.type)
+                if metric_type == "untyped" or metric_type not in self.METRIC_TYPES:
+                    continue
 
-            for _m in obj_map:
-                if _m in messages or (obj_map[_m] == 'histogram' and ('{}_bucket'.format(_m) in messages)):
-                    yield self._extract_metric_from_map(_m, messages, obj_map, obj_help)
+                message = self._metric_family_from_samples(
+                    metric_name, metric_type, metric.documentation, metric.samples
+                )
+                if message.metric:
+                    yield message
         else:
             raise UnknownFormatError('Unsupported content-type provided: {}'.format(response.headers['Content-Type']))
 
+    def _is_metric_family_ignored(self, metric_name):
+        """
+        Whether a metric family can be skipped before being parsed: ignored metrics
+        are still needed if their labels are joined to other metrics.
+        """
+        return metric_name in self.ignore_metrics and metric_name not in self.label_joins
+
     def _text_filter_input(self, input_gen):
         """
         Filters out the text input line by line to avoid parsing and processing
@@ -280,80 +274,73 @@ class PrometheusScraperMixin(object):
 
         raise AttributeError("cannot find expected labels for metric %s with suffix %s" % (metric_name, metric_suffix))
 
-    def _extract_metric_from_map(self, _m, messages, obj_map, obj_help):
+    def _metric_family_from_samples(self, metric_name, metric_type, documentation, samples):
         """
-        Extracts MetricFamily objects from the maps generated by parsing the
-        strings in _extract_metrics_from_string
+        Builds a MetricFamily object from the samples of a metric parsed from the text format.
+        The samples of summaries and histograms are grouped by labels, the quantiles and
+        upper bounds being stored as labels in the text format.
         """
-        _obj = metrics_pb2.MetricFamily()
-        _obj.name = _m
-        _obj.type = self.METRIC_TYPES.index(obj_map[_m])
-        if _m in obj_help:
-            _obj.help = obj_help[_m]
-        # trick for histograms
-        _newlbl = _m
-        if obj_map[_m] == 'histogram':
-            _newlbl = '{}_bucket'.format(_m)
-        # Loop through the array of metrics ({labels, value}) built earlier
-        for _metric in messages[_newlbl]:
-            # in the case of quantiles and buckets, they need to be grouped by labels
-            if obj_map[_m] in ['summary', 'histogram'] and len(_obj.metric) > 0:
-                _label_exists = False
-                _metric_minus = {k: v for k, v in list(iteritems(_metric['labels'])) if k not in ['quantile', 'le']}
-                _metric_idx = 0
-                for mls in _obj.metric:
-                    _tmp_lbl = {idx.name: idx.value for idx in mls.label}
-                    if _metric_minus == _tmp_lbl:
-                        _label_exists = True
-                        break
-                    _metric_idx = _metric_idx + 1
-                if _label_exists:
-                    _g = _obj.metric[_metric_idx]
-                else:
-                    _g = _obj.metric.add()
+        message = metrics_pb2.MetricFamily()
+        message.name = metric_name
+        message.type = self.METRIC_TYPES.index(metric_type)
+        message.help = documentation
+
+        grouped = metric_type in ('summary', 'histogram')
+        if grouped:
+            # The sample names still hold the `prometheus_metrics_prefix`
+            count_suffix = '{}_count'.format(metric_name)
+            sum_suffix = '{}_sum'.format(metric_name)
+            sample_counts = {}
+            sample_sums = {}
+            metrics_by_labels = {}
+            for sample in samples:
+                if sample[0].endswith(count_suffix):
+                    sample_counts[self._grouping_key(sample[1])] = sample[2]
+                elif sample[0].endswith(sum_suffix):
+                    sample_sums[self._grouping_key(sample[1])] = sample[2]
+
+        for sample in samples:
+            labels, value = sample[1], sample[2]
+            if grouped:
+                if sample[0].endswith(count_suffix) or sample[0].endswith(sum_suffix):
+                    continue
+
+                key = self._grouping_key(labels)
+                metric = metrics_by_labels.get(key)
+                is_new = metric is None
+                if is_new:
+                    metric = metrics_by_labels[key] = message.metric.add()
+                    values = getattr(metric, metric_type)
+                    if key in sample_counts:
+                        values.sample_count = long(sample_counts[key])
+                    if key in sample_sums:
+                        values.sample_sum = float(sample_sums[key])
             else:
-                _g = _obj.metric.add()
-            if obj_map[_m] == 'counter':
-                _g.counter.value = float(_metric['value'])
-            elif obj_map[_m] == 'gauge':
-                _g.gauge.value = float(_metric['value'])
-            elif obj_map[_m] == 'summary':
-                if '{}_count'.format(_m) in messages:
-                    _g.summary.sample_count = long(self.get_metric_value_by_labels(messages, _metric, _m, 'count'))
-                if '{}_sum'.format(_m) in messages:
-                    _g.summary.sample_sum = self.get_metric_value_by_labels(messages, _metric, _m, 'sum')
-            # TODO: see what can be done with the untyped metrics
-            elif obj_map[_m] == 'histogram':
-                if '{}_count'.format(_m) in messages:
-                    _g.histogram.sample_count = long(self.get_metric_value_by_labels(messages, _metric, _m, 'count'))
-                if '{}_sum'.format(_m) in messages:
-                    _g.histogram.sample_sum = self.get_metric_value_by_labels(messages, _metric, _m, 'sum')
-            # last_metric = len(_obj.metric) - 1
-            # if last_metric >= 0:
-            for lbl in _metric['labels']:
+                is_new = True
+                metric = message.metric.add()
+                getattr(metric, metric_type).value = float(value)
+
+            for label_name, label_value in iteritems(labels):
                 # In the string format, the quantiles are in the labels
-                if lbl == 'quantile':
-                    # _q = _obj.metric[last_metric].summary.quantile.add()
-                    _q = _g.summary.quantile.add()
-                    _q.quantile = float(_metric['labels'][lbl])
-                    _q.value = float(_metric['value'])
+                if label_name == 'quantile':
+                    quantile = metric.summary.quantile.add()
+                    quantile.quantile = float(label_value)
+                    quantile.value = float(value)
                 # The upper_bounds are stored as "le" labels on string format
-                elif obj_map[_m] == 'histogram' and lbl == 'le':
-                    # _q = _obj.metric[last_metric].histogram.bucket.add()
-                    _q = _g.histogram.bucket.add()
-                    _q.upper_bound = float(_metric['labels'][lbl])
-                    _q.cumulative_count = long(float(_metric['value']))
-                else:
-                    # labels deduplication
-                    is_in_labels = False
-                    for _existing_lbl in _g.label:
-                        if lbl == _existing_lbl.name:
-                            is_in_labels = True
-                    if not is_in_labels:
-                        _l = _g.label.add()
-                        _l.name = lbl
-                        _l.value = _metric['labels'][lbl]
-        return _obj
+                elif label_name == 'le' and metric_type == 'histogram':
+                    bucket = metric.histogram.bucket.add()
+                    bucket.upper_bound = float(label_value)
+                    bucket.cumulative_count = long(float(value))
+                elif is_new:
+                    label = metric.label.add()
+                    label.name = label_name
+                    label.value = label_value
+
+        return message
+
+    @staticmethod
+    def _grouping_key(labels):
+        return frozenset((k, v) for k, v in iteritems(labels) if k not in PrometheusScraperMixin.UNWANTED_LABELS)
 
     def scrape_metrics(self, endpoint):
         """
@@ -530,7 +517,7 @@ class PrometheusScraperMixin(object):
             verify = False
         try:
             response = requests.get(
-                endpoint, headers=headers, stream=False, timeout=self.prometheus_timeout, cert=cert, verify=verify
+                endpoint, headers=headers, stream=True, timeout=self.prometheus_timeout, cert=cert, verify=verify
             )
         except requests.exceptions.SSLError:
             self.log.error("Invalid SSL settings for requesting %s endpoint", endpoint)
@@ -65,6 +65,10 @@ class AggregatorStub(object):
         if not self.ignore_metric(name):
             self._metrics[name].append(MetricStub(name, mtype, value, tags, hostname, None))
 
+    def submit_metrics(self, check, check_id, metrics):
+        for mtype, name, value, tags, hostname in metrics:
+            self.submit_metric(check, check_id, mtype, name, value, tags, hostname)
+
     def submit_metric_e2e(self, check, check_id, mtype, name, value, tags, hostname, device=None):
         # Device is only present in metrics read from the real agent in e2e tests. Normally it is submitted as a tag
         if not self.ignore_metric(name):
@@ -382,6 +386,7 @@ class AggregatorStub(object):
         self._asserted = set()
         self._service_checks = defaultdict(list)
         self._events = []
+        self._histogram_buckets = defaultdict(list)
 
     def all_metrics_asserted(self):
         assert self.metrics_asserted_pct >= 100.0
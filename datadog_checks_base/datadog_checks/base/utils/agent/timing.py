@@ -0,0 +1,138 @@
+# (C) Datadog, Inc. 2019
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+from threading import Lock
+from timeit import default_timer
+
+from six import iteritems
+
+from .common import METRIC_PROFILE_NAMESPACE
+
+
+class TimingProfileMetric(object):
+    __slots__ = ('name', 'value', 'phase')
+
+    def __init__(self, name, value, phase):
+        self.name = '{}.timing.{}'.format(METRIC_PROFILE_NAMESPACE, name)
+        self.value = float(value)
+        self.phase = phase
+
+
+class PhaseStats(object):
+    __slots__ = ('calls', 'duration', 'samples')
+
+    def __init__(self):
+        self.calls = 0
+        self.duration = 0.0
+        self.samples = 0
+
+
+class ProfileSpan(object):
+    """
+    Times a phase of a check run, as a context manager. The number of samples
+    handled during the phase can be recorded with `count`.
+    """
+
+    __slots__ = ('phase', 'profiler', 'samples', '_start')
+
+    def __init__(self, profiler, phase):
+        self.profiler = profiler
+        self.phase = phase
+        self.samples = 0
+        self._start = None
+
+    def count(self, samples=1):
+        self.samples += samples
+
+    def __enter__(self):
+        self._start = default_timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.record(self.phase, default_timer() - self._start, self.samples)
+
+
+class NoopSpan(object):
+    """
+    Stands for a `ProfileSpan` when profiling is disabled.
+    """
+
+    __slots__ = ()
+
+    def count(self, samples=1):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+def no_profile(phase):
+    return NOOP_SPAN
+
+
+class RunProfiler(object):
+    """
+    Accumulates the time spent in each phase of a check run, and the number of samples handled.
+    Phases can be nested, the time of an inner phase is also counted in the outer one.
+    Phases can be recorded from worker threads.
+    """
+
+    __slots__ = ('phases', '_lock')
+
+    def __init__(self):
+        self.phases = {}
+        self._lock = Lock()
+
+    def span(self, phase):
+        return ProfileSpan(self, phase)
+
+    def iterate(self, phase, iterable, count=None):
+        """
+        Time the production of each item of an iterable, e.g. a generator parsing a payload,
+        without the time spent by the consumer.
+
+        :param count: optional callable returning the number of samples of an item, defaults to 1 per item
+        """
+        iterator = iter(iterable)
+        duration = 0.0
+        samples = 0
+        try:
+            while True:
+                start = default_timer()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    duration += default_timer() - start
+                    return
+
+                duration += default_timer() - start
+                samples += 1 if count is None else count(item)
+                yield item
+        finally:
+            self.record(phase, duration, samples)
+
+    def record(self, phase, duration, samples=0):
+        with self._lock:
+            try:
+                stats = self.phases[phase]
+            except KeyError:
+                stats = self.phases[phase] = PhaseStats()
+
+            stats.calls += 1
+            stats.duration += duration
+            stats.samples += samples
+
+    def get_metrics(self):
+        metrics = []
+        for phase, stats in sorted(iteritems(self.phases)):
+            metrics.append(TimingProfileMetric('duration', stats.duration, phase))
+            metrics.append(TimingProfileMetric('calls', stats.calls, phase))
+            metrics.append(TimingProfileMetric('samples', stats.samples, phase))
+
+        return metrics
@@ -0,0 +1,72 @@
+# (C) Datadog, Inc. 2019
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+from collections import OrderedDict
+
+from six import PY3
+
+if PY3:
+
+    def _move_to_end(data, key):
+        data.move_to_end(key)
+
+
+else:
+
+    def _move_to_end(data, key):
+        data[key] = data.pop(key)
+
+
+class LRUCache(object):
+    """
+    LRUCache is a bounded mapping that evicts the least recently used entries
+    once `maxsize` is reached. It keeps hit, miss and eviction counters that
+    can be submitted as telemetry and reset with `reset_stats`.
+    """
+
+    __slots__ = ('_data', 'evictions', 'hits', 'maxsize', 'misses')
+
+    def __init__(self, maxsize):
+        """
+        :param maxsize: maximum number of entries to keep
+        """
+        self._data = OrderedDict()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        _move_to_end(self._data, key)
+        return value
+
+    def set(self, key, value):
+        data = self._data
+        if key in data:
+            _move_to_end(data, key)
+        data[key] = value
+
+        if len(data) > self.maxsize:
+            data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._data.clear()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
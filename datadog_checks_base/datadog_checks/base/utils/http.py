@@ -6,14 +6,18 @@ import os
 import threading
 import warnings
 from contextlib import contextmanager
+from time import time
 
 import requests
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
 from six import iteritems, string_types
 from six.moves.urllib.parse import urlparse
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 from urllib3.exceptions import InsecureRequestWarning
 
 from ..config import is_affirmative
 from ..errors import ConfigurationError
+from .agent.timing import no_profile
 from .headers import get_default_headers, update_headers
 
 try:
@@ -91,6 +95,7 @@ class RequestsWrapper(object):
         'no_proxy_uris',
         'options',
         'persist_connections',
+        'profile',
         'request_hooks',
     )
 
@@ -98,8 +103,11 @@ class RequestsWrapper(object):
     # manager that is provided changes module constants
     warning_lock = threading.Lock()
 
-    def __init__(self, instance, init_config, remapper=None, logger=None):
+    def __init__(self, instance, init_config, remapper=None, logger=None, profile=None):
         self.logger = logger or LOGGER
+
+        # Callable returning a context manager that times a phase, like `AgentCheck.profile`
+        self.profile = profile or no_profile
         default_fields = dict(STANDARD_FIELDS)
 
         # Update the default behavior for global settings
@@ -318,6 +326,7 @@ class RequestsWrapper(object):
             persist = self.persist_connections
 
         with ExitStack() as stack:
+            stack.enter_context(self.profile('http.request'))
             for hook in self.request_hooks:
                 stack.enter_context(hook())
 
@@ -367,6 +376,78 @@ class RequestsWrapper(object):
             pass
 
 
+class ConnectionStats(object):
+    """
+    Counters of the connections opened by a `PooledHTTPAdapter`, to be submitted and reset by its user.
+    They can be updated from several threads sharing the adapter.
+    """
+
+    __slots__ = ('_lock', 'connections', 'handshake_time', 'requests')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # Number of requests sent, to be incremented by the user of the adapter
+            self.requests = 0
+            # Number of connections established, and the total time spent doing so in seconds,
+            # including the TLS handshake for HTTPS connections
+            self.connections = 0
+            self.handshake_time = 0.0
+
+    def add_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def add_connection(self, handshake_time):
+        with self._lock:
+            self.connections += 1
+            self.handshake_time += handshake_time
+
+    @property
+    def reuse_ratio(self):
+        """
+        Share of the requests that were sent on an already established connection.
+        """
+        if not self.requests:
+            return 0.0
+        return max(self.requests - self.connections, 0) / float(self.requests)
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter keeping up to `pool_maxsize` connections alive per host, that records
+    the connections it establishes in `stats`.
+    """
+
+    def __init__(self, stats=None, pool_maxsize=DEFAULT_POOLSIZE, **kwargs):
+        self.stats = stats if stats is not None else ConnectionStats()
+        super(PooledHTTPAdapter, self).__init__(pool_maxsize=pool_maxsize, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(PooledHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _timed_connection_pool(HTTPConnectionPool, self.stats),
+            'https': _timed_connection_pool(HTTPSConnectionPool, self.stats),
+        }
+
+
+def _timed_connection_pool(pool_class, stats):
+    base_connection_class = pool_class.ConnectionCls
+
+    class TimedConnection(base_connection_class):
+        def connect(self):
+            start = time()
+            try:
+                return super(TimedConnection, self).connect()
+            finally:
+                stats.add_connection(time() - start)
+
+    return type('Timed{}'.format(pool_class.__name__), (pool_class,), {'ConnectionCls': TimedConnection})
+
+
 @contextmanager
 def handle_kerberos_keytab(keytab_file):
     # There are no keytab options in any wrapper libs. The env var will be
@@ -1,6 +1,9 @@
 # (C) Datadog, Inc. 2018
 # All rights reserved
 # Licensed under Simplified BSD License (see LICENSE)
+from math import log
+
+MASK_64 = (1 << 64) - 1
 
 
 class Limiter(object):
@@ -70,3 +73,132 @@ class Limiter(object):
         Returns the internal state of the limiter for unit tests
         """
         return (self.count, self.limit, self.reached_limit)
+
+
+def mix_hash(value):
+    """
+    Spreads the bits of a hash over 64 bits, the hash of small integers being the integers themselves.
+    This is the finalizer of MurmurHash3.
+    """
+    value &= MASK_64
+    value ^= value >> 33
+    value = (value * 0xFF51AFD7ED558CCD) & MASK_64
+    value ^= value >> 33
+    value = (value * 0xC4CEB9FE1A85EC53) & MASK_64
+    value ^= value >> 33
+    return value
+
+
+class HyperLogLog(object):
+    """
+    HyperLogLog estimates the number of distinct hashes added to it, using 2 ** precision bytes
+    with a standard error of 1.04 / sqrt(2 ** precision), 1.6% for the default precision.
+    The first hashes are kept as is, so that small cardinalities are exact.
+    See http://algo.inria.fr/flajolet/Publications/FlFuGaMe07.pdf
+    """
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.size = 1 << precision
+        self.alpha = 0.7213 / (1 + 1.079 / self.size)
+        # Hashes kept in a set take a lot more memory than a register each
+        self.exact_limit = self.size >> 3
+
+        self.exact = None
+        self.registers = None
+        # Sum of 2 ** (64 - register), and number of registers still at zero, updated on every change
+        self.inverse_sum = None
+        self.zeros = None
+        self.clear()
+
+    def clear(self):
+        self.exact = set()
+        self.registers = None
+        self.inverse_sum = self.size << 64
+        self.zeros = self.size
+
+    def add(self, value):
+        """
+        :param value: hash of the object to count
+        :returns: boolean, true if the estimated cardinality changed
+        """
+        value = mix_hash(value)
+
+        exact = self.exact
+        if exact is not None:
+            if value in exact:
+                return False
+
+            exact.add(value)
+            if len(exact) > self.exact_limit:
+                self.registers = bytearray(self.size)
+                self.exact = None
+                for value in exact:
+                    self._update_register(value)
+            return True
+
+        return self._update_register(value)
+
+    def _update_register(self, value):
+        bits = 64 - self.precision
+        index = value >> bits
+        # Position of the leftmost 1 in the remaining bits
+        rank = bits - (value & ((1 << bits) - 1)).bit_length() + 1
+
+        current = self.registers[index]
+        if rank <= current:
+            return False
+
+        self.registers[index] = rank
+        self.inverse_sum += (1 << (64 - rank)) - (1 << (64 - current))
+        if not current:
+            self.zeros -= 1
+        return True
+
+    def cardinality(self):
+        if self.exact is not None:
+            return len(self.exact)
+
+        size = self.size
+        estimate = self.alpha * size * size / (self.inverse_sum / float(1 << 64))
+        if estimate <= 2.5 * size and self.zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = size * log(size / float(self.zeros))
+
+        return int(round(estimate))
+
+
+class ContextLimiter(Limiter):
+    """
+    ContextLimiter counts every object by its uid, with a HyperLogLog instead of an exact set,
+    so that the memory used does not grow with the number of objects. The objects keep being
+    counted once the limit is reached, `count` estimates the total number of distinct objects.
+    Uids must be integer hashes.
+    """
+
+    def __init__(self, check_name, object_name, object_limit, warning_func=None, precision=12):
+        """
+        :param precision: the HyperLogLog uses 2 ** precision bytes, see `HyperLogLog`
+        """
+        super(ContextLimiter, self).__init__(check_name, object_name, object_limit, warning_func)
+        self.seen = HyperLogLog(precision)
+
+    def is_reached(self, uid=None):
+        """
+        :param uid: hash of the object, calls without one are ignored
+        :returns: boolean, true if limit exceeded
+        """
+        if uid is not None and self.seen.add(uid):
+            self.count = self.seen.cardinality()
+
+        if self.reached_limit:
+            return True
+
+        if self.count > self.limit:
+            if self.warning:
+                self.warning(
+                    "Check %s exceeded limit of %s %s, ignoring next ones", self.check_name, self.limit, self.name
+                )
+            self.reached_limit = True
+            return True
+        return False
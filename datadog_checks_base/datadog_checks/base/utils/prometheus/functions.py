@@ -3,9 +3,19 @@
 # Licensed under Simplified BSD License (see LICENSE)
 
 from google.protobuf.internal.decoder import _DecodeVarint32  # pylint: disable=E0611,E0401
+from google.protobuf.message import DecodeError
+from six import indexbytes
 
 from . import metrics_pb2
 
+WIRETYPE_VARINT = 0
+WIRETYPE_LENGTH_DELIMITED = 2
+
+# Field numbers of MetricFamily
+METRIC_FAMILY_NAME_FIELD = 1
+METRIC_FAMILY_TYPE_FIELD = 3
+METRIC_FAMILY_METRIC_FIELD = 4
+
 
 # Deprecated, please use the PrometheusCheck class
 def parse_metric_family(buf):
@@ -26,3 +36,112 @@ def parse_metric_family(buf):
         message = metrics_pb2.MetricFamily()
         message.ParseFromString(msg_buf)
         yield message
+
+
+def decode_varint(buf, pos):
+    """
+    Decode the varint starting at `pos` in `buf`, returning the value and the position right after it,
+    or None if `buf` ends before the varint does.
+    """
+    result = 0
+    shift = 0
+    end = len(buf)
+    while pos < end:
+        byte = indexbytes(buf, pos)
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+
+        shift += 7
+        if shift >= 64:
+            raise DecodeError('Too many bytes when decoding varint.')
+
+    return None
+
+
+def iter_delimited_messages(chunks):
+    """
+    Incrementally split a stream of bytes chunks, e.g. `requests.Response.iter_content()`, into the
+    messages it holds, each delimited by its varint32 length [1]. Messages are yielded as memoryviews
+    over the received chunks: only the bytes of a message spanning several chunks are copied.
+
+    [1] https://developers.google.com/protocol-buffers/docs/reference/java/com/google/protobuf/AbstractMessageLite#writeDelimitedTo(java.io.OutputStream)  # noqa: E501
+    """
+    pending = []
+    pending_size = 0
+    # Number of bytes needed before trying to decode the next message
+    needed = 1
+    for chunk in chunks:
+        if not chunk:
+            continue
+
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size < needed:
+            continue
+
+        buf = pending[0] if len(pending) == 1 else b''.join(pending)
+        view = memoryview(buf)
+        pos = 0
+        while True:
+            decoded = decode_varint(view, pos)
+            if decoded is None:
+                needed = pending_size - pos + 1
+                break
+
+            msg_len, start = decoded
+            end = start + msg_len
+            if end > pending_size:
+                needed = end - pos
+                break
+
+            yield view[start:end]
+            pos = end
+
+        pending = [buf[pos:]] if pos < pending_size else []
+        pending_size -= pos
+
+    if pending_size:
+        raise DecodeError('Truncated message.')
+
+
+def peek_metric_family(buf):
+    """
+    Return the name and type of a serialized MetricFamily without parsing its metrics, relying on the
+    fields being serialized in field number order, as Prometheus clients do. The name is None if it
+    cannot be found before the metrics.
+    """
+    view = memoryview(buf)
+    end = len(view)
+    pos = 0
+    name = None
+    # Default value of the `type` field
+    metric_type = metrics_pb2.COUNTER
+    while pos < end:
+        decoded = decode_varint(view, pos)
+        if decoded is None:
+            break
+
+        key, pos = decoded
+        field_number, wire_type = key >> 3, key & 0x7
+        if wire_type not in (WIRETYPE_VARINT, WIRETYPE_LENGTH_DELIMITED):
+            break
+
+        decoded = decode_varint(view, pos)
+        if decoded is None:
+            break
+
+        value, pos = decoded
+        if wire_type == WIRETYPE_VARINT:
+            if field_number == METRIC_FAMILY_TYPE_FIELD:
+                metric_type = value
+        elif field_number == METRIC_FAMILY_NAME_FIELD:
+            name = view[pos : pos + value].tobytes().decode('utf-8')
+            pos += value
+        elif field_number == METRIC_FAMILY_METRIC_FIELD:
+            break
+        else:
+            pos += value
+
+    return name, metric_type
@@ -6,3 +6,63 @@ try:
     import tagger
 except ImportError:
     from ..stubs import tagger  # noqa: F401
+
+
+class NormalizedTags(tuple):
+    """
+    A tuple of tags that are already of the native string type, and can be submitted as they are.
+    `AgentCheck` skips the normalization of their type, e.g. for tags computed once and submitted many times.
+    """
+
+    __slots__ = ()
+
+
+class TaggerCache(object):
+    """
+    TaggerCache caches the tags returned by the tagger for an entity and a cardinality during
+    a check run: every tagger call is a switch between python and the Agent, which adds up when
+    the tags of an entity are queried for every sample of a payload.
+
+    Tags are returned as tuples, as they are shared by all the callers. The cache MUST be reset
+    between check runs so that tag changes are picked up. It keeps hit and miss counters that
+    can be submitted as telemetry and reset with `reset_stats`.
+    """
+
+    __slots__ = ('_cache', 'hits', 'misses')
+
+    def __init__(self):
+        self._cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def tag(self, entity, cardinality):
+        """
+        :param entity: entity id, e.g. `container_id://<ID>`
+        :param cardinality: tagger cardinality, e.g. `tagger.HIGH`
+        :return: tuple of tags, empty if the entity is not found
+        """
+        key = (entity, cardinality)
+        try:
+            tags = self._cache[key]
+        except KeyError:
+            self.misses += 1
+            tags = self._cache[key] = tuple(tagger.tag(entity, cardinality) or ())
+            return tags
+
+        self.hits += 1
+        return tags
+
+    @property
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def reset(self):
+        self._cache.clear()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
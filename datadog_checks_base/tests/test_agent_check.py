@@ -13,6 +13,8 @@ from six import PY3
 from datadog_checks.base import AgentCheck
 from datadog_checks.base import __version__ as base_package_version
 from datadog_checks.base.checks.base import datadog_agent
+from datadog_checks.base.utils.limiter import ContextLimiter
+from datadog_checks.base.utils.tagging import NormalizedTags
 
 
 def test_instance():
@@ -306,6 +308,69 @@ class TestMetricNormalization:
         assert check.normalize(metric_name) == normalized_metric_name
 
 
+class NameCachedCheck(AgentCheck):
+    METRIC_NAME_CACHE_SIZE = 2
+
+
+class TestMetricNameCache:
+    def test_disabled_by_default(self):
+        check = AgentCheck()
+        assert check._metric_name_cache is None
+
+    def test_normalize(self):
+        check = NameCachedCheck()
+
+        assert check.normalize(u'Some Metric', prefix='prefix', fix_case=True) == 'prefix.some_metric'
+        assert check.normalize(u'Some Metric', prefix='prefix', fix_case=True) == 'prefix.some_metric'
+        # Each argument is part of the key
+        assert check.normalize(u'Some Metric', prefix='prefix') == 'prefix.Some_Metric'
+        assert check.normalize(u'Some Metric', fix_case=True) == 'some_metric'
+
+        cache = check._metric_name_cache
+        assert (cache.hits, cache.misses, cache.evictions) == (1, 3, 1)
+        assert len(cache) == 2
+
+    def test_convert_to_underscore_separated(self):
+        check = NameCachedCheck()
+
+        assert check.convert_to_underscore_separated('CamelCase') == b'camel_case'
+        assert check.convert_to_underscore_separated('CamelCase') == b'camel_case'
+        # Doesn't collide with the names returned by `normalize`
+        assert check.normalize('CamelCase') == 'CamelCase'
+
+        cache = check._metric_name_cache
+        assert (cache.hits, cache.misses) == (1, 2)
+
+    def test_run_telemetry(self, aggregator):
+        check = NameCachedCheck('test', {}, [{'metric_name_cache_telemetry': True}])
+
+        def check_method(_):
+            for name in ('a', 'b', 'a', 'c'):
+                check.gauge(check.normalize(name, prefix='test'), 0)
+
+        check.check = check_method
+        assert check.run() == ''
+
+        tags = ['check_name:test', 'check_version:{}'.format(check.check_version)]
+        aggregator.assert_metric('datadog.agent.check.metric_name_cache.size', value=2, tags=tags, count=1)
+        aggregator.assert_metric('datadog.agent.check.metric_name_cache.hits', value=1, tags=tags, count=1)
+        aggregator.assert_metric('datadog.agent.check.metric_name_cache.misses', value=3, tags=tags, count=1)
+        aggregator.assert_metric('datadog.agent.check.metric_name_cache.evictions', value=1, tags=tags, count=1)
+
+        # The stats are reset between runs, and nothing is sent for a run without lookups
+        aggregator.reset()
+        check.check = lambda _: None
+        assert check.run() == ''
+        assert not aggregator.metrics('datadog.agent.check.metric_name_cache.size')
+
+    def test_run_telemetry_disabled(self, aggregator):
+        check = NameCachedCheck('test', {}, [{}])
+        check.check = lambda _: check.normalize('a')
+        assert check.run() == ''
+
+        assert not aggregator.metrics('datadog.agent.check.metric_name_cache.size')
+
+
 class TestMetrics:
     def test_namespace(self, aggregator):
         check = AgentCheck()
@@ -333,6 +398,199 @@ class TestMetrics:
         aggregator.assert_metric(metric_name, count=0)
 
 
+class TestMetricBatch:
+    def test_rows(self, aggregator):
+        check = AgentCheck()
+        check.__NAMESPACE__ = 'test'
+
+        with mock.patch.object(aggregator, 'submit_metrics', wraps=aggregator.submit_metrics) as submit_metrics:
+            check.submit_metrics_batch(
+                aggregator.GAUGE, [('foo', 1, ['tag:1'], None), ('foo', 2, ['tag:2'], 'host'), ('bar', None, [], None)]
+            )
+
+            assert submit_metrics.call_count == 1
+
+        aggregator.assert_metric('test.foo', value=1, tags=['tag:1'], metric_type=aggregator.GAUGE, count=1)
+        aggregator.assert_metric('test.foo', value=2, tags=['tag:2'], hostname='host', count=1)
+        aggregator.assert_metric('test.bar', count=0)
+
+    def test_context_manager(self, aggregator):
+        check = AgentCheck()
+        tags = ['tag:1']
+
+        with mock.patch.object(aggregator, 'submit_metrics', wraps=aggregator.submit_metrics) as submit_metrics:
+            with check.submit_metrics_batch(aggregator.RATE) as batch:
+                batch.add('foo', 1, tags=tags)
+                check.gauge('bar', 2, tags=tags)
+                # Tags are copied when the metric is submitted
+                tags.append('tag:2')
+                check.count('baz', 3, tags=tags)
+                # Nested batches are merged
+                with check.submit_metrics_batch():
+                    check.monotonic_count('qux', 4, raw=True)
+                check.submit_metrics_batch(aggregator.GAUGE, [('quux', 5, None, None)])
+
+                aggregator.assert_metric('foo', count=0)
+
+            assert submit_metrics.call_count == 1
+
+        aggregator.assert_metric('foo', value=1, tags=['tag:1'], metric_type=aggregator.RATE)
+        aggregator.assert_metric('bar', value=2, tags=['tag:1'], metric_type=aggregator.GAUGE)
+        aggregator.assert_metric('baz', value=3, tags=['tag:1', 'tag:2'], metric_type=aggregator.COUNT)
+        aggregator.assert_metric('qux', value=4, metric_type=aggregator.MONOTONIC_COUNT)
+        aggregator.assert_metric('quux', value=5, metric_type=aggregator.GAUGE)
+        aggregator.assert_all_metrics_covered()
+
+    def test_histogram_bucket(self, aggregator):
+        check = AgentCheck()
+        check.__NAMESPACE__ = 'test'
+        tags = ['tag:1']
+
+        with check.submit_metrics_batch(aggregator.GAUGE) as batch:
+            check.submit_histogram_bucket('histo', 1, 0.0, 1.0, True, 'host', tags)
+            check.submit_histogram_bucket('histo', None, 1.0, 2.0, True, 'host', tags)
+            tags.append('tag:2')
+
+            assert len(batch.rows) == 1
+            assert not aggregator.histogram_bucket('histo')
+
+        # Histogram buckets are submitted raw
+        aggregator.assert_histogram_bucket('histo', 1, 0.0, 1.0, True, 'host', ['tag:1'], count=1)
+
+    def test_normalized_tags(self, aggregator):
+        check = AgentCheck()
+        tags = NormalizedTags(['tag:1'])
+
+        with mock.patch.object(check, '_normalize_tags_type', wraps=check._normalize_tags_type) as normalize_tags_type:
+            with check.submit_metrics_batch(aggregator.GAUGE) as batch:
+                batch.add('foo', 1, tags=tags)
+                check.submit_histogram_bucket('histo', 1, 0.0, 1.0, True, 'host', tags)
+
+                assert all(row[3] is tags for row in batch.rows)
+
+        assert [type(call[0][0]) for call in normalize_tags_type.call_args_list] == [NormalizedTags, NormalizedTags]
+        aggregator.assert_metric('foo', value=1, tags=['tag:1'], count=1)
+        aggregator.assert_histogram_bucket('histo', 1, 0.0, 1.0, True, 'host', ['tag:1'], count=1)
+
+    def test_flush_when_full(self, aggregator):
+        check = AgentCheck()
+        check.METRIC_BATCH_SIZE = 2
+
+        with check.submit_metrics_batch(aggregator.GAUGE) as batch:
+            for i in range(3):
+                batch.add('foo', i)
+
+            aggregator.assert_metric('foo', count=2)
+
+        aggregator.assert_metric('foo', count=3)
+
+    def test_limiter(self, aggregator):
+        check = LimitedCheck()
+
+        with check.submit_metrics_batch():
+            for _ in range(0, 20):
+                check.gauge('metric', 0)
+
+        assert len(check.get_warnings()) == 1
+        assert len(aggregator.metrics('metric')) == 10
+
+    def test_non_float_metric(self, aggregator):
+        check = AgentCheck()
+        with pytest.raises(ValueError):
+            with check.submit_metrics_batch():
+                check.gauge('test_metric', '85k')
+
+        aggregator.assert_metric('test_metric', count=0)
+
+    def test_recording(self, aggregator):
+        check = AgentCheck()
+        check.METRIC_BATCH_SIZE = 2
+
+        with check.submit_metrics_batch(aggregator.GAUGE) as batch:
+            batch.add('foo', 1)
+            recording = batch.start_recording()
+            for i in range(3):
+                check.gauge('bar', i, tags=['tag:{}'.format(i)])
+            batch.stop_recording(recording)
+            batch.add('baz', 4)
+
+        assert [row[1:3] for row in recording] == [('bar', 0), ('bar', 1), ('bar', 2)]
+
+        aggregator.reset()
+        with check.submit_metrics_batch() as batch:
+            batch.extend(recording)
+
+        for i in range(3):
+            aggregator.assert_metric('bar', value=i, tags=['tag:{}'.format(i)], metric_type=aggregator.GAUGE, count=1)
+        aggregator.assert_all_metrics_covered()
+
+
+class ProfiledCheck(AgentCheck):
+    def check(self, instance):
+        with self.profile('fetch'):
+            items = [1, 2, 3]
+
+        with self.submit_metrics_batch():
+            with self.profile('transform') as span:
+                for item in self.profile_iter('parse', items):
+                    span.count()
+                    self.gauge('metric', item)
+
+
+class TestProfiling:
+    def test_disabled(self, aggregator):
+        check = ProfiledCheck('test', {}, [{}])
+        items = [1, 2, 3]
+
+        assert check.profile_iter('parse', items) is items
+        with check.profile('fetch') as span:
+            span.count(3)
+
+        assert check.run() == ''
+        aggregator.assert_metric('metric', count=3)
+        assert not [name for name in aggregator.metric_names if name.startswith('datadog.agent.profile')]
+
+    def test_run(self, aggregator):
+        check = ProfiledCheck('test', {'profile_timing': True}, [{}])
+
+        assert check.run() == ''
+
+        aggregator.assert_metric('metric', count=3)
+        for phase, calls, samples in (('check', 1, 0), ('fetch', 1, 0), ('parse', 1, 3), ('transform', 1, 3)):
+            tags = ['check_name:test', 'check_version:{}'.format(check.check_version), 'phase:{}'.format(phase)]
+            aggregator.assert_metric('datadog.agent.profile.timing.duration', tags=tags, count=1)
+            aggregator.assert_metric('datadog.agent.profile.timing.calls', value=calls, tags=tags, count=1)
+            samples_stubs = [
+                stub for stub in aggregator.metrics('datadog.agent.profile.timing.samples') if stub.tags == sorted(tags)
+            ]
+            assert [stub.value for stub in samples_stubs] == [samples]
+
+        # The metrics submitted in bulk
+        tags = ['check_name:test', 'check_version:{}'.format(check.check_version), 'phase:submit']
+        aggregator.assert_metric('datadog.agent.profile.timing.samples', value=3, tags=tags, count=1)
+
+        # Profiling stops with the run
+        assert check._run_profiler is None
+
+    def test_http(self, aggregator):
+        check = ProfiledCheck('test', {'profile_timing': True}, [{}])
+        check.check = lambda _: check.http.get('http://localhost')
+
+        with mock.patch('requests.get'):
+            assert check.run() == ''
+
+        tags = ['check_name:test', 'check_version:{}'.format(check.check_version), 'phase:http.request']
+        aggregator.assert_metric('datadog.agent.profile.timing.calls', value=1, tags=tags, count=1)
+
+    def test_run_error(self, aggregator):
+        check = ProfiledCheck('test', {'profile_timing': True}, [{}])
+        check.check = mock.MagicMock(side_effect=Exception('error'))
+
+        assert 'error' in check.run()
+        assert check._run_profiler is None
+        aggregator.assert_metric('datadog.agent.profile.timing.duration', count=0)
+
+
 class TestEvents:
     def test_valid_event(self, aggregator):
         check = AgentCheck()
@@ -577,6 +835,68 @@ class TestLimits:
         assert len(aggregator.metrics("metric")) == 10
 
 
+class ContextLimitedCheck(LimitedCheck):
+    LIMIT_METRIC_CONTEXTS = True
+
+
+class TestContextLimits:
+    def test_context_hash(self, aggregator):
+        check = ContextLimitedCheck()
+
+        # Test stability of the hash against tag ordering
+        context = check._context_hash(aggregator.GAUGE, "test.metric", ["one", "two"], None)
+        assert context == check._context_hash(aggregator.GAUGE, "test.metric", ["two", "one"], None)
+
+        # Test all fields impact the hash
+        assert context != check._context_hash(aggregator.RATE, "test.metric", ["one", "two"], None)
+        assert context != check._context_hash(aggregator.GAUGE, "test.metric2", ["one", "two"], None)
+        assert context != check._context_hash(aggregator.GAUGE, "test.metric", ["two"], None)
+        assert context != check._context_hash(aggregator.GAUGE, "test.metric", ["one", "two"], "host")
+
+    def test_metric_limit_gauges(self, aggregator):
+        check = ContextLimitedCheck()
+
+        # Multiple calls for a single context should not trigger
+        for _ in range(0, 20):
+            check.gauge("metric", 0)
+        assert len(check.get_warnings()) == 0
+        assert len(aggregator.metrics("metric")) == 20
+
+        # Only 9 new contexts should pass through
+        for i in range(0, 20):
+            check.gauge("metric", 0, tags=["tag:{}".format(i)])
+        assert len(check.get_warnings()) == 1
+        assert len(aggregator.metrics("metric")) == 29
+
+    def test_run_telemetry(self, aggregator):
+        check = ContextLimitedCheck('test', {}, [{}])
+
+        def check_method(_):
+            for i in range(0, 20):
+                check.count("metric", 0, tags=["tag:{}".format(i)])
+                check.count("metric", 0, tags=["tag:{}".format(i)])
+
+        check.check = check_method
+        assert check.run() == ''
+        assert len(aggregator.metrics("metric")) == 20
+
+        tags = ['check_name:test', 'check_version:{}'.format(check.check_version)]
+        aggregator.assert_metric('datadog.agent.check.metric_contexts', value=20, tags=tags, count=1)
+
+        # The limiter is reset between runs
+        assert check.metric_limiter.get_status() == (0, 10, False)
+
+    def test_instance_config(self, aggregator):
+        check = LimitedCheck('test', {}, [{'limit_metric_contexts': True}])
+        assert isinstance(check.metric_limiter, ContextLimiter)
+
+        check = ContextLimitedCheck('test', {}, [{'limit_metric_contexts': False}])
+        assert not isinstance(check.metric_limiter, ContextLimiter)
+
+        check.run()
+        aggregator.assert_metric('datadog.agent.check.metric_contexts', count=0)
+
+
 class TestCheckInitializations:
     def test_default(self):
         class TestCheck(AgentCheck):
@@ -0,0 +1,38 @@
+# (C) Datadog, Inc. 2019
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+from prometheus_client.core import HistogramMetricFamily
+
+from datadog_checks.checks.openmetrics import OpenMetricsBaseCheck
+
+BUCKET_BOUNDS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0]
+
+
+def histogram_samples(contexts, bounds):
+    """
+    Return the samples of a histogram with the given number of label sets, each with a bucket per bound plus +Inf.
+    """
+    metric = HistogramMetricFamily('request_duration_seconds', 'Request duration', labels=['cluster', 'code'])
+    for i in range(contexts):
+        buckets = [(str(bound), j * 10.0 + i) for j, bound in enumerate(bounds)]
+        buckets.append(('+Inf', len(bounds) * 10.0 + i))
+        metric.add_metric(['cluster_{}'.format(i), str(200 + i % 5)], buckets, sum_value=i * 100.0)
+
+    return metric.samples
+
+
+def test_decumulate_histogram_buckets(benchmark):
+    check = OpenMetricsBaseCheck('openmetrics_check', {}, {})
+    # 10k buckets
+    samples = histogram_samples(588, BUCKET_BOUNDS)
+    metric = HistogramMetricFamily('request_duration_seconds', 'Request duration')
+
+    def setup():
+        metric.samples = [(name, dict(labels), value) for name, labels, value in samples]
+        return (metric,), {}
+
+    benchmark.pedantic(check._decumulate_histogram_buckets, setup=setup, rounds=50)
+
+    buckets = [sample for sample in metric.samples if sample[0].endswith('_bucket')]
+    assert len(buckets) == 588 * (len(BUCKET_BOUNDS) + 1)
+    assert all(sample[2] == 10.0 for sample in buckets if sample[1]['lower_bound'] != '0')
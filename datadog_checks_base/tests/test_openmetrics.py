@@ -4,20 +4,38 @@
 # All rights reserved
 # Licensed under Simplified BSD License (see LICENSE)
 import copy
+import hashlib
 import logging
 import math
 import os
+import threading
 
 import mock
 import pytest
 import requests
+from google.protobuf.internal.encoder import _VarintBytes  # pylint: disable=E0611,E0401
 from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily, SummaryMetricFamily
+from prometheus_client.parser import text_fd_to_metric_families
 from six import iteritems
-
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+from urllib3.exceptions import MaxRetryError, ProtocolError
+
+from datadog_checks.base.checks.openmetrics.label_joins import LabelJoinIndex
+from datadog_checks.base.checks.openmetrics.parser import iter_chunk_lines, text_lines_to_metric_families
+from datadog_checks.base.checks.openmetrics.protobuf_parser import (
+    count_samples,
+    metric_family_to_metric,
+    protobuf_chunks_to_metric_families,
+)
+from datadog_checks.base.utils.prometheus import metrics_pb2
+from datadog_checks.base.utils.prometheus.functions import iter_delimited_messages
+from datadog_checks.base.utils.tagging import NormalizedTags
 from datadog_checks.checks.openmetrics import OpenMetricsBaseCheck
 from datadog_checks.dev import get_here
 
 text_content_type = 'text/plain; version=0.0.4'
+protobuf_content_type = 'application/vnd.google.protobuf; proto=io.prometheus.client.MetricFamily; encoding=delimited'
 
 
 class MockResponse:
@@ -25,14 +43,26 @@ class MockResponse:
     MockResponse is used to simulate the object requests.Response commonly returned by requests.get
     """
 
-    def __init__(self, content, content_type):
+    def __init__(self, content, content_type, status_code=200, headers=None):
         self.content = content
+        self.status_code = status_code
         self.headers = {'Content-Type': content_type}
+        if headers:
+            self.headers.update(headers)
 
-    def iter_lines(self, **_):
-        for elt in self.content.split("\n"):
+    def iter_lines(self, chunk_size=512, **_):
+        content = b''.join(self.iter_content(chunk_size=chunk_size)).decode('utf-8')
+        for elt in content.split("\n"):
             yield elt
 
+    def iter_content(self, chunk_size=1, **_):
+        content = self.content if isinstance(self.content, bytes) else self.content.encode('utf-8')
+        for i in range(0, len(content), chunk_size):
+            yield content[i : i + chunk_size]
+
+    def raise_for_status(self):
+        pass
+
     def close(self):
         pass
 
@@ -1065,23 +1095,6 @@ def test_decumulate_histogram_buckets_single_bucket(p_check, mocked_prometheus_s
     assert sorted(expected_metric.samples, key=lambda i: i[0]) == sorted(current_metric.samples, key=lambda i: i[0])
 
 
-def test_compute_bucket_hash(p_check):
-    check = p_check
-
-    # two different buckets should have the same hash for the same other tags values
-    tags1 = {"url": "http://127.0.0.1:8080/api", "verb": "GET", "le": "1"}
-    tags2 = {"url": "http://127.0.0.1:8080/api", "verb": "GET", "le": "2"}
-    assert check._compute_bucket_hash(tags1) == check._compute_bucket_hash(tags2)
-
-    # tag order should not matter
-    tags3 = {"verb": "GET", "le": "+inf", "url": "http://127.0.0.1:8080/api"}
-    assert check._compute_bucket_hash(tags1) == check._compute_bucket_hash(tags3)
-
-    # changing a tag value should change the context hash
-    tags4 = {"url": "http://127.0.0.1:8080/api", "verb": "DELETE", "le": "1"}
-    assert check._compute_bucket_hash(tags1) != check._compute_bucket_hash(tags4)
-
-
 def test_decumulate_histogram_buckets_multiple_contexts(p_check, mocked_prometheus_scraper_config):
     # buckets are not necessary ordered
     text_data = (
@@ -2095,3 +2108,893 @@ def test_metadata_transformer(mocked_openmetrics_check_factory, text_data):
         m.assert_any_call('test:123', 'version.raw', 'v1.6.0-alpha.0.680+3872cb93abf948-dirty')
         m.assert_any_call('test:123', 'version.scheme', 'semver')
         assert m.call_count == 7
+
+
+@pytest.mark.parametrize('fixture_name', ['metrics.txt', 'ksm.txt', 'deprecated.txt'])
+def test_streaming_parser_matches_prometheus_client(fixture_name):
+    f_name = os.path.join(get_here(), 'fixtures', 'prometheus', fixture_name)
+    with open(f_name, 'r') as f:
+        text_data = f.read()
+
+    expected = list(text_fd_to_metric_families(text_data.split('\n')))
+    # Use a small chunk size so that lines are split across chunks
+    chunks = MockResponse(text_data, text_content_type).iter_content(chunk_size=7)
+    assert list(text_lines_to_metric_families(iter_chunk_lines(chunks))) == expected
+
+
+def test_streaming_parser_skipped_families():
+    text_data = (
+        '# HELP foo Foo.\n'
+        '# TYPE foo gauge\n'
+        'foo{a="1"} 1\n'
+        'foo{a="2"} 2\n'
+        '# TYPE bar counter\n'
+        'bar{a="1"} 3\n'
+        'baz 4\n'
+    )
+    skipped = []
+
+    metrics = list(
+        text_lines_to_metric_families(
+            iter_chunk_lines([text_data.encode('utf-8')]),
+            family_filter=lambda name, metric_type: name != 'foo',
+            on_skipped_family=lambda *args: skipped.append(args),
+        )
+    )
+
+    assert [(metric.name, metric.type, metric.samples) for metric in metrics] == [
+        ('bar', 'counter', [('bar', {'a': '1'}, 3.0)]),
+        ('baz', 'untyped', [('baz', {}, 4.0)]),
+    ]
+    assert skipped == [('foo', 'gauge', 2)]
+
+
+@pytest.mark.parametrize('telemetry', [False, True])
+def test_streaming_parser_submissions(aggregator, mocked_prometheus_check, telemetry):
+    f_name = os.path.join(get_here(), 'fixtures', 'prometheus', 'ksm.txt')
+    with open(f_name, 'r') as f:
+        text_data = f.read()
+
+    def run(use_streaming_parser):
+        check = mocked_prometheus_check
+        instance = copy.deepcopy(PROMETHEUS_CHECK_INSTANCE)
+        instance['prometheus_url'] = 'http://fake.endpoint:10055/{}'.format(use_streaming_parser)
+        instance['metrics'] = [{'kube_pod_container_status_restarts': 'pod.restart'}, 'kube_node_*']
+        instance['ignore_metrics'] = ['kube_node_info']
+        instance['label_joins'] = {'kube_pod_info': {'label_to_match': 'pod', 'labels_to_get': ['node']}}
+        instance['telemetry'] = telemetry
+        instance['use_streaming_parser'] = use_streaming_parser
+        config = check.get_scraper_config(instance)
+        check.poll = mock.MagicMock(return_value=MockResponse(text_data, text_content_type))
+
+        # First run builds the label mapping
+        check.process(config)
+        check.process(config, metric_transformers={'kube_pod_status_ready': check.submit_openmetric})
+        submitted = {name: sorted(stubs) for name, stubs in iteritems(aggregator._metrics)}
+        aggregator.reset()
+        return submitted
+
+    expected = run(False)
+    assert expected
+    assert run(True) == expected
+
+
+PROTOBUF_CHECK_INSTANCE = {
+    'prometheus_url': 'http://fake.endpoint:10055/metrics',
+    'metrics': ['skydns_*', 'http_request_*', 'go_memstats_*'],
+    'ignore_metrics': ['go_memstats_heap_alloc_bytes'],
+    'type_overrides': {'go_goroutines': 'gauge'},
+    'namespace': 'prometheus',
+}
+
+
+def text_to_protobuf(text_data):
+    """
+    Encode a text payload in the protobuf format as the Go client does, the +Inf buckets being implicit.
+    """
+    payload = []
+    for family in text_fd_to_metric_families(text_data.split('\n')):
+        message = metrics_pb2.MetricFamily(
+            name=family.name, help=family.documentation, type=getattr(metrics_pb2, family.type.upper())
+        )
+        metrics = {}
+        for name, labels, value in family.samples:
+            metric_labels = tuple((k, v) for k, v in iteritems(labels) if k not in ('le', 'quantile'))
+            metric = metrics.get(metric_labels)
+            if metric is None:
+                metric = metrics[metric_labels] = message.metric.add()
+                for label_name, label_value in metric_labels:
+                    metric.label.add(name=label_name, value=label_value)
+
+            if family.type in ('counter', 'gauge', 'untyped'):
+                getattr(metric, family.type).value = value
+                continue
+
+            values = getattr(metric, family.type)
+            if name.endswith('_sum'):
+                values.sample_sum = value
+            elif name.endswith('_count'):
+                values.sample_count = int(value)
+            elif family.type == 'summary':
+                values.quantile.add(quantile=float(labels['quantile']), value=value)
+            elif labels['le'] != '+Inf':
+                values.bucket.add(upper_bound=float(labels['le']), cumulative_count=int(value))
+
+        payload.append(_VarintBytes(message.ByteSize()))
+        payload.append(message.SerializeToString())
+
+    return b''.join(payload)
+
+
+def test_protobuf_parser():
+    text_data = (
+        '# HELP foo Foo.\n'
+        '# TYPE foo histogram\n'
+        'foo_bucket{a="1",le="0.5"} 1\n'
+        'foo_bucket{a="1",le="+Inf"} 2\n'
+        'foo_sum{a="1"} 3\n'
+        'foo_count{a="1"} 2\n'
+        '# TYPE bar summary\n'
+        'bar{quantile="0.99"} 4\n'
+        'bar_sum 5\n'
+        'bar_count 6\n'
+        '# TYPE baz gauge\n'
+        'baz{a="1"} 7\n'
+        'baz{a="2"} 8\n'
+    )
+    payload = text_to_protobuf(text_data)
+    chunks = [payload[i : i + 5] for i in range(0, len(payload), 5)]
+
+    metrics = list(protobuf_chunks_to_metric_families(chunks))
+    expected = list(text_fd_to_metric_families(text_data.split('\n')))
+    assert [(m.name, m.type, m.samples) for m in metrics] == [(m.name, m.type, m.samples) for m in expected]
+
+    skipped = []
+    metrics = list(
+        protobuf_chunks_to_metric_families(
+            chunks,
+            family_filter=lambda name, metric_type: metric_type != 'gauge',
+            on_skipped_family=lambda *args: skipped.append(args),
+            blacklist=['a="1"'],
+            on_blacklisted=lambda sample_count: skipped.append(sample_count),
+        )
+    )
+    assert [(m.name, len(m.samples)) for m in metrics] == [('foo', 0), ('bar', 3)]
+    assert skipped == [4, 1, ('baz', 'gauge', 1)]
+
+    # Skipped families are counted without being converted
+    with mock.patch(
+        'datadog_checks.base.checks.openmetrics.protobuf_parser.metric_family_to_metric', wraps=metric_family_to_metric
+    ) as convert:
+        skipped = []
+        metrics = list(
+            protobuf_chunks_to_metric_families(
+                chunks,
+                family_filter=lambda name, metric_type: metric_type == 'gauge',
+                on_skipped_family=lambda *args: skipped.append(args),
+            )
+        )
+    assert convert.call_count == 1
+    assert skipped == [('foo', 'histogram', 4), ('bar', 'summary', 3)]
+
+
+@pytest.mark.parametrize('blacklist', [None, ['system="reverse"'], ['go_']])
+def test_protobuf_count_samples(text_data, blacklist):
+    payload = text_to_protobuf(text_data)
+    messages = []
+    for buf in iter_delimited_messages([payload]):
+        message = metrics_pb2.MetricFamily()
+        message.ParseFromString(bytes(buf))
+        messages.append(message)
+
+    counted = []
+    expected = []
+    for message in messages:
+        counted.append(count_samples(message, blacklist, counted.append))
+        expected.append(len(metric_family_to_metric(message, blacklist, expected.append).samples))
+
+    assert len(messages) > 1
+    assert counted == expected
+
+
+@pytest.mark.parametrize('telemetry', [False, True])
+@pytest.mark.parametrize('non_cumulative_buckets', [False, True])
+def test_protobuf_submissions(aggregator, mocked_prometheus_check, text_data, telemetry, non_cumulative_buckets):
+    protobuf_data = text_to_protobuf(text_data)
+
+    def run(use_protobuf_format):
+        check = mocked_prometheus_check
+        instance = copy.deepcopy(PROTOBUF_CHECK_INSTANCE)
+        instance['prometheus_url'] = 'http://fake.endpoint:10055/{}'.format(use_protobuf_format)
+        instance['non_cumulative_buckets'] = non_cumulative_buckets
+        instance['telemetry'] = telemetry
+        instance['use_protobuf_format'] = use_protobuf_format
+        config = check.get_scraper_config(instance)
+        config['_text_filter_blacklist'] = ['system="reverse"']
+        if use_protobuf_format:
+            response = MockResponse(protobuf_data, protobuf_content_type)
+        else:
+            response = MockResponse(text_data, text_content_type)
+        check.poll = mock.MagicMock(return_value=response)
+
+        check.process(config, metric_transformers={'go_goroutines': check.submit_openmetric})
+        # The telemetry is compared by totals, the payloads having different sizes
+        aggregator._metrics.pop('prometheus.telemetry.payload.size', None)
+        submitted = {
+            name: sum(stub.value for stub in stubs) if '.telemetry.' in name else sorted(stubs)
+            for name, stubs in iteritems(aggregator._metrics)
+        }
+        aggregator.reset()
+        return submitted
+
+    expected = run(False)
+    assert expected
+    assert run(True) == expected
+
+
+def test_protobuf_format_negotiation(aggregator, mocked_prometheus_check, text_data):
+    check = mocked_prometheus_check
+    instance = dict(PROTOBUF_CHECK_INSTANCE, use_protobuf_format=True)
+    config = check.get_scraper_config(instance)
+
+    # Endpoints that don't support the protobuf format answer with the text format
+    with mock.patch('requests.get', return_value=MockResponse(text_data, text_content_type)) as get:
+        check.process(config)
+        assert get.call_args[1]['headers']['accept'] == check.PROTOBUF_ACCEPT_HEADER
+
+    aggregator.assert_metric('prometheus.skydns_skydns_dns_cachemiss_count_total')
+    aggregator.reset()
+
+    with mock.patch('requests.get', return_value=MockResponse(text_to_protobuf(text_data), protobuf_content_type)):
+        check.process(config)
+
+    aggregator.assert_metric('prometheus.skydns_skydns_dns_cachemiss_count_total')
+
+    aggregator.reset()
+
+    # The text format is requested in the same run after a protobuf payload could not be decoded
+    responses = [MockResponse(b'\xff', protobuf_content_type), MockResponse(text_data, text_content_type)]
+    with mock.patch('requests.get', side_effect=responses) as get:
+        check.process(config)
+        assert get.call_count == 2
+        assert 'accept' not in get.call_args[1]['headers']
+
+    aggregator.assert_metric('prometheus.skydns_skydns_dns_cachemiss_count_total')
+    aggregator.reset()
+
+    with mock.patch('requests.get', return_value=MockResponse(text_data, text_content_type)) as get:
+        check.process(config)
+        assert 'accept' not in get.call_args[1]['headers']
+
+
+def test_protobuf_format_retry(aggregator, mocked_prometheus_check, text_data):
+    check = mocked_prometheus_check
+    check.PROTOBUF_FORMAT_RETRY_RUNS = 3
+    instance = dict(PROTOBUF_CHECK_INSTANCE, use_protobuf_format=True)
+    config = check.get_scraper_config(instance)
+
+    responses = [MockResponse(b'\xff', protobuf_content_type), MockResponse(text_data, text_content_type)]
+    with mock.patch('requests.get', side_effect=responses):
+        check.process(config)
+
+    # The protobuf format is requested again after some successful runs in the text format
+    with mock.patch('requests.get', return_value=MockResponse(text_data, text_content_type)) as get:
+        for _ in range(2):
+            assert config['_protobuf_format_failed']
+            check.process(config)
+            assert 'accept' not in get.call_args[1]['headers']
+
+        assert not config['_protobuf_format_failed']
+        check.process(config)
+        assert get.call_args[1]['headers']['accept'] == check.PROTOBUF_ACCEPT_HEADER
+
+
+@pytest.mark.parametrize('use_streaming_parser', [True, False])
+def test_protobuf_format_fallback(aggregator, mocked_prometheus_check, text_data, use_streaming_parser):
+    check = mocked_prometheus_check
+    instance = dict(PROTOBUF_CHECK_INSTANCE, use_protobuf_format=True, use_streaming_parser=use_streaming_parser)
+
+    def submissions(responses):
+        instance['prometheus_url'] = 'http://fake.endpoint:10055/{}'.format(len(responses))
+        config = check.get_scraper_config(instance)
+        with mock.patch('requests.get', side_effect=responses):
+            check.process(config)
+        submitted = {name: sorted(stubs) for name, stubs in iteritems(aggregator._metrics)}
+        aggregator.reset()
+        return submitted
+
+    expected = submissions([MockResponse(text_data, text_content_type)])
+    # The families decoded before the error are submitted once
+    truncated = MockResponse(text_to_protobuf(text_data)[:-1], protobuf_content_type)
+    assert expected
+    assert submissions([truncated, MockResponse(text_data, text_content_type)]) == expected
+
+
+def test_dispatch_plan(mocked_prometheus_check, mocked_prometheus_scraper_config):
+    config = mocked_prometheus_scraper_config
+    config['metrics_mapper'] = {'foo': 'mapped.foo', 'bar_*': 'bar_*'}
+    config['ignore_metrics'] = ['baz']
+    transformer = mock.MagicMock()
+    plan = config['_dispatch_plan']
+
+    assert plan.get('foo', config, {'qux': transformer}) == (False, 'mapped.foo', None, False)
+    assert plan.get('bar_total', config, {'qux': transformer}) == (False, None, None, True)
+    assert plan.get('baz', config, {'qux': transformer}) == (True, None, None, False)
+    assert plan.get('qux', config, {'qux': transformer}) == (False, None, transformer, False)
+    assert plan.get('unknown', config, {'qux': transformer}) == (False, None, None, False)
+    assert len(plan) == 5
+
+    # Equivalent transformers don't invalidate the plan
+    assert plan.get('foo', config, {'qux': transformer}).mapped_name == 'mapped.foo'
+    assert len(plan) == 5
+
+    # Configuration changes do
+    config['metrics_mapper']['unknown'] = 'mapped.unknown'
+    assert plan.get('unknown', config, {'qux': transformer}).mapped_name == 'mapped.unknown'
+    assert len(plan) == 1
+
+    config['ignore_metrics'] = ['unknown']
+    assert plan.get('unknown', config, {'qux': transformer}).ignored is True
+
+    assert plan.get('qux', config, None).transformer is None
+
+    # Changes that keep the size of the configuration are also detected
+    config['metrics_mapper']['foo'] = 'renamed.foo'
+    assert plan.get('foo', config, None).mapped_name == 'renamed.foo'
+    config['ignore_metrics'][0] = 'foo'
+    assert plan.get('foo', config, None).ignored is True
+
+
+def test_dispatch_plan_changed_in_place(aggregator, mocked_prometheus_check, text_data):
+    check = mocked_prometheus_check
+    instance = copy.deepcopy(PROMETHEUS_CHECK_INSTANCE)
+    config = check.get_scraper_config(instance)
+    check.poll = mock.MagicMock(return_value=MockResponse(text_data, text_content_type))
+
+    check.process(config)
+    aggregator.assert_metric('prometheus.process.vm.bytes', count=1)
+    aggregator.reset()
+
+    # The plan is validated at the start of every scrape
+    config['metrics_mapper']['process_virtual_memory_bytes'] = 'process.vm.renamed'
+    check.process(config)
+    aggregator.assert_metric('prometheus.process.vm.bytes', count=0)
+    aggregator.assert_metric('prometheus.process.vm.renamed', count=1)
+    assert config['_dispatch_plan_validated'] is False
+
+
+def test_dispatch_plan_process_metric(aggregator, mocked_prometheus_check, mocked_prometheus_scraper_config, ref_gauge):
+    check = mocked_prometheus_check
+    config = mocked_prometheus_scraper_config
+    config['_dry_run'] = False
+
+    check.process_metric(ref_gauge, config)
+    aggregator.assert_metric('prometheus.process.vm.bytes', count=1)
+
+    config['ignore_metrics'].append('process_virtual_memory_bytes')
+    check.process_metric(ref_gauge, config)
+    aggregator.assert_metric('prometheus.process.vm.bytes', count=1)
+
+
+def test_label_tags_cache(aggregator, mocked_prometheus_check, mocked_prometheus_scraper_config):
+    check = mocked_prometheus_check
+    config = mocked_prometheus_scraper_config
+    cache = config['_label_tags_cache']
+    sample = ('process_virtual_memory_bytes', {'foo': 'bar', 'baz': 'qux'}, 1.0)
+
+    assert sorted(check._metric_tags('process.vm.bytes', 1.0, sample, config)) == ['baz:qux', 'foo:bar']
+    assert sorted(check._metric_tags('process.vm.bytes', 1.0, sample, config)) == ['baz:qux', 'foo:bar']
+    assert (len(cache), cache.hits, cache.misses) == (1, 1, 1)
+
+    # Changing how labels are rendered invalidates the cache
+    config['labels_mapper']['foo'] = 'renamed'
+    assert sorted(check._metric_tags('process.vm.bytes', 1.0, sample, config)) == ['baz:qux', 'renamed:bar']
+    config['exclude_labels'].append('baz')
+    assert check._metric_tags('process.vm.bytes', 1.0, sample, config) == ('renamed:bar',)
+    assert len(cache) == 1
+
+    # Changes that keep the size of the settings are also detected
+    config['labels_mapper']['foo'] = 'other'
+    assert check._metric_tags('process.vm.bytes', 1.0, sample, config) == ('other:bar',)
+    config['exclude_labels'][-1] = 'foo'
+    assert check._metric_tags('process.vm.bytes', 1.0, sample, config) == ('baz:qux',)
+
+
+def test_label_tags_cache_constant_tags(aggregator, mocked_prometheus_check, mocked_prometheus_scraper_config):
+    check = mocked_prometheus_check
+    config = mocked_prometheus_scraper_config
+    config['custom_tags'] = ['env:dev']
+    config['_metric_tags'] = ['foo:bar']
+    sample = ('process_virtual_memory_bytes', {'baz': 'qux'}, 1.0)
+
+    tags = check._metric_tags('process.vm.bytes', 1.0, sample, config)
+    assert tags == ('env:dev', 'foo:bar', 'baz:qux')
+    # The same tuple is submitted for every sample with these labels
+    assert check._metric_tags('process.vm.bytes', 1.0, sample, config) is tags
+
+    config['_metric_tags'][:] = ['foo:baz']
+    assert check._metric_tags('process.vm.bytes', 1.0, sample, config) == ('env:dev', 'foo:baz', 'baz:qux')
+
+    check.gauge('process.vm.bytes', 1.0, tags=tags)
+    aggregator.assert_metric('process.vm.bytes', tags=['env:dev', 'foo:bar', 'baz:qux'])
+
+
+class FinalizingCheck(OpenMetricsBaseCheck):
+    def _finalize_tags_to_submit(self, _tags, metric_name, val, metric, custom_tags=None, hostname=None):
+        _tags.append('extra:tag')
+        return _tags
+
+
+def test_label_tags_cache_finalize_override(mocked_prometheus_check):
+    sample = ('process_virtual_memory_bytes', {'foo': 'bar'}, 1.0)
+
+    config = mocked_prometheus_check.create_scraper_configuration(PROMETHEUS_CHECK_INSTANCE)
+    assert config['_finalize_tags_overridden'] is False
+
+    # Checks overriding `_finalize_tags_to_submit` get a list they can modify
+    check = FinalizingCheck('prometheus_check', {}, {})
+    config = check.create_scraper_configuration(PROMETHEUS_CHECK_INSTANCE)
+    assert config['_finalize_tags_overridden'] is True
+    for _ in range(2):
+        assert check._metric_tags('process.vm.bytes', 1.0, sample, config) == ['foo:bar', 'extra:tag']
+
+
+def test_label_tags_cache_batch(aggregator, mocked_prometheus_check, text_data):
+    check = mocked_prometheus_check
+    instance = dict(PROMETHEUS_CHECK_INSTANCE, tags=['custom:tag'])
+    config = check.get_scraper_config(instance)
+    check.poll = mock.MagicMock(return_value=MockResponse(text_data, text_content_type))
+
+    with mock.patch.object(check, '_normalize_tags_type', wraps=check._normalize_tags_type) as normalize_tags_type:
+        check.process(config)
+
+    # The cached tags are submitted through the batch of `process` without being normalized again
+    calls = normalize_tags_type.call_args_list
+    tags = [call[0][0] for call in calls if call[0][2:] == ('prometheus.process.vm.bytes',)]
+    assert tags
+    assert all(type(tag_list) is NormalizedTags for tag_list in tags)
+    aggregator.assert_metric('prometheus.process.vm.bytes', 54927360.0, tags=['custom:tag'], count=1)
+
+
+def test_label_tags_cache_eviction(mocked_prometheus_check):
+    check = mocked_prometheus_check
+    instance = dict(PROMETHEUS_CHECK_INSTANCE, label_tags_cache_size=2)
+    config = check.create_scraper_configuration(instance)
+    cache = config['_label_tags_cache']
+
+    for i in range(5):
+        sample = ('process_virtual_memory_bytes', {'foo': str(i)}, 1.0)
+        assert check._metric_tags('process.vm.bytes', 1.0, sample, config) == ('foo:{}'.format(i),)
+
+    assert len(cache) == 2
+    assert cache.evictions == 3
+
+
+def test_label_tags_cache_disabled(mocked_prometheus_check):
+    check = mocked_prometheus_check
+    instance = dict(PROMETHEUS_CHECK_INSTANCE, label_tags_cache_size=0)
+    config = check.create_scraper_configuration(instance)
+    sample = ('process_virtual_memory_bytes', {'foo': 'bar'}, 1.0)
+
+    assert config['_label_tags_cache'] is None
+    assert check._metric_tags('process.vm.bytes', 1.0, sample, config) == ['foo:bar']
+
+
+def test_label_tags_cache_telemetry(aggregator, mocked_prometheus_check, text_data):
+    check = mocked_prometheus_check
+    instance = dict(PROMETHEUS_CHECK_INSTANCE, telemetry=True)
+    config = check.get_scraper_config(instance)
+    check.poll = mock.MagicMock(return_value=MockResponse(text_data, text_content_type))
+
+    check.process(config)
+    check.process(config)
+
+    def values(name):
+        return [stub.value for stub in aggregator.metrics('prometheus.telemetry.tags.cache.{}'.format(name))]
+
+    assert values('size') == [1, 1]
+    assert values('misses') == [1, 0]
+    assert values('hits') == [0, 1]
+    assert values('evictions') == [0, 0]
+
+
+class KeepAliveServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def keep_alive_endpoint():
+    """
+    Serve a metrics payload over HTTP/1.1 and count the connections that are opened.
+    """
+    payload = b'# TYPE process_virtual_memory_bytes gauge\nprocess_virtual_memory_bytes 54927360.0\n'
+    connections = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            connections.append(self.client_address)
+            BaseHTTPRequestHandler.setup(self)
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', text_content_type)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = KeepAliveServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:{}/metrics'.format(server.server_address[1]), connections
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_persist_connections(aggregator, mocked_prometheus_check, keep_alive_endpoint):
+    endpoint, connections = keep_alive_endpoint
+    check = mocked_prometheus_check
+    instance = dict(PROMETHEUS_CHECK_INSTANCE, prometheus_url=endpoint, persist_connections=True, telemetry=True)
+    config = check.get_scraper_config(instance)
+
+    for _ in range(3):
+        check.process(config)
+
+    assert len(connections) == 1
+    aggregator.assert_metric('prometheus.process.vm.bytes', 54927360.0, count=3)
+
+    def values(name):
+        return [stub.value for stub in aggregator.metrics('prometheus.telemetry.connections.{}'.format(name))]
+
+    assert values('opened.count') == [1, 0, 0]
+    assert values('reuse.ratio') == [0, 1, 1]
+    handshake_times = values('handshake.time')
+    assert handshake_times[0] > 0
+    assert handshake_times[1:] == [0, 0]
+
+
+def test_persist_connections_disabled(mocked_prometheus_check, keep_alive_endpoint):
+    endpoint, connections = keep_alive_endpoint
+    check = mocked_prometheus_check
+    config = check.get_scraper_config(dict(PROMETHEUS_CHECK_INSTANCE, prometheus_url=endpoint))
+
+    for _ in range(3):
+        check.process(config)
+
+    assert len(connections) == 3
+    assert config['_session'] is None
+
+
+def test_persist_connections_idle_timeout(mocked_prometheus_check, keep_alive_endpoint):
+    endpoint, connections = keep_alive_endpoint
+    check = mocked_prometheus_check
+    instance = dict(PROMETHEUS_CHECK_INSTANCE, prometheus_url=endpoint, persist_connections=True)
+    config = check.get_scraper_config(instance)
+
+    check.process(config)
+    session = config['_session']
+    check.process(config)
+    assert config['_session'] is session
+    assert len(connections) == 1
+
+    config['_session_last_used'] -= config['connection_idle_timeout'] + 1
+    check.process(config)
+    assert config['_session'] is not session
+    assert len(connections) == 2
+
+
+def dropped_connection_error():
+    """
+    Return the error raised by requests when the endpoint closed a connection that was kept open.
+    """
+    return requests.exceptions.ConnectionError(ProtocolError('Connection aborted.', OSError(104, 'Connection reset')))
+
+
+def test_persist_connections_redial(mocked_prometheus_check, keep_alive_endpoint):
+    endpoint, connections = keep_alive_endpoint
+    check = mocked_prometheus_check
+    instance = dict(PROMETHEUS_CHECK_INSTANCE, prometheus_url=endpoint, persist_connections=True)
+    config = check.get_scraper_config(instance)
+
+    check.process(config)
+    session = config['_session']
+
+    with mock.patch.object(session, 'get', side_effect=dropped_connection_error()):
+        check.process(config)
+
+    assert config['_session'] is not session
+    assert len(connections) == 2
+    assert config['_connection_stats'].requests == 3
+
+
+@pytest.mark.parametrize(
+    'error',
+    [
+        pytest.param(requests.exceptions.ConnectTimeout('connect timeout'), id='connect timeout'),
+        pytest.param(requests.exceptions.ConnectionError(MaxRetryError(None, '/', 'refused')), id='refused'),
+    ],
+)
+def test_persist_connections_no_retry(mocked_prometheus_check, keep_alive_endpoint, error):
+    endpoint, connections = keep_alive_endpoint
+    check = mocked_prometheus_check
+    instance = dict(PROMETHEUS_CHECK_INSTANCE, prometheus_url=endpoint, persist_connections=True)
+    config = check.get_scraper_config(instance)
+
+    check.process(config)
+    session = config['_session']
+
+    # Endpoints that can't be connected to are only requested once
+    with mock.patch.object(session, 'get', side_effect=error) as get:
+        with pytest.raises(type(error)):
+            check.process(config)
+
+    assert get.call_count == 1
+    assert config['_session'] is session
+    assert config['_connection_stats'].requests == 2
+
+
+def test_persist_connections_shared_session(mocked_prometheus_check, keep_alive_endpoint):
+    endpoint, connections = keep_alive_endpoint
+    check = mocked_prometheus_check
+    instance = dict(PROMETHEUS_CHECK_INSTANCE, prometheus_url=endpoint, persist_connections=True)
+    config = check.get_scraper_config(instance)
+    config['_shared_session'] = True
+
+    check.process(config)
+    session = config['_session']
+
+    # The session might be used by other threads, it's kept and the connection that failed is replaced
+    get = session.get
+    errors = [dropped_connection_error()]
+
+    def fail_once(url, **kwargs):
+        if errors:
+            raise errors.pop()
+        return get(url, **kwargs)
+
+    with mock.patch.object(session, 'get', side_effect=fail_once):
+        check.process(config)
+
+    assert config['_session'] is session
+    assert config['_connection_stats'].requests == 3
+
+
+def test_replay_unchanged_payloads(aggregator, mocked_prometheus_check, text_data):
+    check = mocked_prometheus_check
+    instance = dict(PROMETHEUS_CHECK_INSTANCE, replay_unchanged_payloads=True, telemetry=True)
+    config = check.get_scraper_config(instance)
+    check.poll = mock.MagicMock(return_value=MockResponse(text_data, text_content_type))
+
+    def submissions():
+        return sorted(
+            (stub.name, stub.value, tuple(stub.tags)) for stub in aggregator.metrics('prometheus.process.vm.bytes')
+        )
+
+    with mock.patch.object(check, 'parse_metric_family', wraps=check.parse_metric_family) as parse_metric_family:
+        check.process(config)
+        first_run = submissions()
+        assert not config['_payload_unchanged']
+        aggregator.reset()
+
+        # The payload is hashed as it is parsed, so it's only known to be unchanged afterwards
+        check.process(config)
+        assert parse_metric_family.call_count == 2
+        assert submissions() == first_run
+        assert config['_payload_unchanged']
+        aggregator.reset()
+
+        check.process(config)
+        assert parse_metric_family.call_count == 2
+        assert submissions() == first_run
+        assert [stub.value for stub in aggregator.metrics('prometheus.telemetry.payload.replayed.count')] == [1]
+        aggregator.reset()
+
+        # Changed payloads are processed
+        check.poll.return_value = MockResponse(text_data.replace('5.492736e+07', '42.0'), text_content_type)
+        check.process(config)
+        assert parse_metric_family.call_count == 3
+        assert not config['_payload_unchanged']
+        aggregator.assert_metric('prometheus.process.vm.bytes', 42.0, count=1)
+        aggregator.reset()
+
+        check.process(config)
+        assert parse_metric_family.call_count == 4
+        assert config['_payload_unchanged']
+        aggregator.reset()
+
+        # The submissions are replayed up to `payload_cache_max_age` seconds
+        config['_payload_cache'] = config['_payload_cache']._replace(
+            timestamp=config['_payload_cache'].timestamp - config['payload_cache_max_age'] - 1
+        )
+        check.process(config)
+        assert parse_metric_family.call_count == 5
+        aggregator.assert_metric('prometheus.process.vm.bytes', 42.0, count=1)
+
+
+def test_replay_unchanged_payloads_streaming_digest(mocked_prometheus_check, text_data):
+    check = mocked_prometheus_check
+    instance = dict(PROMETHEUS_CHECK_INSTANCE, replay_unchanged_payloads=True)
+    config = check.get_scraper_config(instance)
+    check.poll = mock.MagicMock(return_value=MockResponse(text_data, text_content_type))
+
+    with mock.patch.object(check, '_get_payload_digest', wraps=check._get_payload_digest) as get_payload_digest:
+        check.process(config)
+        check.process(config)
+        # The payload is only read in memory before being parsed once it was found unchanged
+        assert get_payload_digest.call_count == 0
+        assert config['_payload_cache'].digest == hashlib.sha256(text_data.encode('utf-8')).hexdigest()
+
+        check.process(config)
+        assert get_payload_digest.call_count == 1
+
+
+def test_replay_unchanged_payloads_distribution_buckets(aggregator, mocked_prometheus_check):
+    check = mocked_prometheus_check
+    instance = dict(
+        PROMETHEUS_CHECK_INSTANCE,
+        metrics=[{'my_histogram': 'custom.histogram'}],
+        replay_unchanged_payloads=True,
+        send_distribution_buckets=True,
+    )
+    config = check.get_scraper_config(instance)
+    text_data = (
+        '# HELP my_histogram my_histogram\n'
+        '# TYPE my_histogram histogram\n'
+        'my_histogram_bucket{le="1"} 1\n'
+        'my_histogram_bucket{le="+Inf"} 4\n'
+        'my_histogram_sum 1337\n'
+        'my_histogram_count 4\n'
+    )
+    check.poll = mock.MagicMock(return_value=MockResponse(text_data, text_content_type))
+
+    with mock.patch.object(check, 'parse_metric_family', wraps=check.parse_metric_family) as parse_metric_family:
+        for _ in range(3):
+            check.process(config)
+
+    # The last run is replayed, histogram buckets included
+    assert parse_metric_family.call_count == 2
+    buckets = aggregator.histogram_bucket('prometheus.custom.histogram')
+    assert len(buckets) == 6
+    assert sorted((bucket.lower_bound, bucket.upper_bound) for bucket in buckets[4:]) == [
+        (0.0, 1.0),
+        (1.0, float('inf')),
+    ]
+
+
+def test_replay_unchanged_payloads_conditional_request(aggregator, mocked_prometheus_check, text_data):
+    check = mocked_prometheus_check
+    instance = dict(PROMETHEUS_CHECK_INSTANCE, replay_unchanged_payloads=True)
+    config = check.get_scraper_config(instance)
+    validators = {'ETag': '"abc"', 'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+
+    with mock.patch('requests.get', return_value=MockResponse(text_data, text_content_type, headers=validators)) as get:
+        check.process(config)
+        assert 'If-None-Match' not in get.call_args[1]['headers']
+
+    aggregator.assert_metric('prometheus.process.vm.bytes', 54927360.0, count=1)
+    aggregator.reset()
+
+    with mock.patch('requests.get', return_value=MockResponse('', text_content_type, status_code=304)) as get:
+        check.process(config)
+        headers = get.call_args[1]['headers']
+        assert headers['If-None-Match'] == '"abc"'
+        assert headers['If-Modified-Since'] == 'Wed, 21 Oct 2015 07:28:00 GMT'
+
+    aggregator.assert_metric('prometheus.process.vm.bytes', 54927360.0, count=1)
+
+
+def test_replay_unchanged_payloads_dry_run(aggregator, mocked_prometheus_check, text_data):
+    check = mocked_prometheus_check
+    instance = dict(
+        PROMETHEUS_CHECK_INSTANCE,
+        replay_unchanged_payloads=True,
+        label_joins={'process_virtual_memory_bytes': {'label_to_match': 'foo', 'labels_to_get': ['bar']}},
+    )
+    config = check.get_scraper_config(instance)
+    check.poll = mock.MagicMock(return_value=MockResponse(text_data, text_content_type))
+
+    # Nothing is submitted during the dry run, so there is nothing to replay
+    check.process(config)
+    assert config['_payload_cache'] is None
+    aggregator.assert_metric('prometheus.process.vm.bytes', count=0)
+
+    check.process(config)
+    check.process(config)
+    aggregator.assert_metric('prometheus.process.vm.bytes', 54927360.0, count=2)
+
+
+def test_label_join_index():
+    index = LabelJoinIndex()
+    index.store('pod', 'pod-1', {'node': 'node-1'})
+    index.store('pod', 'pod-1', {'phase': 'Running'})
+    index.store('pod', 'pod-2', {'node': 'node-2'})
+    index.store('namespace', 'default', {'team': 'core'})
+    assert len(index) == 3
+
+    sample_labels = {'pod': 'pod-1', 'namespace': 'default', 'container': 'agent'}
+    index.join(sample_labels, {'pod', 'namespace'})
+    assert sample_labels == {
+        'pod': 'pod-1',
+        'namespace': 'default',
+        'container': 'agent',
+        'node': 'node-1',
+        'phase': 'Running',
+        'team': 'core',
+    }
+
+    # Everything was stored during the first generation
+    index.collect()
+    assert len(index) == 3
+
+    # Entries are kept as long as they are stored or joined on
+    index.store('pod', 'pod-2', {'node': 'node-2'})
+    index.join({'namespace': 'default'}, {'pod', 'namespace'})
+    index.join({'pod': 'pod-3'}, {'pod', 'namespace'})
+    index.collect()
+    assert index.mapping == {'pod': {'pod-2': {'node': 'node-2'}}, 'namespace': {'default': {'team': 'core'}}}
+    assert index.generation == 2
+
+    index.collect()
+    assert index.mapping == {'pod': {}, 'namespace': {}}
+
+
+def test_label_joins_dry_run(aggregator, mocked_prometheus_check, mocked_prometheus_scraper_config, mock_get):
+    check = mocked_prometheus_check
+    mocked_prometheus_scraper_config['namespace'] = 'ksm'
+    mocked_prometheus_scraper_config['label_joins'] = {
+        'kube_pod_info': {'label_to_match': 'pod', 'labels_to_get': ['node']}
+    }
+    mocked_prometheus_scraper_config['metrics_mapper'] = {'kube_pod_status_ready': 'pod.ready'}
+
+    with mock.patch.object(check, '_join_labels', wraps=check._join_labels) as join_labels:
+        # The first run only fills the index
+        check.process(mocked_prometheus_scraper_config)
+        assert join_labels.call_count == 0
+        assert len(mocked_prometheus_scraper_config['_label_join_index']) == 15
+        aggregator.assert_metric('ksm.pod.ready', count=0)
+
+        check.process(mocked_prometheus_scraper_config)
+        assert join_labels.call_count > 0
+
+    aggregator.assert_metric(
+        'ksm.pod.ready',
+        tags=[
+            'pod:dd-agent-62bgh',
+            'namespace:default',
+            'condition:true',
+            'node:gke-foobar-test-kube-default-pool-9b4ff111-0kch',
+        ],
+        value=1,
+    )
+
+
+def test_profile_timing(aggregator, text_data):
+    instance = dict(OPENMETRICS_CHECK_INSTANCE)
+    check = OpenMetricsBaseCheck('openmetrics_check', {'profile_timing': True}, [instance])
+    check.poll = mock.MagicMock(return_value=MockResponse(text_data, text_content_type))
+
+    assert check.run() == ''
+
+    aggregator.assert_metric('openmetrics.process.vm.bytes', count=1)
+    for phase in ('openmetrics.fetch', 'openmetrics.parse', 'openmetrics.process', 'submit'):
+        aggregator.assert_metric_has_tag('datadog.agent.profile.timing.duration', 'phase:{}'.format(phase), count=1)
+
+    samples = {
+        stub.tags[-1]: stub.value
+        for stub in aggregator.metrics('datadog.agent.profile.timing.samples')
+        if stub.tags[-1] in ('phase:openmetrics.parse', 'phase:openmetrics.process')
+    }
+    # Untyped metrics are dropped by the parsing
+    parsed = sum(
+        len(metric.samples)
+        for metric in text_fd_to_metric_families(text_data.split('\n'))
+        if metric.type in OpenMetricsBaseCheck.METRIC_TYPES
+    )
+    assert samples == {'phase:openmetrics.parse': parsed, 'phase:openmetrics.process': parsed}
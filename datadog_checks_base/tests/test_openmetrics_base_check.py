@@ -1,9 +1,12 @@
 import os
+from io import BytesIO
 
 import pytest
+import requests
 from mock import patch
 
 from datadog_checks.checks.openmetrics import OpenMetricsBaseCheck
+from datadog_checks.errors import CheckException
 
 FIXTURE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'fixtures', 'bearer_tokens')
 
@@ -198,3 +201,103 @@ def test_bearer_token_not_found():
     }
     with pytest.raises(IOError):
         OpenMetricsBaseCheck('prometheus_check', {}, {}, [instance])
+
+
+def mock_get(payloads):
+    """
+    Return a replacement of `requests.get` serving the given payloads by endpoint, or raising them.
+    """
+
+    def get(endpoint, **_):
+        payload = payloads[endpoint]
+        if isinstance(payload, Exception):
+            raise payload
+
+        response = requests.Response()
+        response.status_code = 200
+        response.headers['Content-Type'] = 'text/plain; version=0.0.4'
+        response.encoding = 'utf-8'
+        response.raw = BytesIO(payload.encode('utf-8'))
+        return response
+
+    return get
+
+
+def multi_endpoint_instance(endpoints, **options):
+    instance = {
+        'prometheus_urls': endpoints,
+        'namespace': 'openmetrics',
+        'metrics': [{'process_virtual_memory_bytes': 'process.vm.bytes'}],
+    }
+    instance.update(options)
+    return instance
+
+
+@pytest.mark.parametrize('concurrent_scrapes', [1, 2, 4])
+def test_prometheus_urls(aggregator, concurrent_scrapes):
+    endpoints = ['http://endpoint{}/metrics'.format(i) for i in range(3)]
+    payloads = {
+        endpoint: '# TYPE process_virtual_memory_bytes gauge\nprocess_virtual_memory_bytes{{pod="{}"}} {}\n'.format(
+            i, i * 10
+        )
+        for i, endpoint in enumerate(endpoints)
+    }
+    instance = multi_endpoint_instance(endpoints, concurrent_scrapes=concurrent_scrapes)
+    check = OpenMetricsBaseCheck('openmetrics_check', {}, {}, [instance])
+
+    assert sorted(check.config_map) == endpoints
+
+    with patch('requests.get', side_effect=mock_get(payloads)):
+        check.check(instance)
+
+    for i, endpoint in enumerate(endpoints):
+        aggregator.assert_metric('openmetrics.process.vm.bytes', i * 10, tags=['pod:{}'.format(i)], count=1)
+        aggregator.assert_service_check(
+            'openmetrics.prometheus.health', OpenMetricsBaseCheck.OK, tags=['endpoint:{}'.format(endpoint)], count=1
+        )
+        assert check.config_map[endpoint]['_prefetched_response'] is None
+    aggregator.assert_all_metrics_covered()
+
+
+@pytest.mark.parametrize('concurrent_scrapes', [1, 4])
+def test_prometheus_urls_endpoint_failure(aggregator, concurrent_scrapes):
+    endpoints = ['http://endpoint0/metrics', 'http://endpoint1/metrics']
+    payloads = {
+        endpoints[0]: requests.exceptions.ConnectionError('connection refused'),
+        endpoints[1]: '# TYPE process_virtual_memory_bytes gauge\nprocess_virtual_memory_bytes 10\n',
+    }
+    instance = multi_endpoint_instance(endpoints, concurrent_scrapes=concurrent_scrapes)
+    check = OpenMetricsBaseCheck('openmetrics_check', {}, {}, [instance])
+
+    with patch('requests.get', side_effect=mock_get(payloads)):
+        with pytest.raises(CheckException, match='Unable to scrape 1 of 2 endpoints: {}'.format(endpoints[0])):
+            check.check(instance)
+
+    aggregator.assert_metric('openmetrics.process.vm.bytes', 10, count=1)
+    aggregator.assert_service_check(
+        'openmetrics.prometheus.health', OpenMetricsBaseCheck.CRITICAL, tags=['endpoint:{}'.format(endpoints[0])]
+    )
+    aggregator.assert_service_check(
+        'openmetrics.prometheus.health', OpenMetricsBaseCheck.OK, tags=['endpoint:{}'.format(endpoints[1])]
+    )
+
+
+def test_prefetch_response_deadline(aggregator):
+    endpoint = 'http://endpoint0/metrics'
+    payload = '# TYPE process_virtual_memory_bytes gauge\n' + 'process_virtual_memory_bytes 10\n' * 10000
+    instance = multi_endpoint_instance([endpoint], scrape_deadline=5)
+    check = OpenMetricsBaseCheck('openmetrics_check', {}, {}, [instance])
+    scraper_config = check.get_scraper_configs(instance)[0]
+
+    # Every chunk takes 1 second to be received
+    clock = iter(range(100))
+    with patch('requests.get', side_effect=mock_get({endpoint: payload})):
+        with patch('datadog_checks.base.checks.openmetrics.mixins.time', side_effect=lambda: next(clock)):
+            check.prefetch_response(scraper_config)
+
+    with pytest.raises(requests.exceptions.Timeout):
+        check.poll(scraper_config)
+    assert scraper_config['_prefetched_response'] is None
+    aggregator.assert_service_check(
+        'openmetrics.prometheus.health', OpenMetricsBaseCheck.CRITICAL, tags=['endpoint:{}'.format(endpoint)]
+    )
@@ -9,11 +9,13 @@ import os
 import mock
 import pytest
 import requests
+from google.protobuf.message import DecodeError
 from six import iteritems, iterkeys
 from six.moves import range
 
 from datadog_checks.checks.prometheus import PrometheusCheck, UnknownFormatError
 from datadog_checks.utils.prometheus import metrics_pb2, parse_metric_family
+from datadog_checks.utils.prometheus.functions import iter_delimited_messages, peek_metric_family
 
 protobuf_content_type = 'application/vnd.google.protobuf; proto=io.prometheus.client.MetricFamily; encoding=delimited'
 
@@ -31,6 +33,10 @@ class MockResponse:
         for elt in self.content.split("\n"):
             yield elt
 
+    def iter_content(self, chunk_size=1, **_):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i : i + chunk_size]
+
     def close(self):
         pass
 
@@ -256,6 +262,46 @@ def test_parse_metric_family_unsupported(bin_data, mocked_prometheus_check):
         list(check.parse_metric_family(response))
 
 
+@pytest.mark.parametrize('chunk_size', [1, 7, 1024, 100000])
+def test_iter_delimited_messages(bin_data, chunk_size):
+    chunks = MockResponse(bin_data, protobuf_content_type).iter_content(chunk_size=chunk_size)
+    messages = list(iter_delimited_messages(chunks))
+
+    assert len(messages) == 61
+    assert [peek_metric_family(m)[0] for m in messages] == [m.name for m in parse_metric_family(bin_data)]
+
+
+def test_iter_delimited_messages_truncated(bin_data):
+    with pytest.raises(DecodeError):
+        list(iter_delimited_messages([bin_data[:-1]]))
+
+
+def test_parse_metric_family_protobuf_ignored(bin_data, mocked_prometheus_check):
+    check = mocked_prometheus_check
+    check.ignore_metrics = ['go_goroutines', 'go_gc_duration_seconds']
+    check.label_joins = {'go_gc_duration_seconds': {'label_to_match': 'quantile', 'labels_to_get': []}}
+
+    with mock.patch.object(metrics_pb2.MetricFamily, 'ParseFromString', autospec=True) as parse:
+        list(check.parse_metric_family(MockResponse(bin_data, protobuf_content_type)))
+        # The ignored metric is skipped before being parsed
+        assert parse.call_count == 60
+
+    names = [m.name for m in check.parse_metric_family(MockResponse(bin_data, protobuf_content_type))]
+    assert len(names) == 60
+    assert 'go_goroutines' not in names
+    # Needed for the label joins
+    assert 'go_gc_duration_seconds' in names
+
+
+def test_parse_metric_family_text_ignored(text_data, mocked_prometheus_check):
+    check = mocked_prometheus_check
+    check.ignore_metrics = ['go_memstats_heap_alloc_bytes']
+
+    names = [m.name for m in check.parse_metric_family(MockResponse(text_data, 'text/plain; version=0.0.4'))]
+    assert len(names) == 39
+    assert 'go_memstats_heap_alloc_bytes' not in names
+
+
 def test_process(bin_data, mocked_prometheus_check, ref_gauge):
     endpoint = "http://fake.endpoint:10055/metrics"
     check = mocked_prometheus_check
@@ -331,7 +377,11 @@ def test_process_metric_filtered(mocked_prometheus_check):
 def test_poll_protobuf(mocked_prometheus_check, bin_data):
     """ Tests poll using the protobuf format """
     check = mocked_prometheus_check
-    mock_response = mock.MagicMock(status_code=200, content=bin_data, headers={'Content-Type': protobuf_content_type})
+    mock_response = mock.MagicMock(
+        status_code=200,
+        iter_content=lambda **kwargs: iter([bin_data]),
+        headers={'Content-Type': protobuf_content_type},
+    )
     with mock.patch('requests.get', return_value=mock_response, __name__="get"):
         response = check.poll("http://fake.endpoint:10055/metrics")
         messages = list(check.parse_metric_family(response))
@@ -1957,3 +2007,32 @@ def test_text_filter_input():
 
     filtered = [x for x in check._text_filter_input(lines_in)]
     assert filtered == expected_out
+
+
+def test_parse_summary_named_like_count(p_check):
+    text_data = (
+        '# HELP kubelet_containers_per_pod_count The number of containers per pod.\n'
+        '# TYPE kubelet_containers_per_pod_count summary\n'
+        'kubelet_containers_per_pod_count{quantile="0.5"} 1\n'
+        'kubelet_containers_per_pod_count{quantile="0.9"} 2\n'
+        'kubelet_containers_per_pod_count_sum 25\n'
+        'kubelet_containers_per_pod_count_count 21\n'
+    )
+
+    expected_metric = metrics_pb2.MetricFamily()
+    expected_metric.help = "The number of containers per pod."
+    expected_metric.name = "kubelet_containers_per_pod_count"
+    expected_metric.type = 2
+
+    summary_metric = expected_metric.metric.add()
+    summary_metric.summary.sample_count = 21
+    summary_metric.summary.sample_sum = 25.0
+    for quantile, value in ((0.5, 1.0), (0.9, 2.0)):
+        summary_quantile = summary_metric.summary.quantile.add()
+        summary_quantile.quantile = quantile
+        summary_quantile.value = value
+
+    response = MockResponse(text_data, 'text/plain; version=0.0.4')
+    metrics = list(p_check.parse_metric_family(response))
+
+    assert metrics == [expected_metric]
@@ -10,9 +10,11 @@ import mock
 import pytest
 from six import PY3
 
+from datadog_checks.base.utils.cache import LRUCache
 from datadog_checks.base.utils.common import ensure_bytes, ensure_unicode, pattern_filter, round_value
 from datadog_checks.base.utils.containers import iter_unique
-from datadog_checks.base.utils.limiter import Limiter
+from datadog_checks.base.utils.limiter import ContextLimiter, HyperLogLog, Limiter
+from datadog_checks.base.utils.tagging import TaggerCache, tagger
 
 
 class Item:
@@ -117,6 +119,141 @@ class TestLimiter:
         assert limiter.get_status() == (1, 10, False)
 
 
+class TestHyperLogLog:
+    def test_exact(self):
+        hll = HyperLogLog()
+        for i in range(hll.exact_limit):
+            assert hll.add(i) is True
+            assert hll.add(i) is False
+        assert hll.cardinality() == hll.exact_limit
+        assert hll.registers is None
+
+    @pytest.mark.parametrize('cardinality', [1000, 10000, 100000])
+    def test_estimate(self, cardinality):
+        hll = HyperLogLog()
+        for _ in range(2):
+            for i in range(cardinality):
+                hll.add(i)
+
+        assert hll.exact is None
+        # 3 standard errors
+        assert abs(hll.cardinality() - cardinality) < cardinality * 0.05
+
+    def test_clear(self):
+        hll = HyperLogLog()
+        for i in range(10000):
+            hll.add(i)
+
+        hll.clear()
+        assert hll.cardinality() == 0
+        assert hll.add(0) is True
+        assert hll.cardinality() == 1
+
+
+class TestContextLimiter:
+    def test_limit(self):
+        warning = mock.MagicMock()
+        limiter = ContextLimiter("my_check", "names", 10, warning_func=warning)
+        for i in range(10):
+            for _ in range(2):
+                assert limiter.is_reached(i) is False
+        assert limiter.get_status() == (10, 10, False)
+
+        # Reach limit, further objects are still counted
+        for i in range(10, 20):
+            assert limiter.is_reached(i) is True
+        assert limiter.is_reached(0) is True
+        assert limiter.get_status() == (20, 10, True)
+        warning.assert_called_once_with("Check %s exceeded limit of %s %s, ignoring next ones", "my_check", 10, "names")
+
+    def test_reset(self):
+        limiter = ContextLimiter("my_check", "names", 10)
+        for i in range(20):
+            limiter.is_reached(i)
+
+        limiter.reset()
+        assert limiter.get_status() == (0, 10, False)
+        assert limiter.is_reached(0) is False
+        assert limiter.get_status() == (1, 10, False)
+
+
+class TestLRUCache:
+    def test_get_set(self):
+        cache = LRUCache(2)
+        assert cache.get('foo') is None
+        cache.set('foo', 1)
+        assert cache.get('foo') == 1
+        assert 'foo' in cache
+        assert len(cache) == 1
+        assert (cache.hits, cache.misses, cache.evictions) == (1, 1, 0)
+
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.set('foo', 1)
+        cache.set('bar', 2)
+        # Mark `foo` as recently used
+        cache.get('foo')
+        cache.set('baz', 3)
+
+        assert 'bar' not in cache
+        assert cache.get('foo') == 1
+        assert cache.get('baz') == 3
+        assert len(cache) == 2
+        assert cache.evictions == 1
+
+    def test_reset_stats(self):
+        cache = LRUCache(1)
+        cache.set('foo', 1)
+        cache.set('bar', 2)
+        cache.get('bar')
+        cache.get('foo')
+        cache.reset_stats()
+
+        assert (cache.hits, cache.misses, cache.evictions) == (0, 0, 0)
+        assert len(cache) == 1
+
+
+class TestTaggerCache:
+    def setup_method(self):
+        tagger.reset()
+        tagger.set_tags({'container_id://foo': ['image_name:foo'], 'container_id://bar': ['image_name:bar']})
+
+    def teardown_method(self):
+        tagger.reset()
+
+    def test_tag(self):
+        cache = TaggerCache()
+        assert cache.tag('container_id://foo', tagger.HIGH) == ('image_name:foo',)
+        assert cache.tag('container_id://foo', tagger.HIGH) == ('image_name:foo',)
+        assert cache.tag('container_id://foo', tagger.LOW) == ('image_name:foo',)
+        assert cache.tag('container_id://unknown', tagger.HIGH) == ()
+        assert cache.tag('container_id://unknown', tagger.HIGH) == ()
+
+        assert len(cache) == 3
+        assert tagger._calls == [
+            ('container_id://foo', tagger.HIGH),
+            ('container_id://foo', tagger.LOW),
+            ('container_id://unknown', tagger.HIGH),
+        ]
+        assert (cache.hits, cache.misses) == (2, 3)
+        assert cache.hit_ratio == 0.4
+
+    def test_reset(self):
+        cache = TaggerCache()
+        cache.tag('container_id://foo', tagger.HIGH)
+        tagger.set_tags({'container_id://foo': ['image_name:baz']})
+        assert cache.tag('container_id://foo', tagger.HIGH) == ('image_name:foo',)
+
+        cache.reset()
+        assert cache.tag('container_id://foo', tagger.HIGH) == ('image_name:baz',)
+        assert (cache.hits, cache.misses) == (1, 2)
+
+        cache.reset_stats()
+        assert (cache.hits, cache.misses) == (0, 0)
+        assert cache.hit_ratio == 0.0
+        assert len(cache) == 1
+
+
 class TestRounding:
     def test_round_half_up(self):
         assert round_value(3.5) == 4.0
@@ -1,34 +1,61 @@
 # (C) Datadog, Inc. 2018
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
-import re
 from collections import defaultdict
+from copy import copy, deepcopy
 
 import requests
+from six import iteritems
+from six.moves.urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
 
 from datadog_checks.checks import AgentCheck
+from datadog_checks.checks.openmetrics.mixins import OpenMetricsScraperMixin
+from datadog_checks.config import is_affirmative
 
 from .errors import UnknownMetric, UnknownTags
+from .metrics import PROMETHEUS_LABELS, PROMETHEUS_METRICS, PROMETHEUS_RESPONSE_CODE_CLASS_METRICS
 from .parser import parse_histogram, parse_metric
+from .utils import get_unmatched_patterns, make_metric_matcher, make_metric_pattern
 
+# Options of the instance named differently for the Prometheus format scraper
+PROMETHEUS_OPTIONS = {
+    'verify_ssl': 'ssl_verify',
+    'tls_verify': 'ssl_verify',
+    'tls_cert': 'ssl_cert',
+    'tls_private_key': 'ssl_private_key',
+    'tls_ca_cert': 'ssl_ca_cert',
+    'headers': 'extra_headers',
+    'timeout': 'prometheus_timeout',
+}
 
-class Envoy(AgentCheck):
+
+class Envoy(OpenMetricsScraperMixin, AgentCheck):
     HTTP_CONFIG_REMAPPER = {'verify_ssl': {'name': 'tls_verify'}}
     SERVICE_CHECK_NAME = 'envoy.can_connect'
 
+    # Maximum number of stat names whose parsing is cached, the cache is cleared when it's reached
+    PARSED_METRICS_CACHE_SIZE = 100000
+
     def __init__(self, name, init_config, instances):
         super(Envoy, self).__init__(name, init_config, instances)
         self.unknown_metrics = defaultdict(int)
         self.unknown_tags = defaultdict(int)
         self.whitelist = None
         self.blacklist = None
+        self.caching_metrics = None
 
-        # The memory implications here are unclear to me. We may want a bloom filter
-        # or a data structure that expires elements based on inactivity.
-        self.whitelisted_metrics = set()
-        self.blacklisted_metrics = set()
+        # The outcome of the filtering and parsing of the stat names, see `parse_stat`
+        self.parsed_metrics = {}
+        self.parsed_metrics_custom_tags = None
 
-        self.caching_metrics = None
+        # Scraper of the Prometheus format, when `use_prometheus_endpoint` is enabled
+        self.default_instances = {}
+        self.default_namespace = 'envoy'
+        self.scraper_config = None
+        self.prometheus_metric_names = None
+        self.prometheus_transformers = {
+            metric: self.submit_response_code_class_metric for metric in PROMETHEUS_RESPONSE_CODE_CLASS_METRICS
+        }
 
     def check(self, instance):
         custom_tags = instance.get('tags', [])
@@ -41,17 +68,25 @@ class Envoy(AgentCheck):
             self.log.error(msg)
             return
 
-        if self.whitelist is None:
-            whitelist = set(re.sub(r'^envoy\\?\.', '', s, 1) for s in instance.get('metric_whitelist', []))
-            self.whitelist = [re.compile(pattern) for pattern in whitelist]
-
-        if self.blacklist is None:
-            blacklist = set(re.sub(r'^envoy\\?\.', '', s, 1) for s in instance.get('metric_blacklist', []))
-            self.blacklist = [re.compile(pattern) for pattern in blacklist]
-
         if self.caching_metrics is None:
+            self.whitelist = make_metric_matcher(instance.get('metric_whitelist', []))
+            self.blacklist = make_metric_matcher(instance.get('metric_blacklist', []))
             self.caching_metrics = instance.get('cache_metrics', True)
 
+            if is_affirmative(instance.get('use_prometheus_endpoint', False)):
+                self.scraper_config = self.create_scraper_configuration(
+                    self.create_prometheus_instance(instance, stats_url)
+                )
+
+        if self.scraper_config is not None:
+            self.check_prometheus_endpoint(custom_tags)
+            return
+
+        # The cached tags include the custom tags
+        if not self.caching_metrics or self.parsed_metrics_custom_tags != custom_tags:
+            self.parsed_metrics.clear()
+            self.parsed_metrics_custom_tags = list(custom_tags)
+
         try:
             response = self.http.get(stats_url)
         except requests.exceptions.Timeout:
@@ -75,66 +110,186 @@ class Envoy(AgentCheck):
 
         # Avoid repeated global lookups.
         get_method = getattr
+        parsed_metrics = self.parsed_metrics
 
-        for line in response.content.decode().splitlines():
-            try:
-                envoy_metric, value = line.split(': ')
-            except ValueError:
-                continue
+        # Buffer the submissions to send them to the aggregator in bulk
+        with self.submit_metrics_batch():
+            for line in response.content.decode().splitlines():
+                try:
+                    envoy_metric, value = line.split(': ')
+                except ValueError:
+                    continue
 
-            if not self.whitelisted_metric(envoy_metric):
-                continue
+                # Stat names are stable across runs, they are only filtered and parsed once
+                try:
+                    parsed_metric = parsed_metrics[envoy_metric]
+                except KeyError:
+                    parsed_metric = self.parse_stat(envoy_metric, custom_tags)
 
-            try:
-                metric, tags, method = parse_metric(envoy_metric)
-            except UnknownMetric:
-                if envoy_metric not in self.unknown_metrics:
-                    self.log.debug('Unknown metric `{}`'.format(envoy_metric))
-                self.unknown_metrics[envoy_metric] += 1
-                continue
-            except UnknownTags as e:
-                unknown_tags = str(e).split('|||')
-                for tag in unknown_tags:
-                    if tag not in self.unknown_tags:
-                        self.log.debug('Unknown tag `{}` in metric `{}`'.format(tag, envoy_metric))
-                    self.unknown_tags[tag] += 1
-                continue
+                if parsed_metric is None:
+                    continue
 
-            tags.extend(custom_tags)
+                metric, tags, method = parsed_metric
+                if method is None:
+                    self.count_unknown(envoy_metric, tags)
+                    continue
 
-            try:
-                value = int(value)
-                get_method(self, method)(metric, value, tags=tags)
+                try:
+                    value = int(value)
+                    get_method(self, method)(metric, value, tags=tags)
 
-            # If the value isn't an integer assume it's pre-computed histogram data.
-            except (ValueError, TypeError):
-                for metric, value in parse_histogram(metric, value):
-                    self.gauge(metric, value, tags=tags)
+                # If the value isn't an integer assume it's pre-computed histogram data.
+                except (ValueError, TypeError):
+                    for metric, value in parse_histogram(metric, value):
+                        self.gauge(metric, value, tags=tags)
 
         self.service_check(self.SERVICE_CHECK_NAME, AgentCheck.OK, tags=custom_tags)
 
-    def whitelisted_metric(self, metric):
-        if self.caching_metrics:
-            if metric in self.whitelisted_metrics:
-                return True
-            elif metric in self.blacklisted_metrics:
-                return False
+    def create_prometheus_instance(self, instance, stats_url):
+        """Sets up the instance of the Prometheus format scraper.
+
+        The whitelist is sent to Envoy as a filter of the stat names.
+        The blacklist is matched against the metric names without
+        tags, which are labels in the Prometheus format: a warning is
+        logged for the patterns matching none of them.
+        """
+        prometheus_instance = deepcopy(instance)
+        for option, prometheus_option in iteritems(PROMETHEUS_OPTIONS):
+            if option in instance:
+                prometheus_instance[prometheus_option] = instance[option]
+
+        # The query string of `stats_url`, e.g. `?usedonly`, is kept
+        url = urlparse(stats_url)
+        params = parse_qsl(url.query, keep_blank_values=True)
+        whitelist = make_metric_pattern(instance.get('metric_whitelist', []))
+        if whitelist is not None:
+            params.append(('filter', whitelist))
+        if is_affirmative(instance.get('stats_used_only', False)) and 'usedonly' not in dict(params):
+            params.append(('usedonly', ''))
+
+        prometheus_url = urlunparse(
+            url._replace(path='{}/prometheus'.format(url.path.rstrip('/')), query=urlencode(params))
+        )
+
+        metric_names = set(PROMETHEUS_METRICS.values())
+        for template in PROMETHEUS_RESPONSE_CODE_CLASS_METRICS.values():
+            metric_names.update(template.format(code_class) for code_class in range(1, 6))
+
+        # Patterns written for the `/stats` format, e.g. with a cluster name, don't filter anything here
+        for pattern in get_unmatched_patterns(instance.get('metric_blacklist', []), metric_names):
+            self.log.warning(
+                'Pattern `%s` of `metric_blacklist` matches no metric of the Prometheus format, '
+                'where it is matched against the metric names without tags',
+                pattern,
+            )
+
+        self.prometheus_metric_names = set(
+            metric for metric in metric_names if self.blacklist is None or not self.blacklist(metric)
+        )
+
+        prometheus_instance.update(
+            {
+                'prometheus_url': prometheus_url,
+                'namespace': 'envoy',
+                'metrics': [
+                    {prometheus_metric: metric}
+                    for prometheus_metric, metric in iteritems(PROMETHEUS_METRICS)
+                    if metric in self.prometheus_metric_names
+                ],
+                'labels_mapper': PROMETHEUS_LABELS,
+                # Families that aren't collected are skipped without parsing their samples
+                'use_streaming_parser': True,
+                # Reported with the `envoy.can_connect` service check
+                'health_service_check': False,
+            }
+        )
 
-        if self.whitelist:
-            whitelisted = any(pattern.search(metric) for pattern in self.whitelist)
-            if self.blacklist:
-                whitelisted = whitelisted and not any(pattern.search(metric) for pattern in self.blacklist)
+        return prometheus_instance
 
-            if self.caching_metrics and whitelisted:
-                self.whitelisted_metrics.add(metric)
+    def check_prometheus_endpoint(self, custom_tags):
+        endpoint = self.scraper_config['prometheus_url']
 
-            return whitelisted
-        elif self.blacklist:
-            blacklisted = any(pattern.search(metric) for pattern in self.blacklist)
+        try:
+            self.process(self.scraper_config, metric_transformers=self.prometheus_transformers)
+        except requests.exceptions.Timeout:
+            msg = 'Envoy endpoint `{}` timed out after {} seconds'.format(
+                endpoint, self.scraper_config['prometheus_timeout']
+            )
+            self.service_check(self.SERVICE_CHECK_NAME, AgentCheck.CRITICAL, message=msg, tags=custom_tags)
+            self.log.exception(msg)
+            return
+        except requests.exceptions.RequestException:
+            msg = 'Error accessing Envoy endpoint `{}`'.format(endpoint)
+            self.service_check(self.SERVICE_CHECK_NAME, AgentCheck.CRITICAL, message=msg, tags=custom_tags)
+            self.log.exception(msg)
+            return
+
+        self.service_check(self.SERVICE_CHECK_NAME, AgentCheck.OK, tags=custom_tags)
 
-            if self.caching_metrics and blacklisted:
-                self.blacklisted_metrics.add(metric)
+    def submit_response_code_class_metric(self, metric, scraper_config):
+        """Submits the metrics whose response code class is a label in
+        the Prometheus format under their names in the `/stats` format,
+        e.g. `envoy_cluster_upstream_rq_xx{envoy_response_code_class="2"}`
+        as `envoy.cluster.upstream_rq_2xx`.
+        """
+        template = PROMETHEUS_RESPONSE_CODE_CLASS_METRICS[metric.name]
+        samples_by_class = defaultdict(list)
+        for sample in metric.samples:
+            labels = sample[self.SAMPLE_LABELS].copy()
+            code_class = labels.pop('envoy_response_code_class', None)
+            samples_by_class[code_class].append(
+                sample[: self.SAMPLE_LABELS] + (labels,) + sample[self.SAMPLE_LABELS + 1 :]
+            )
+
+        for code_class, samples in iteritems(samples_by_class):
+            metric_name = template.format(code_class)
+            if metric_name not in self.prometheus_metric_names:
+                continue
 
-            return not blacklisted
+            class_metric = copy(metric)
+            class_metric.samples = samples
+            self.submit_openmetric(metric_name, class_metric, scraper_config)
+
+    def parse_stat(self, envoy_metric, custom_tags):
+        """Filters and parses a stat name, and caches the outcome.
+
+        Returns `None` if the metric is filtered out, the metric name,
+        its tags including the custom tags, and the name of the
+        submission method otherwise. The method is `None` when the
+        metric or some of its tags are unknown, the tags are then the
+        unknown tags.
+        """
+        if not self.whitelisted_metric(envoy_metric):
+            parsed_metric = None
         else:
-            return True
+            try:
+                metric, tags, method = parse_metric(envoy_metric)
+                parsed_metric = (metric, tuple(tags + custom_tags), method)
+            except UnknownMetric:
+                parsed_metric = (None, (), None)
+            except UnknownTags as e:
+                parsed_metric = (None, tuple(str(e).split('|||')), None)
+
+        if len(self.parsed_metrics) >= self.PARSED_METRICS_CACHE_SIZE:
+            self.parsed_metrics.clear()
+        self.parsed_metrics[envoy_metric] = parsed_metric
+
+        return parsed_metric
+
+    def count_unknown(self, envoy_metric, unknown_tags):
+        if not unknown_tags:
+            if envoy_metric not in self.unknown_metrics:
+                self.log.debug('Unknown metric `{}`'.format(envoy_metric))
+            self.unknown_metrics[envoy_metric] += 1
+            return
+
+        for tag in unknown_tags:
+            if tag not in self.unknown_tags:
+                self.log.debug('Unknown tag `{}` in metric `{}`'.format(tag, envoy_metric))
+            self.unknown_tags[tag] += 1
+
+    def whitelisted_metric(self, metric):
+        if self.whitelist is not None and not self.whitelist(metric):
+            return False
+
+        return self.blacklist is None or not self.blacklist(metric)
@@ -1,7 +1,7 @@
 # (C) Datadog, Inc. 2018
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
-from .utils import make_metric_tree
+from .utils import make_metric_tree, make_prometheus_metrics
 
 METRIC_PREFIX = 'envoy.'
 
@@ -2751,3 +2751,30 @@ METRICS = {
 # fmt: on
 
 METRIC_TREE = make_metric_tree(METRICS)
+
+PROMETHEUS_METRICS, PROMETHEUS_RESPONSE_CODE_CLASS_METRICS = make_prometheus_metrics(METRICS)
+
+# Labels of the Prometheus format, holding the tags extracted by Envoy from the stat names,
+# mapped to the names of the tags of the `/stats` format
+PROMETHEUS_LABELS = {
+    'envoy_cluster_name': 'cluster_name',
+    'envoy_listener_address': 'address',
+    'envoy_http_conn_manager_prefix': 'stat_prefix',
+    'envoy_http_user_agent': 'user_agent',
+    'envoy_ssl_cipher': 'cipher',
+    'envoy_clientssl_prefix': 'stat_prefix',
+    'envoy_mongo_prefix': 'stat_prefix',
+    'envoy_mongo_cmd': 'cmd',
+    'envoy_mongo_collection': 'collection',
+    'envoy_mongo_callsite': 'callsite',
+    'envoy_ratelimit_prefix': 'stat_prefix',
+    'envoy_redis_prefix': 'stat_prefix',
+    'envoy_tcp_prefix': 'stat_prefix',
+    'envoy_dynamo_table': 'table_name',
+    'envoy_dynamo_operation': 'operation_name',
+    'envoy_grpc_bridge_service': 'grpc_service',
+    'envoy_grpc_bridge_method': 'grpc_method',
+    'envoy_virtual_host': 'virtual_host_name',
+    'envoy_virtual_cluster': 'virtual_cluster_name',
+    'envoy_rds_route_config': 'route_config_name',
+}
@@ -1,3 +1,9 @@
+import re
+
+RESPONSE_CODE_CLASS_SUFFIX = re.compile(r'_rq_\dxx$')
+PROMETHEUS_INVALID_CHARACTERS = re.compile(r'[^a-zA-Z0-9_]')
+
+
 def make_metric_tree(metrics):
     metric_tree = {}
 
@@ -33,3 +39,74 @@ def make_metric_tree(metrics):
                 tree['|_tags_|'] = sorted(tree['|_tags_|'], key=lambda t: len(t), reverse=True)
 
     return metric_tree
+
+
+def make_metric_pattern(patterns):
+    """Combines the regular expressions into a single one, matching
+    any of them. Returns `None` if there are no patterns.
+    """
+    patterns = _strip_metric_prefix(patterns)
+    if not patterns:
+        return None
+
+    return '|'.join('(?:{})'.format(pattern) for pattern in patterns)
+
+
+def make_metric_matcher(patterns):
+    """Combines the regular expressions into a single one, to match
+    any of them in one pass. Returns a function searching a metric
+    name, or `None` if there are no patterns.
+    """
+    pattern = make_metric_pattern(patterns)
+    if pattern is None:
+        return None
+
+    try:
+        return re.compile(pattern).search
+    except re.error:
+        # Some patterns can't be combined, e.g. with global flags not at the start.
+        compiled_patterns = [re.compile(pattern) for pattern in _strip_metric_prefix(patterns)]
+        return lambda metric: any(pattern.search(metric) for pattern in compiled_patterns)
+
+
+def get_unmatched_patterns(patterns, metrics):
+    """Returns the regular expressions, without their `envoy.` prefix,
+    that don't match any of the metric names.
+    """
+    metrics = list(metrics)
+    return [
+        pattern
+        for pattern in _strip_metric_prefix(patterns)
+        if not any(re.search(pattern, metric) for metric in metrics)
+    ]
+
+
+def _strip_metric_prefix(patterns):
+    # Envoy metrics are matched without their `envoy.` prefix.
+    return sorted(set(re.sub(r'^envoy\\?\.', '', pattern, 1) for pattern in patterns))
+
+
+def make_prometheus_metrics(metrics):
+    """Maps the names of the metrics in the Prometheus format to their
+    names in the `/stats` format, without tags.
+
+    Envoy extracts the response code class of the `*_rq_<N>xx` metrics
+    as a label, they are mapped separately to a name template where
+    the class is to be formatted, e.g.:
+        'envoy_cluster_upstream_rq_xx' -> 'cluster.upstream_rq_{}xx'
+    """
+    prometheus_metrics = {}
+    response_code_class_metrics = {}
+
+    for metric in metrics:
+        if RESPONSE_CODE_CLASS_SUFFIX.search(metric):
+            template = metric[:-3] + '{}xx'
+            response_code_class_metrics[to_prometheus_name(template.format(''))] = template
+        else:
+            prometheus_metrics[to_prometheus_name(metric)] = metric
+
+    return prometheus_metrics, response_code_class_metrics
+
+
+def to_prometheus_name(metric):
+    return 'envoy_' + PROMETHEUS_INVALID_CHARACTERS.sub('_', metric)
@@ -5,9 +5,11 @@ from copy import deepcopy
 
 import mock
 import pytest
+import requests
 
 from datadog_checks.envoy import Envoy
 from datadog_checks.envoy.metrics import METRIC_PREFIX, METRICS
+from datadog_checks.envoy.parser import parse_metric
 
 from .common import INSTANCES, response
 
@@ -120,3 +122,159 @@ def test_config(test_case, extra_config, expected_http_kwargs):
         )
         http_wargs.update(expected_http_kwargs)
         r.get.assert_called_with('http://localhost:8001/stats', **http_wargs)
+
+
+def test_parsed_metrics_cache(aggregator):
+    instance = deepcopy(INSTANCES['main'])
+    instance['tags'] = ['optional:tag1']
+    c = Envoy(CHECK_NAME, {}, [instance])
+
+    with mock.patch('requests.get', return_value=response('multiple_services')):
+        with mock.patch('datadog_checks.envoy.envoy.parse_metric', side_effect=parse_metric) as parse:
+            c.check(instance)
+            assert parse.call_count == len(c.parsed_metrics)
+            unknown_metrics = sum(c.unknown_metrics.values())
+            aggregator.reset()
+
+            # Metric names are only parsed once
+            c.check(instance)
+            assert parse.call_count == len(c.parsed_metrics)
+            assert sum(c.unknown_metrics.values()) == 2 * unknown_metrics
+
+            aggregator.assert_metric('envoy.cluster.upstream_cx_total', tags=['cluster_name:in.0000', 'optional:tag1'])
+
+            # Cached tags are rebuilt when the custom tags change
+            aggregator.reset()
+            instance['tags'] = ['optional:tag2']
+            c.check(instance)
+            assert parse.call_count == 2 * len(c.parsed_metrics)
+
+            aggregator.assert_metric('envoy.cluster.upstream_cx_total', tags=['cluster_name:in.0000', 'optional:tag2'])
+
+
+def test_parsed_metrics_cache_disabled():
+    instance = deepcopy(INSTANCES['main'])
+    instance['cache_metrics'] = False
+    c = Envoy(CHECK_NAME, {}, [instance])
+
+    with mock.patch('requests.get', return_value=response('multiple_services')):
+        with mock.patch('datadog_checks.envoy.envoy.parse_metric', side_effect=parse_metric) as parse:
+            c.check(instance)
+            calls = parse.call_count
+            c.check(instance)
+            assert parse.call_count == 2 * calls
+
+
+def test_parsed_metrics_cache_size():
+    instance = INSTANCES['blacklist']
+    c = Envoy(CHECK_NAME, {}, [instance])
+    c.PARSED_METRICS_CACHE_SIZE = 10
+
+    with mock.patch('requests.get', return_value=response('multiple_services')):
+        c.check(instance)
+
+    assert 0 < len(c.parsed_metrics) <= 10
+
+
+def test_parsed_metrics_cache_filtered():
+    instance = INSTANCES['blacklist']
+    c = Envoy(CHECK_NAME, {}, [instance])
+
+    with mock.patch('requests.get', return_value=response('multiple_services')):
+        c.check(instance)
+
+    # Filtered out metrics are cached too
+    assert c.parsed_metrics['cluster.in.0000.upstream_cx_total'] is None
+    assert c.parsed_metrics['http.admin.downstream_cx_total'] == (
+        'envoy.http.downstream_cx_total',
+        ('stat_prefix:admin',),
+        'monotonic_count',
+    )
+
+
+def prometheus_response():
+    prometheus = requests.Response()
+    prometheus.status_code = 200
+    prometheus.headers['Content-Type'] = 'text/plain; version=0.0.4'
+    prometheus._content = response('prometheus').content
+    prometheus._content_consumed = True
+    return prometheus
+
+
+def test_prometheus_endpoint(aggregator):
+    instance = deepcopy(INSTANCES['main'])
+    instance['use_prometheus_endpoint'] = True
+    instance['tags'] = ['optional:tag1']
+    c = Envoy(CHECK_NAME, {}, [instance])
+
+    with mock.patch('requests.get', side_effect=lambda *args, **kwargs: prometheus_response()) as get:
+        c.check(instance)
+
+    assert get.call_args[0][0] == 'http://localhost:8001/stats/prometheus'
+
+    for metric, tags, value in (
+        ('envoy.cluster.upstream_cx_total', ['cluster_name:service1'], 12),
+        ('envoy.cluster.upstream_cx_total', ['cluster_name:service2'], 3),
+        ('envoy.cluster.upstream_rq_2xx', ['cluster_name:service1'], 10),
+        ('envoy.cluster.upstream_rq_5xx', ['cluster_name:service1'], 2),
+        ('envoy.cluster.upstream_rq_2xx', ['cluster_name:service2'], 3),
+        ('envoy.cluster.membership_healthy', ['cluster_name:service1'], 1),
+        ('envoy.http.downstream_cx_active', ['stat_prefix:ingress_http'], 2),
+        ('envoy.listener.downstream_cx_total', ['address:0.0.0.0_80'], 7),
+        ('envoy.server.uptime', [], 3600),
+        ('envoy.runtime.load_success', [], 1),
+        ('envoy.cluster.upstream_rq_time.count', ['cluster_name:service1', 'upper_bound:none'], 12),
+        ('envoy.cluster.upstream_rq_time.count', ['cluster_name:service1', 'upper_bound:50.0'], 11),
+        ('envoy.cluster.upstream_rq_time.sum', ['cluster_name:service1'], 142.5),
+    ):
+        aggregator.assert_metric(metric, value=value, tags=tags + ['optional:tag1'], count=1)
+
+    aggregator.assert_metric('envoy.cluster.upstream_cx_total', metric_type=aggregator.MONOTONIC_COUNT)
+    aggregator.assert_service_check(Envoy.SERVICE_CHECK_NAME, Envoy.OK, tags=['optional:tag1'])
+
+
+def test_prometheus_endpoint_filters(aggregator):
+    instance = deepcopy(INSTANCES['whitelist_blacklist'])
+    instance['stats_url'] += '?usedonly'
+    instance['use_prometheus_endpoint'] = True
+    instance['stats_used_only'] = True
+    instance['metric_blacklist'] = [r'envoy\.cluster\.upstream_rq_5xx', r'^cluster\.membership']
+    c = Envoy(CHECK_NAME, {}, [instance])
+
+    with mock.patch('requests.get', side_effect=lambda *args, **kwargs: prometheus_response()) as get:
+        c.check(instance)
+
+    # The whitelist is applied by Envoy
+    assert get.call_args[0][0] == 'http://localhost:8001/stats/prometheus?usedonly=&filter=%28%3F%3Acluster%5C.%29'
+
+    aggregator.assert_metric('envoy.cluster.upstream_cx_total', count=2)
+    aggregator.assert_metric('envoy.cluster.upstream_rq_2xx', count=2)
+    aggregator.assert_metric('envoy.cluster.upstream_rq_5xx', count=0)
+    aggregator.assert_metric('envoy.cluster.membership_healthy', count=0)
+
+
+def test_prometheus_endpoint_unmatched_blacklist(aggregator):
+    instance = deepcopy(INSTANCES['main'])
+    instance['use_prometheus_endpoint'] = True
+    # Cluster names are labels in the Prometheus format
+    instance['metric_blacklist'] = [r'^cluster\.service1\.', r'envoy\.cluster\.upstream_rq_5xx']
+    c = Envoy(CHECK_NAME, {}, [instance])
+
+    with mock.patch('requests.get', side_effect=lambda *args, **kwargs: prometheus_response()):
+        with mock.patch.object(c.log, 'warning') as warning:
+            c.check(instance)
+
+    assert [call[0][1] for call in warning.call_args_list] == [r'^cluster\.service1\.']
+    aggregator.assert_metric('envoy.cluster.upstream_cx_total', count=2)
+    aggregator.assert_metric('envoy.cluster.upstream_rq_5xx', count=0)
+
+
+def test_prometheus_endpoint_error(aggregator):
+    instance = deepcopy(INSTANCES['main'])
+    instance['use_prometheus_endpoint'] = True
+    c = Envoy(CHECK_NAME, {}, [instance])
+
+    with mock.patch('requests.get', side_effect=requests.exceptions.ConnectionError):
+        c.check(instance)
+
+    aggregator.assert_service_check(Envoy.SERVICE_CHECK_NAME, Envoy.CRITICAL)
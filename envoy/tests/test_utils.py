@@ -1,4 +1,9 @@
-from datadog_checks.envoy.utils import make_metric_tree
+from datadog_checks.envoy.utils import (
+    get_unmatched_patterns,
+    make_metric_matcher,
+    make_metric_tree,
+    make_prometheus_metrics,
+)
 
 
 def test_make_metric_tree():
@@ -47,3 +52,51 @@ def test_make_metric_tree():
         },
     }
     # fmt: on
+
+
+def test_make_metric_matcher():
+    assert make_metric_matcher([]) is None
+
+    match = make_metric_matcher([r'envoy\.cluster\.in', r'^http\.', r'cluster\.in'])
+    assert match('cluster.in.upstream_cx_total')
+    assert match('http.admin.downstream_cx_total')
+    assert not match('cluster.out.upstream_cx_total')
+    assert not match('listener.http.downstream_cx_total')
+
+
+def test_make_metric_matcher_uncombinable():
+    match = make_metric_matcher(['(?i)^CLUSTER', '^http'])
+    assert match('cluster.in.upstream_cx_total')
+    assert match('http.admin.downstream_cx_total')
+    assert not match('listener.http.downstream_cx_total')
+
+
+def test_get_unmatched_patterns():
+    metrics = ['cluster.upstream_cx_total', 'http.downstream_cx_total']
+
+    assert get_unmatched_patterns([], metrics) == []
+    assert get_unmatched_patterns([r'envoy\.cluster\.', r'^http', r'cluster\.in\.', r'^listener'], metrics) == [
+        r'^listener',
+        r'cluster\.in\.',
+    ]
+
+
+def test_make_prometheus_metrics():
+    metrics = {
+        'cluster.upstream_cx_total': {},
+        'cluster.upstream_rq_2xx': {},
+        'cluster.upstream_rq_5xx': {},
+        'cluster.outlier_detection.ejections_detected_consecutive_5xx': {},
+        'http.rs-ratelimit.over_limit': {},
+    }
+
+    assert make_prometheus_metrics(metrics) == (
+        {
+            'envoy_cluster_upstream_cx_total': 'cluster.upstream_cx_total',
+            'envoy_cluster_outlier_detection_ejections_detected_consecutive_5xx': (
+                'cluster.outlier_detection.ejections_detected_consecutive_5xx'
+            ),
+            'envoy_http_rs_ratelimit_over_limit': 'http.rs-ratelimit.over_limit',
+        },
+        {'envoy_cluster_upstream_rq_xx': 'cluster.upstream_rq_{}xx'},
+    )
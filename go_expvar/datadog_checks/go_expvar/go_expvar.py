@@ -72,6 +72,9 @@ class GoExpvar(AgentCheck):
         'ssl_keyfile': {'name': 'tls_private_key', 'default': None},
     }
 
+    # The paths of the metrics are normalized on every run
+    METRIC_NAME_CACHE_SIZE = 1000
+
     def __init__(self, name, init_config, instances):
         super(GoExpvar, self).__init__(name, init_config, instances)
         self._regexes = {}
@@ -90,46 +90,163 @@ def replace_container_rt_prefix(cid):
 
 class PodListUtils(object):
     """
-    Queries the podlist and the agent6's filtering logic to determine whether to
+    Indexes the podlist and queries the agent6's filtering logic to determine whether to
     send metrics for a given container.
-    Results and podlist are cached between calls to avoid the repeated python-go switching
-    cost (filter called once per prometheus metric), hence the PodListUtils object MUST
-    be re-created at every check run.
+    The podlist is indexed so that the lookups done for every metric sample don't scan it.
+    The index is meant to live across check runs: `update` diffs every new podlist by pod uid
+    and resourceVersion, only new or modified pods are indexed again, and filtering results
+    of unchanged containers are kept to avoid the repeated python-go switching cost (filter
+    called once per prometheus metric).
 
     Containers that are part of a static pod are not filtered, as we cannot curently
     reliably determine their image name to pass to the filtering logic.
     """
 
     def __init__(self, podlist):
+        self.pods = {}
         self.containers = {}
         self.static_pod_uids = set()
+        self.host_network_pod_uids = set()
         self.cache = {}
         self.pod_uid_by_name_tuple = {}
         self.container_id_by_name_tuple = {}
+        # Pods added or modified by the last update, by pod key
+        self.changed_pods = set()
+        # Indexed pods, their resourceVersion and the (name tuple, cid) of their containers, by pod key
+        self._indexed_pods = {}
 
-        if podlist is None:
-            return
+        self.update(podlist)
 
-        pods = podlist.get('items') or []
+    @staticmethod
+    def _get_pod_key(metadata):
+        return metadata.get("uid") or (metadata.get("namespace"), metadata.get("name"))
 
-        for pod in pods:
+    def update(self, podlist):
+        """
+        Update the index with a new podlist. The items of the podlist that didn't change since
+        the previous update are replaced with the already indexed pods, so that the new copies
+        can be freed.
+
+        :param podlist: podlist dict object or None
+        :return: number of pods added or modified
+        """
+        pods = (podlist or {}).get('items') or []
+
+        pod_keys = set(self._get_pod_key(pod.get("metadata", {})) for pod in pods)
+        for key in [key for key in self._indexed_pods if key not in pod_keys]:
+            self._remove_pod(key)
+
+        # Filtering results of cids that aren't containers (system slices) aren't kept
+        for cid in [cid for cid in self.cache if cid not in self.containers]:
+            del self.cache[cid]
+
+        self.changed_pods = set()
+        seen = set()
+        for i, pod in enumerate(pods):
             metadata = pod.get("metadata", {})
-            uid = metadata.get("uid")
-            namespace = metadata.get("namespace")
-            pod_name = metadata.get("name")
-            self.pod_uid_by_name_tuple[(namespace, pod_name)] = uid
+            key = self._get_pod_key(metadata)
+            if key in seen:
+                continue
+            seen.add(key)
+
+            version = metadata.get("resourceVersion")
+            indexed = self._indexed_pods.get(key)
+            if indexed is not None and version is not None and indexed[1] == version:
+                pods[i] = indexed[0]
+                continue
+
+            if indexed is not None:
+                self._remove_pod(key)
+            self._add_pod(key, pod, version)
+            self.changed_pods.add(key)
+
+        return len(self.changed_pods)
+
+    def _add_pod(self, key, pod, version):
+        metadata = pod.get("metadata", {})
+        uid = metadata.get("uid")
+        namespace = metadata.get("namespace")
+        pod_name = metadata.get("name")
+        self.pod_uid_by_name_tuple[(namespace, pod_name)] = uid
+
+        if uid is not None:
+            self.pods[uid] = pod
 
             # FIXME we are forced to do that because the Kubelet PodList isn't updated
             # for static pods, see https://github.com/kubernetes/kubernetes/pull/59948
             if is_static_pending_pod(pod):
                 self.static_pod_uids.add(uid)
 
-            for ctr in pod.get('status', {}).get('containerStatuses', []):
-                cid = ctr.get('containerID')
-                if not cid:
-                    continue
-                self.containers[cid] = ctr
-                self.container_id_by_name_tuple[(namespace, pod_name, ctr.get('name'))] = cid
+            if pod.get('spec', {}).get('hostNetwork', False):
+                self.host_network_pod_uids.add(uid)
+
+        containers = []
+        for ctr in pod.get('status', {}).get('containerStatuses', []):
+            cid = ctr.get('containerID')
+            if not cid:
+                continue
+            name_tuple = (namespace, pod_name, ctr.get('name'))
+            self.containers[cid] = ctr
+            self.container_id_by_name_tuple[name_tuple] = cid
+            self.cache.pop(cid, None)
+            containers.append((name_tuple, cid))
+
+        self._indexed_pods[key] = (pod, version, containers)
+
+    def _remove_pod(self, key):
+        pod, _, containers = self._indexed_pods.pop(key)
+        metadata = pod.get("metadata", {})
+        uid = metadata.get("uid")
+        name_tuple = (metadata.get("namespace"), metadata.get("name"))
+        if self.pod_uid_by_name_tuple.get(name_tuple, uid) == uid:
+            self.pod_uid_by_name_tuple.pop(name_tuple, None)
+
+        if uid is not None:
+            self.pods.pop(uid, None)
+            self.static_pod_uids.discard(uid)
+            self.host_network_pod_uids.discard(uid)
+
+        for ctr_name_tuple, cid in containers:
+            if self.container_id_by_name_tuple.get(ctr_name_tuple) == cid:
+                del self.container_id_by_name_tuple[ctr_name_tuple]
+            self.containers.pop(cid, None)
+            self.cache.pop(cid, None)
+
+    def get_pod_by_uid(self, uid):
+        """
+        Get the pod from its uid
+
+        :param uid: pod uid
+        :return: pod dict object or None
+        """
+        return self.pods.get(uid)
+
+    def is_static_pending_pod(self, uid):
+        """
+        Return if the pod is a static pending pod, see `is_static_pending_pod`
+
+        :param uid: pod uid
+        :return: bool
+        """
+        return uid in self.static_pod_uids
+
+    def is_host_networked(self, uid):
+        """
+        Return if the pod is on host network, False if it isn't in the pod list
+
+        :param uid: pod uid
+        :return: bool
+        """
+        return uid in self.host_network_pod_uids
+
+    def get_container_status(self, cid):
+        """
+        Get the status of a container from its id
+
+        :param cid: container id, with runtime scheme
+        :return: container status dict object or None
+        """
+        return self.containers.get(cid)
 
     def get_uid_by_name_tuple(self, name_tuple):
         """
@@ -15,8 +15,10 @@ from kubeutil import get_connection_info
 from six import iteritems
 from six.moves.urllib.parse import urljoin
 
+from datadog_checks.base.checks.libs.thread_pool import Pool
+from datadog_checks.base.config import is_affirmative
 from datadog_checks.base.utils.date import UTC, parse_rfc3339
-from datadog_checks.base.utils.tagging import tagger
+from datadog_checks.base.utils.tagging import TaggerCache, tagger
 from datadog_checks.checks import AgentCheck
 from datadog_checks.checks.openmetrics import OpenMetricsBaseCheck
 from datadog_checks.errors import CheckException
@@ -136,6 +138,25 @@ class KubeletCheck(CadvisorPrometheusScraperMixin, OpenMetricsBaseCheck, Cadviso
 
         self.kubelet_scraper_config = self.get_scraper_config(kubelet_instance)
 
+        # Pod index and container requests & limits, updated incrementally at every run
+        self.pod_list = None
+        self.pod_list_utils = PodListUtils(None)
+        self._container_resources = {}
+        # Tags of the pods and containers, queried once per run
+        self.tagger_cache = TaggerCache()
+
+        # Results of the phases started ahead in worker threads, by phase
+        self._prefetched = {}
+        self.parallel_collection = is_affirmative(inst.get('parallel_collection', False))
+        if self.parallel_collection:
+            # The kubelet endpoints are all requested through the session of the kubelet scraper,
+            # see `_get_kubelet_session`
+            self.kubelet_scraper_config['persist_connections'] = True
+            self.cadvisor_scraper_config['persist_connections'] = True
+            self.kubelet_scraper_config['_shared_session'] = True
+            self.cadvisor_scraper_config['_shared_session'] = True
+            self.cadvisor_scraper_config['_connection_stats'] = self.kubelet_scraper_config['_connection_stats']
+
     def _create_kubelet_prometheus_instance(self, instance):
         """
         Create a copy of the instance and set default values.
@@ -184,9 +205,6 @@ class KubeletCheck(CadvisorPrometheusScraperMixin, OpenMetricsBaseCheck, Cadviso
         self.instance_tags = instance.get('tags', [])
         self.kubelet_credentials = KubeletCredentials(kubelet_conn_info)
 
-        # Test the kubelet health ASAP
-        self._perform_kubelet_check(self.instance_tags)
-
         if 'cadvisor_metrics_endpoint' in instance:
             self.cadvisor_scraper_config['prometheus_url'] = instance.get(
                 'cadvisor_metrics_endpoint', urljoin(endpoint, CADVISOR_METRICS_PATH)
@@ -207,40 +225,151 @@ class KubeletCheck(CadvisorPrometheusScraperMixin, OpenMetricsBaseCheck, Cadviso
         self.kubelet_credentials.configure_scraper(self.cadvisor_scraper_config)
         self.kubelet_credentials.configure_scraper(self.kubelet_scraper_config)
 
+        pool = None
+        if self.parallel_collection:
+            pool = self._prefetch_phases(endpoint)
+
+        try:
+            self._collect(instance, endpoint)
+        finally:
+            if pool is not None:
+                self._stop_prefetch(pool)
+
+            # Free up memory, the pods are kept by the index
+            self.pod_list = None
+            self.tagger_cache.reset()
+
+    def _collect(self, instance, endpoint):
+        # Test the kubelet health ASAP
+        self._perform_kubelet_check(self.instance_tags)
+
         # Legacy cadvisor support
         try:
-            self.cadvisor_legacy_url = self.detect_cadvisor(endpoint, self.cadvisor_legacy_port)
+            self.cadvisor_legacy_url = self._run_phase(
+                'kubelet.cadvisor_detection', self.detect_cadvisor, endpoint, self.cadvisor_legacy_port
+            )
         except Exception as e:
             self.log.debug('cAdvisor not found, running in prometheus mode: %s' % str(e))
 
-        self.pod_list = self.retrieve_pod_list()
-        self.pod_list_utils = PodListUtils(self.pod_list)
+        self.pod_list = self._run_phase('kubelet.pod_list', self.retrieve_pod_list)
+        changed_pods = self.pod_list_utils.update(self.pod_list)
+        self.log.debug('%d pods added or modified since the previous run', changed_pods)
+
+        # Buffer the submissions to send them to the aggregator in bulk
+        with self.submit_metrics_batch():
+            self._report_node_metrics(self.instance_tags)
+            self._report_pods_running(self.pod_list, self.instance_tags)
+            self._report_container_spec_metrics(self.pod_list, self.instance_tags)
+            self._report_container_state_metrics(self.pod_list, self.instance_tags)
+
+            if self.cadvisor_legacy_url:  # Legacy cAdvisor
+                self.log.debug('processing legacy cadvisor metrics')
+                with self.profile('kubelet.cadvisor'):
+                    self.process_cadvisor(instance, self.cadvisor_legacy_url, self.pod_list, self.pod_list_utils)
+            elif self.cadvisor_scraper_config['prometheus_url']:  # Prometheus
+                self.log.debug('processing cadvisor metrics')
+                self._wait_prefetch('kubelet.cadvisor_prefetch')
+                with self.profile('kubelet.cadvisor'):
+                    self.process(self.cadvisor_scraper_config, metric_transformers=self.CADVISOR_METRIC_TRANSFORMERS)
+
+            if self.kubelet_scraper_config['prometheus_url']:  # Prometheus
+                self.log.debug('processing kubelet metrics')
+                self._wait_prefetch('kubelet.metrics_prefetch')
+                with self.profile('kubelet.metrics'):
+                    self.process(self.kubelet_scraper_config)
+
+            self._send_tagger_cache_telemetry(self.tagger_cache, self.kubelet_scraper_config)
+
+    def _prefetch_phases(self, endpoint):
+        """
+        Start the requests to the kubelet that don't depend on each other in worker threads, and
+        return the pool running them. Their results are used by the phases of the run, in order:
+        the processing of the payloads and the submissions stay in the main thread.
+        """
+        # Refreshed before it's used by the worker threads
+        self._get_kubelet_session()
+
+        phases = [
+            ('kubelet.health', self._retrieve_kubelet_health, ()),
+            ('kubelet.node_spec', self._retrieve_node_spec, ()),
+            ('kubelet.pod_list', self.retrieve_pod_list, ()),
+        ]
+        if self.cadvisor_legacy_port:
+            # The cAdvisor prometheus endpoint is only requested if the legacy cAdvisor is not found
+            phases.append(('kubelet.cadvisor_detection', self.detect_cadvisor, (endpoint, self.cadvisor_legacy_port)))
+        elif self.cadvisor_scraper_config['prometheus_url']:
+            phases.append(('kubelet.cadvisor_prefetch', self.prefetch_response, (self.cadvisor_scraper_config,)))
+        if self.kubelet_scraper_config['prometheus_url']:
+            phases.append(('kubelet.metrics_prefetch', self.prefetch_response, (self.kubelet_scraper_config,)))
+
+        pool = Pool(len(phases), name='{}-phases'.format(self.name))
+        for phase, func, args in phases:
+            self._prefetched[phase] = pool.apply_async(self._profile_phase, (phase, func) + args)
+
+        return pool
+
+    def _stop_prefetch(self, pool):
+        # Wait for the phases that weren't used, so that nothing is left for the next run
+        for result in self._prefetched.values():
+            result.wait()
+        self._prefetched.clear()
+        self.cadvisor_scraper_config['_prefetched_response'] = None
+        self.kubelet_scraper_config['_prefetched_response'] = None
+
+        pool.terminate()
+
+    def _profile_phase(self, phase, func, *args):
+        with self.profile(phase):
+            return func(*args)
+
+    def _run_phase(self, phase, func, *args):
+        """
+        Return the result of a phase, that was started ahead in parallel collection mode,
+        raising the error it failed with. It's run now otherwise.
+        """
+        result = self._prefetched.pop(phase, None)
+        if result is not None:
+            return result.get()
 
-        self._report_node_metrics(self.instance_tags)
-        self._report_pods_running(self.pod_list, self.instance_tags)
-        self._report_container_spec_metrics(self.pod_list, self.instance_tags)
-        self._report_container_state_metrics(self.pod_list, self.instance_tags)
+        return self._profile_phase(phase, func, *args)
 
-        if self.cadvisor_legacy_url:  # Legacy cAdvisor
-            self.log.debug('processing legacy cadvisor metrics')
-            self.process_cadvisor(instance, self.cadvisor_legacy_url, self.pod_list, self.pod_list_utils)
-        elif self.cadvisor_scraper_config['prometheus_url']:  # Prometheus
-            self.log.debug('processing cadvisor metrics')
-            self.process(self.cadvisor_scraper_config, metric_transformers=self.CADVISOR_METRIC_TRANSFORMERS)
+    def _wait_prefetch(self, phase):
+        """
+        Wait for the payload of a prometheus endpoint requested ahead in parallel collection mode,
+        `poll` then uses it.
+        """
+        result = self._prefetched.pop(phase, None)
+        if result is not None:
+            result.wait()
 
-        if self.kubelet_scraper_config['prometheus_url']:  # Prometheus
-            self.log.debug('processing kubelet metrics')
-            self.process(self.kubelet_scraper_config)
+    def _get_kubelet_session(self):
+        """
+        Return the session shared by the requests to the kubelet in parallel collection mode,
+        its connections are kept open between runs.
 
-        # Free up memory
-        self.pod_list = None
-        self.pod_list_utils = None
+        The session is only created or replaced here, before the phases are started: the worker
+        threads use it as is.
+        """
+        session = self._get_session(self.kubelet_scraper_config)
+        # The cAdvisor prometheus endpoint is served by the kubelet too
+        cadvisor_session = self.cadvisor_scraper_config['_session']
+        if cadvisor_session is not None and cadvisor_session is not session:
+            cadvisor_session.close()
+        self.cadvisor_scraper_config['_session'] = session
+        self.cadvisor_scraper_config['_session_last_used'] = self.kubelet_scraper_config['_session_last_used']
+        return session
 
     def perform_kubelet_query(self, url, verbose=True, timeout=10, stream=False):
         """
         Perform and return a GET request against kubelet. Support auth and TLS validation.
         """
-        return requests.get(
+        if self.parallel_collection:
+            # Refreshed by `_prefetch_phases` when the query is run by a worker thread
+            session = self.kubelet_scraper_config['_session'] or self._get_kubelet_session()
+            get = session.get
+        else:
+            get = requests.get
+        return get(
             url,
             timeout=timeout,
             verify=self.kubelet_credentials.verify(),
@@ -297,7 +426,7 @@ class KubeletCheck(CadvisorPrometheusScraperMixin, OpenMetricsBaseCheck, Cadviso
         return node_spec
 
     def _report_node_metrics(self, instance_tags):
-        node_spec = self._retrieve_node_spec()
+        node_spec = self._run_phase('kubelet.node_spec', self._retrieve_node_spec)
         num_cores = node_spec.get('num_cores', 0)
         memory_capacity = node_spec.get('memory_capacity', 0)
 
@@ -305,6 +434,12 @@ class KubeletCheck(CadvisorPrometheusScraperMixin, OpenMetricsBaseCheck, Cadviso
         self.gauge(self.NAMESPACE + '.cpu.capacity', float(num_cores), tags)
         self.gauge(self.NAMESPACE + '.memory.capacity', float(memory_capacity), tags)
 
+    def _retrieve_kubelet_health(self):
+        """
+        Retrieve the lines of the kubelet health check.
+        """
+        return list(self.perform_kubelet_query(self.kube_health_url).iter_lines(decode_unicode=True))
+
     def _perform_kubelet_check(self, instance_tags):
         """Runs local service checks"""
         service_check_base = self.NAMESPACE + '.kubelet.check'
@@ -312,8 +447,7 @@ class KubeletCheck(CadvisorPrometheusScraperMixin, OpenMetricsBaseCheck, Cadviso
         url = self.kube_health_url
 
         try:
-            req = self.perform_kubelet_query(url)
-            for line in req.iter_lines(decode_unicode=True):
+            for line in self._run_phase('kubelet.health', self._retrieve_kubelet_health):
                 # avoid noise; this check is expected to fail since we override the container hostname
                 if line.find('hostname') != -1:
                     continue
@@ -366,10 +500,10 @@ class KubeletCheck(CadvisorPrometheusScraperMixin, OpenMetricsBaseCheck, Cadviso
                 if "running" not in container.get('state', {}):
                     continue
                 has_container_running = True
-                tags = tagger.tag(replace_container_rt_prefix(container_id), tagger.LOW) or None
+                tags = self.tagger_cache.tag(replace_container_rt_prefix(container_id), tagger.LOW)
                 if not tags:
                     continue
-                tags += instance_tags
+                tags += tuple(instance_tags)
                 hash_tags = tuple(sorted(tags))
                 containers_tag_counter[hash_tags] += 1
             # Pod reporting
@@ -379,10 +513,10 @@ class KubeletCheck(CadvisorPrometheusScraperMixin, OpenMetricsBaseCheck, Cadviso
             if not pod_id:
                 self.log.debug('skipping pod with no uid')
                 continue
-            tags = tagger.tag('kubernetes_pod_uid://%s' % pod_id, tagger.LOW) or None
+            tags = self.tagger_cache.tag('kubernetes_pod_uid://%s' % pod_id, tagger.LOW)
             if not tags:
                 continue
-            tags += instance_tags
+            tags += tuple(instance_tags)
             hash_tags = tuple(sorted(tags))
             pods_tag_counter[hash_tags] += 1
         for tags, count in iteritems(pods_tag_counter):
@@ -392,48 +526,83 @@ class KubeletCheck(CadvisorPrometheusScraperMixin, OpenMetricsBaseCheck, Cadviso
 
     def _report_container_spec_metrics(self, pod_list, instance_tags):
         """Reports pod requests & limits by looking at pod specs."""
+        container_resources = {}
         for pod in pod_list['items']:
             pod_name = pod.get('metadata', {}).get('name')
             pod_phase = pod.get('status', {}).get('phase')
             if self._should_ignore_pod(pod_name, pod_phase):
                 continue
 
-            for ctr in pod['spec']['containers']:
-                if not ctr.get('resources'):
-                    continue
-
-                c_name = ctr.get('name', '')
-                cid = None
-                for ctr_status in pod['status'].get('containerStatuses', []):
-                    if ctr_status.get('name') == c_name:
-                        # it is already prefixed with 'runtime://'
-                        cid = ctr_status.get('containerID')
-                        break
-                if not cid:
-                    continue
-
-                pod_uid = pod.get('metadata', {}).get('uid')
+            pod_uid = pod.get('metadata', {}).get('uid')
+            for cid, resources in self._get_container_resources(pod, container_resources):
                 if self.pod_list_utils.is_excluded(cid, pod_uid):
                     continue
 
-                tags = tagger.tag(replace_container_rt_prefix(cid), tagger.HIGH)
+                tags = self.tagger_cache.tag(replace_container_rt_prefix(cid), tagger.HIGH)
                 if not tags:
                     continue
+                tags = list(tags)
                 tags += instance_tags
 
-                try:
-                    for resource, value_str in iteritems(ctr.get('resources', {}).get('requests', {})):
-                        value = self.parse_quantity(value_str)
-                        self.gauge('{}.{}.requests'.format(self.NAMESPACE, resource), value, tags)
-                except (KeyError, AttributeError) as e:
-                    self.log.debug("Unable to retrieve container requests for %s: %s", c_name, e)
+                for metric_name, value in resources:
+                    self.gauge(metric_name, value, tags)
+
+        # Only keep the resources of the pods still in the podlist
+        self._container_resources = container_resources
+
+    def _get_container_resources(self, pod, container_resources):
+        """
+        Returns the container ids of a pod with their requests & limits metrics.
+        They are parsed again only when the pod has changed since the previous run.
+
+        :param pod: pod dict object
+        :param container_resources: dict storing the resources by pod uid for the next run
+        :return: list of (cid, list of (metric name, value))
+        """
+        metadata = pod.get('metadata', {})
+        pod_uid = metadata.get('uid')
+        version = metadata.get('resourceVersion')
+
+        cached = self._container_resources.get(pod_uid)
+        if cached is not None and version is not None and cached[0] == version:
+            container_resources[pod_uid] = cached
+            return cached[1]
+
+        resources = []
+        for ctr in pod['spec']['containers']:
+            if not ctr.get('resources'):
+                continue
+
+            c_name = ctr.get('name', '')
+            cid = None
+            for ctr_status in pod['status'].get('containerStatuses', []):
+                if ctr_status.get('name') == c_name:
+                    # it is already prefixed with 'runtime://'
+                    cid = ctr_status.get('containerID')
+                    break
+            if not cid:
+                continue
+
+            values = []
+            try:
+                for resource, value_str in iteritems(ctr.get('resources', {}).get('requests', {})):
+                    value = self.parse_quantity(value_str)
+                    values.append(('{}.{}.requests'.format(self.NAMESPACE, resource), value))
+            except (KeyError, AttributeError) as e:
+                self.log.debug("Unable to retrieve container requests for %s: %s", c_name, e)
+
+            try:
+                for resource, value_str in iteritems(ctr.get('resources', {}).get('limits', {})):
+                    value = self.parse_quantity(value_str)
+                    values.append(('{}.{}.limits'.format(self.NAMESPACE, resource), value))
+            except (KeyError, AttributeError) as e:
+                self.log.debug("Unable to retrieve container limits for %s: %s", c_name, e)
+
+            resources.append((cid, values))
 
-                try:
-                    for resource, value_str in iteritems(ctr.get('resources', {}).get('limits', {})):
-                        value = self.parse_quantity(value_str)
-                        self.gauge('{}.{}.limits'.format(self.NAMESPACE, resource), value, tags)
-                except (KeyError, AttributeError) as e:
-                    self.log.debug("Unable to retrieve container limits for %s: %s", c_name, e)
+        if pod_uid is not None:
+            container_resources[pod_uid] = (version, resources)
+        return resources
 
     def _report_container_state_metrics(self, pod_list, instance_tags):
         """Reports container state & reasons by looking at container statuses"""
@@ -457,9 +626,10 @@ class KubeletCheck(CadvisorPrometheusScraperMixin, OpenMetricsBaseCheck, Cadviso
                 if self.pod_list_utils.is_excluded(cid, pod_uid):
                     continue
 
-                tags = tagger.tag(replace_container_rt_prefix(cid), tagger.ORCHESTRATOR)
+                tags = self.tagger_cache.tag(replace_container_rt_prefix(cid), tagger.ORCHESTRATOR)
                 if not tags:
                     continue
+                tags = list(tags)
                 tags += instance_tags
 
                 restart_count = ctr_status.get('restartCount', 0)
@@ -10,7 +10,7 @@ from six import iteritems
 from datadog_checks.base.utils.tagging import tagger
 from datadog_checks.checks.openmetrics import OpenMetricsBaseCheck
 
-from .common import get_pod_by_uid, is_static_pending_pod, replace_container_rt_prefix
+from .common import replace_container_rt_prefix
 
 METRIC_TYPES = ['counter', 'gauge', 'summary']
 
@@ -185,11 +185,11 @@ class CadvisorPrometheusScraperMixin(object):
         :return str or None
         """
         if CadvisorPrometheusScraperMixin._is_container_metric(labels):
-            pod = self._get_pod_by_metric_label(labels)
-            if pod is not None and is_static_pending_pod(pod):
+            pod_uid = self._get_pod_uid(labels)
+            if self.pod_list_utils.is_static_pending_pod(pod_uid):
                 # If the pod is static, ContainerStatus is unavailable.
                 # Return the pod UID so that we can collect metrics from it later on.
-                return self._get_pod_uid(labels)
+                return pod_uid
             return self._get_container_id(labels)
 
     def _get_pod_uid(self, labels):
@@ -222,10 +222,7 @@ class CadvisorPrometheusScraperMixin(object):
         :param pod_uid: str
         :return: bool
         """
-        for pod in self.pod_list['items']:
-            if pod.get('metadata', {}).get('uid', '') == pod_uid:
-                return pod.get('spec', {}).get('hostNetwork', False)
-        return False
+        return self.pod_list_utils.is_host_networked(pod_uid)
 
     def _get_pod_by_metric_label(self, labels):
         """
@@ -233,7 +230,7 @@ class CadvisorPrometheusScraperMixin(object):
         :return:
         """
         pod_uid = self._get_pod_uid(labels)
-        return get_pod_by_uid(pod_uid, self.pod_list)
+        return self.pod_list_utils.get_pod_by_uid(pod_uid)
 
     @staticmethod
     def _get_kube_container_name(labels):
@@ -302,16 +299,16 @@ class CadvisorPrometheusScraperMixin(object):
             if self.pod_list_utils.is_excluded(c_id, pod_uid):
                 continue
 
-            tags = tagger.tag(replace_container_rt_prefix(c_id), tagger.HIGH)
+            tags = self.tagger_cache.tag(replace_container_rt_prefix(c_id), tagger.HIGH)
             if not tags:
                 continue
+            tags = list(tags)
             tags += scraper_config['custom_tags']
 
             # FIXME we are forced to do that because the Kubelet PodList isn't updated
             # for static pods, see https://github.com/kubernetes/kubernetes/pull/59948
-            pod = self._get_pod_by_metric_label(sample[self.SAMPLE_LABELS])
-            if pod is not None and is_static_pending_pod(pod):
-                pod_tags = tagger.tag('kubernetes_pod_uid://%s' % pod["metadata"]["uid"], tagger.HIGH)
+            if self.pod_list_utils.is_static_pending_pod(pod_uid):
+                pod_tags = self.tagger_cache.tag('kubernetes_pod_uid://%s' % pod_uid, tagger.HIGH)
                 if not pod_tags:
                     continue
                 tags += pod_tags
@@ -346,9 +343,10 @@ class CadvisorPrometheusScraperMixin(object):
         for pod_uid, sample in iteritems(samples):
             if '.network.' in metric_name and self._is_pod_host_networked(pod_uid):
                 continue
-            tags = tagger.tag('kubernetes_pod_uid://%s' % pod_uid, tagger.HIGH)
+            tags = self.tagger_cache.tag('kubernetes_pod_uid://%s' % pod_uid, tagger.HIGH)
             if not tags:
                 continue
+            tags = list(tags)
             tags += scraper_config['custom_tags']
             for label in labels:
                 value = sample[self.SAMPLE_LABELS].get(label)
@@ -378,16 +376,16 @@ class CadvisorPrometheusScraperMixin(object):
             if self.pod_list_utils.is_excluded(c_id, pod_uid):
                 continue
 
-            tags = tagger.tag(replace_container_rt_prefix(c_id), tagger.HIGH)
+            tags = self.tagger_cache.tag(replace_container_rt_prefix(c_id), tagger.HIGH)
             if not tags:
                 continue
+            tags = list(tags)
             tags += scraper_config['custom_tags']
 
             # FIXME we are forced to do that because the Kubelet PodList isn't updated
             # for static pods, see https://github.com/kubernetes/kubernetes/pull/59948
-            pod = self._get_pod_by_metric_label(sample[self.SAMPLE_LABELS])
-            if pod is not None and is_static_pending_pod(pod):
-                pod_tags = tagger.tag('kubernetes_pod_uid://%s' % pod["metadata"]["uid"], tagger.HIGH)
+            if self.pod_list_utils.is_static_pending_pod(pod_uid):
+                pod_tags = self.tagger_cache.tag('kubernetes_pod_uid://%s' % pod_uid, tagger.HIGH)
                 if not pod_tags:
                     continue
                 tags += pod_tags
@@ -422,9 +420,10 @@ class CadvisorPrometheusScraperMixin(object):
             if self.pod_list_utils.is_excluded(c_id, pod_uid):
                 continue
 
-            tags = tagger.tag(replace_container_rt_prefix(c_id), tagger.HIGH)
+            tags = self.tagger_cache.tag(replace_container_rt_prefix(c_id), tagger.HIGH)
             if not tags:
                 continue
+            tags = list(tags)
             tags += scraper_config['custom_tags']
 
             if m_name:
@@ -0,0 +1,129 @@
+# (C) Datadog, Inc. 2019
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+import copy
+import json
+import re
+
+import mock
+import pytest
+
+from datadog_checks.kubelet import KubeletCheck, PodListUtils
+
+from .test_kubelet import mock_from_file
+
+# Default maximum number of pods per node
+MAX_PODS = 110
+
+POD_NAME_LABEL = re.compile(r'pod_name="([^"]+)"')
+
+
+def max_pods_pod_list():
+    """
+    Clones the pods of the pods.json fixture until reaching MAX_PODS.
+    """
+    pod_list = json.loads(mock_from_file('pods.json'))
+    pods = pod_list['items']
+    items = []
+    copy_index = 0
+    while len(items) < MAX_PODS:
+        for pod in pods:
+            pod = copy.deepcopy(pod)
+            metadata = pod['metadata']
+            metadata['name'] = '{}-{}'.format(metadata['name'], copy_index)
+            metadata['uid'] = '{}-{}'.format(metadata['uid'], copy_index)
+            for ctr in pod.get('status', {}).get('containerStatuses', []):
+                if ctr.get('containerID'):
+                    ctr['containerID'] = '{}{:04d}'.format(ctr['containerID'], copy_index)
+            items.append(pod)
+        copy_index += 1
+
+    pod_list['items'] = items[:MAX_PODS]
+    return pod_list, copy_index
+
+
+def max_pods_cadvisor_payload(copies):
+    """
+    Clones the samples of the pods of the pre 1.16 cadvisor fixture, to match `max_pods_pod_list`.
+    """
+    lines = []
+    for line in mock_from_file('cadvisor_metrics_pre_1_16.txt').split('\n'):
+        match = POD_NAME_LABEL.search(line)
+        if match is None:
+            lines.append(line)
+            continue
+
+        for copy_index in range(copies):
+            lines.append(line.replace(match.group(0), 'pod_name="{}-{}"'.format(match.group(1), copy_index)))
+
+    return '\n'.join(lines)
+
+
+def max_pods_tags(pod_list):
+    tags = {}
+    for pod in pod_list['items']:
+        pod_tag = 'pod_name:{}'.format(pod['metadata']['name'])
+        tags['kubernetes_pod_uid://{}'.format(pod['metadata']['uid'])] = [pod_tag]
+        for ctr in pod.get('status', {}).get('containerStatuses', []):
+            cid = ctr.get('containerID')
+            if cid:
+                tags['container_id://{}'.format(cid.split('://')[1])] = [
+                    pod_tag,
+                    'kube_container_name:{}'.format(ctr['name']),
+                ]
+    return tags
+
+
+@pytest.fixture
+def max_pods_check(monkeypatch):
+    from datadog_checks.base.stubs import tagger
+
+    pod_list, copies = max_pods_pod_list()
+    content = max_pods_cadvisor_payload(copies)
+
+    tagger.reset()
+    tagger.set_tags(max_pods_tags(pod_list))
+
+    check = KubeletCheck('kubelet', None, {}, [{}])
+    check.cadvisor_scraper_config['prometheus_url'] = 'http://127.0.0.1:10255/metrics/cadvisor'
+    check.pod_list = pod_list
+
+    def mocked_poll(*args, **kwargs):
+        attrs = {'close.return_value': True, 'iter_lines.return_value': content.split('\n'), 'content': content}
+        return mock.Mock(headers={'Content-Type': 'text/plain'}, **attrs)
+
+    monkeypatch.setattr(check, 'poll', mock.Mock(side_effect=mocked_poll))
+
+    yield check
+
+    tagger.reset()
+
+
+def test_pod_list_utils(benchmark):
+    pod_list, _ = max_pods_pod_list()
+
+    benchmark(PodListUtils, pod_list)
+
+
+def test_pod_list_utils_update(benchmark):
+    pod_list, _ = max_pods_pod_list()
+    pod_list_utils = PodListUtils(pod_list)
+
+    def update():
+        # Unchanged pods, as decoded from a new podlist
+        pod_list_utils.update({'items': [copy.copy(pod) for pod in pod_list['items']]})
+
+    benchmark(update)
+
+
+def test_cadvisor_max_pods(benchmark, max_pods_check):
+    check = max_pods_check
+
+    def process():
+        check.pod_list_utils = PodListUtils(check.pod_list)
+        check.process(check.cadvisor_scraper_config, metric_transformers=check.CADVISOR_METRIC_TRANSFORMERS)
+
+    # Run once to get logging of unknown metrics out of the way.
+    process()
+
+    benchmark(process)
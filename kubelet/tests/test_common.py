@@ -114,6 +114,86 @@ def test_is_static_pod():
     assert is_static_pending_pod(pod) is False
 
 
+def test_pod_list_utils_index():
+    podlist = json.loads(mock_from_file('pods.json'))
+    pod_list_utils = PodListUtils(podlist)
+
+    assert len(pod_list_utils.pods) == 8
+    for uid in ("260c2b1d43b094af6d6b4ccba082c2db", "2edfd4d9-10ce-11e8-bd5a-42010af00137", "unknown", None):
+        assert pod_list_utils.get_pod_by_uid(uid) is get_pod_by_uid(uid, podlist)
+
+    # kube-proxy-gke-haissam-default-pool-be5066f1-wnvn is static
+    assert pod_list_utils.is_static_pending_pod("260c2b1d43b094af6d6b4ccba082c2db") is True
+    assert pod_list_utils.is_static_pending_pod("2edfd4d9-10ce-11e8-bd5a-42010af00137") is False
+    assert pod_list_utils.is_static_pending_pod(None) is False
+
+    assert pod_list_utils.is_host_networked("260c2b1d43b094af6d6b4ccba082c2db") is True
+    assert pod_list_utils.is_host_networked("2edfd4d9-10ce-11e8-bd5a-42010af00137") is False
+    assert pod_list_utils.is_host_networked("unknown") is False
+
+    status = pod_list_utils.get_container_status(
+        "docker://5741ed2471c0e458b6b95db40ba05d1a5ee168256638a0264f08703e48d76561"
+    )
+    assert status["name"] == "fluentd-gcp"
+    assert pod_list_utils.get_container_status("unknown") is None
+
+
+def test_pod_list_utils_empty():
+    pod_list_utils = PodListUtils(None)
+
+    assert pod_list_utils.get_pod_by_uid("260c2b1d43b094af6d6b4ccba082c2db") is None
+    assert pod_list_utils.is_static_pending_pod("260c2b1d43b094af6d6b4ccba082c2db") is False
+    assert pod_list_utils.is_host_networked("260c2b1d43b094af6d6b4ccba082c2db") is False
+
+
+def test_pod_list_utils_update(monkeypatch):
+    is_excluded = mock.Mock(return_value=False)
+    monkeypatch.setattr('datadog_checks.kubelet.common.is_excluded', is_excluded)
+
+    fluentd_cid = "docker://5741ed2471c0e458b6b95db40ba05d1a5ee168256638a0264f08703e48d76561"
+    agent_cid = "docker://a335589109ce5506aa69ba7481fc3e6c943abd23c5277016c92dac15d0f40479"
+    demo_cid = "docker://5f93d91c7aee0230f77fbe9ec642dd60958f5098e76de270a933285c24dfdc6f"
+
+    pod_list_utils = PodListUtils(json.loads(mock_from_file('pods.json')))
+    assert len(pod_list_utils.changed_pods) == 8
+    fluentd = pod_list_utils.get_pod_by_uid("2edfd4d9-10ce-11e8-bd5a-42010af00137")
+    assert pod_list_utils.is_excluded(fluentd_cid) is False
+    assert pod_list_utils.is_excluded(agent_cid) is False
+    assert pod_list_utils.is_excluded("invalid") is True
+    assert is_excluded.call_count == 2
+
+    podlist = json.loads(mock_from_file('pods.json'))
+    pods = podlist['items']
+    # datadog-agent-jbm2k is modified, demo-app-success-c485bc67b-klj45 is deleted
+    pods[3]['metadata']['resourceVersion'] = "30704999"
+    pods[3]['status']['containerStatuses'][0]['image'] = "datadog/agent:latest"
+    del pods[5]
+
+    # Pods without resourceVersion are always indexed again
+    assert pod_list_utils.update(podlist) == 3
+    assert pods[1] is fluentd
+    assert pod_list_utils.get_pod_by_uid("24d6daa3-10d8-11e8-bd5a-42010af00137") is None
+    assert pod_list_utils.get_uid_by_name_tuple(("default", "demo-app-success-c485bc67b-klj45")) is None
+    assert pod_list_utils.get_container_status(demo_cid) is None
+    assert pod_list_utils.get_container_status(agent_cid)["image"] == "datadog/agent:latest"
+    assert "invalid" not in pod_list_utils.cache
+
+    # The filtering result of unchanged containers is kept
+    is_excluded.reset_mock()
+    assert pod_list_utils.is_excluded(fluentd_cid) is False
+    is_excluded.assert_not_called()
+    assert pod_list_utils.is_excluded(agent_cid) is False
+    is_excluded.assert_called_once_with("datadog-agent", "datadog/agent:latest")
+    assert pod_list_utils.is_excluded(demo_cid) is True
+
+    assert pod_list_utils.update(None) == 0
+    assert pod_list_utils.pods == {}
+    assert pod_list_utils.containers == {}
+    assert pod_list_utils.pod_uid_by_name_tuple == {}
+    assert pod_list_utils.container_id_by_name_tuple == {}
+    assert pod_list_utils.static_pod_uids == set()
+
+
 def test_credentials_empty():
     creds = KubeletCredentials({})
     assert creds.verify() is None
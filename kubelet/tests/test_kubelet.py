@@ -4,12 +4,17 @@
 import json
 import os
 import sys
+import threading
 from datetime import datetime
+from io import BytesIO
 
 import mock
 import pytest
+import requests
 from six import iteritems
+from urllib3.exceptions import ProtocolError
 
+from datadog_checks.base import AgentCheck
 from datadog_checks.base.utils.date import UTC, parse_rfc3339
 from datadog_checks.kubelet import KubeletCheck, KubeletCredentials
 
@@ -293,6 +298,130 @@ def _test_kubelet_check_prometheus(monkeypatch, aggregator, tagger, instance_tag
     assert aggregator.metrics_asserted_pct == 100.0
 
 
+def test_tagger_cache(monkeypatch, aggregator, tagger):
+    instance = {'telemetry': True}
+    check = mock_kubelet_check(monkeypatch, [instance])
+
+    check.check(instance)
+
+    # Every entity is queried once per cardinality
+    assert len(tagger._calls) == len(set(tagger._calls))
+    assert len(check.tagger_cache) == 0
+    hits = aggregator.metrics('kubernetes.telemetry.tagger.cache.hits')[0].value
+    misses = aggregator.metrics('kubernetes.telemetry.tagger.cache.misses')[0].value
+    assert misses == len(tagger._calls)
+    assert hits > misses
+    aggregator.assert_metric('kubernetes.telemetry.tagger.cache.hit_ratio', value=hits / (hits + misses))
+
+
+def mock_session_get(payloads, threads):
+    """
+    Return a replacement of `requests.Session.get` serving the fixtures by path,
+    and recording the thread requesting each path.
+    """
+
+    def get(url, **_):
+        path = url.replace('http://127.0.0.1:10255', '')
+        threads[path] = threading.current_thread().name
+
+        response = requests.Response()
+        response.status_code = 200
+        response.headers['Content-Type'] = 'text/plain'
+        response.encoding = 'utf-8'
+        response.raw = BytesIO(payloads[path].encode('utf-8'))
+        return response
+
+    return get
+
+
+def test_parallel_collection(monkeypatch, aggregator, tagger):
+    instance = {'parallel_collection': True, 'tags': ['instance:tag']}
+    check = KubeletCheck('kubelet', None, {}, [instance])
+    monkeypatch.setattr(check, '_compute_pod_expiration_datetime', mock.Mock(return_value=None))
+
+    payloads = {
+        '/healthz': '[+]ping ok\n[+]syncloop ok\nhealthz check passed\n',
+        '/spec': json.dumps(NODE_SPEC),
+        '/pods': mock_from_file('pods.json'),
+        '/metrics/cadvisor': mock_from_file('cadvisor_metrics_pre_1_16.txt'),
+        '/metrics': mock_from_file('kubelet_metrics.txt'),
+    }
+    threads = {}
+    with mock.patch('requests.Session.get', side_effect=mock_session_get(payloads, threads)):
+        # called twice so pct metrics are guaranteed to be there
+        check.check(instance)
+        check.check(instance)
+
+    # Every endpoint is requested from a worker thread, through the same session
+    assert sorted(threads) == sorted(payloads)
+    assert threading.current_thread().name not in threads.values()
+    assert check.cadvisor_scraper_config['_session'] is check.kubelet_scraper_config['_session']
+    assert check._prefetched == {}
+    assert check.cadvisor_scraper_config['_prefetched_response'] is None
+    assert check.kubelet_scraper_config['_prefetched_response'] is None
+
+    aggregator.assert_service_check('kubernetes.kubelet.check.ping', AgentCheck.OK)
+    aggregator.assert_service_check('kubernetes.kubelet.check', AgentCheck.OK)
+    for metric in EXPECTED_METRICS_COMMON + EXPECTED_METRICS_PROMETHEUS:
+        aggregator.assert_metric(metric)
+        aggregator.assert_metric_has_tag(metric, 'instance:tag')
+
+
+def test_parallel_collection_connection_error(monkeypatch, aggregator, tagger):
+    instance = {'parallel_collection': True}
+    check = KubeletCheck('kubelet', None, {}, [instance])
+    monkeypatch.setattr(check, '_compute_pod_expiration_datetime', mock.Mock(return_value=None))
+
+    payloads = {
+        '/healthz': '[+]ping ok\n[+]syncloop ok\nhealthz check passed\n',
+        '/spec': json.dumps(NODE_SPEC),
+        '/pods': mock_from_file('pods.json'),
+        '/metrics/cadvisor': mock_from_file('cadvisor_metrics_pre_1_16.txt'),
+        '/metrics': mock_from_file('kubelet_metrics.txt'),
+    }
+    get = mock_session_get(payloads, {})
+    failures = []
+
+    def fail_once(url, **kwargs):
+        if url.endswith('/metrics/cadvisor') and not failures:
+            failures.append(url)
+            raise requests.exceptions.ConnectionError(ProtocolError('Connection aborted.'))
+        return get(url, **kwargs)
+
+    with mock.patch('requests.Session.get', side_effect=fail_once):
+        with mock.patch('requests.Session.close') as close:
+            check.check(instance)
+
+    # The session used by the other worker threads is kept, the request is retried on it
+    assert failures
+    assert not close.called
+    session = check.kubelet_scraper_config['_session']
+    assert session is not None
+    assert check.cadvisor_scraper_config['_session'] is session
+    assert check.kubelet_scraper_config['_connection_stats'].requests == 3
+
+    aggregator.assert_service_check('kubernetes.kubelet.check', AgentCheck.OK)
+    for metric in EXPECTED_METRICS_PROMETHEUS:
+        aggregator.assert_metric(metric)
+
+
+def test_parallel_collection_profile_timing(monkeypatch, aggregator):
+    instance = {'parallel_collection': True}
+    check = KubeletCheck('kubelet', {'profile_timing': True}, {}, [instance])
+    check.check_id = 'test:123'
+    monkeypatch.setattr(check, '_retrieve_kubelet_health', mock.Mock(return_value=[]))
+    monkeypatch.setattr(check, '_retrieve_node_spec', mock.Mock(return_value=NODE_SPEC))
+    monkeypatch.setattr(check, 'retrieve_pod_list', mock.Mock(return_value={'items': []}))
+    monkeypatch.setattr(check, 'prefetch_response', mock.Mock(return_value=None))
+    monkeypatch.setattr(check, 'process', mock.Mock(return_value=None))
+
+    assert check.run() == ''
+
+    for phase in ('kubelet.health', 'kubelet.pod_list', 'kubelet.cadvisor_prefetch', 'kubelet.metrics_prefetch'):
+        tags = ['check_name:kubelet', 'check_version:{}'.format(check.check_version), 'phase:{}'.format(phase)]
+        aggregator.assert_metric('datadog.agent.profile.timing.calls', value=1, tags=tags)
+
+
 def test_prometheus_cpu_summed(monkeypatch, aggregator, tagger):
     check = mock_kubelet_check(monkeypatch, [{}])
     monkeypatch.setattr(check, 'rate', mock.Mock())
@@ -517,6 +646,36 @@ def test_report_container_spec_metrics(monkeypatch, tagger):
     check.gauge.assert_has_calls(calls, any_order=True)
 
 
+def test_report_container_spec_metrics_unchanged_pods(monkeypatch, tagger):
+    check = KubeletCheck('kubelet', None, {}, [{}])
+    monkeypatch.setattr(check, 'gauge', mock.Mock())
+    monkeypatch.setattr(check, 'parse_quantity', mock.Mock(side_effect=KubeletCheck.parse_quantity))
+
+    attrs = {'is_excluded.return_value': False}
+    check.pod_list_utils = mock.Mock(**attrs)
+
+    check._report_container_spec_metrics(json.loads(mock_from_file('pods.json')), [])
+    first_calls = check.gauge.call_args_list
+    assert check.parse_quantity.call_count == 12
+
+    check.gauge.reset_mock()
+    check.parse_quantity.reset_mock()
+    pod_list = json.loads(mock_from_file('pods.json'))
+    # The requests of datadog-agent-jbm2k are parsed again once it's modified
+    pod_list['items'][3]['metadata']['resourceVersion'] = "30704999"
+    check._report_container_spec_metrics(pod_list, [])
+
+    assert check.gauge.call_args_list == first_calls
+    assert check.parse_quantity.call_count == 1
+
+    # Deleted pods are dropped from the cache
+    check._report_container_spec_metrics({'items': pod_list['items'][:2]}, [])
+    assert sorted(check._container_resources) == [
+        '260c2b1d43b094af6d6b4ccba082c2db',
+        '2edfd4d9-10ce-11e8-bd5a-42010af00137',
+    ]
+
+
 def test_report_container_state_metrics(monkeypatch, tagger):
     check = KubeletCheck('kubelet', None, {}, [{}])
     check.pod_list_url = "dummyurl"
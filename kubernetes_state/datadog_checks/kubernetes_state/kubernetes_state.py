@@ -4,7 +4,7 @@
 
 import re
 import time
-from collections import Counter, defaultdict
+from collections import Counter, OrderedDict, defaultdict
 from copy import deepcopy
 
 from six import iteritems
@@ -54,11 +54,14 @@ class KubernetesState(OpenMetricsBaseCheck):
     DEFAULT_METRIC_LIMIT = 0
 
     def __init__(self, name, init_config, agentConfig, instances=None):
-        # We do not support more than one instance of kube-state-metrics
+        # We do not support more than one instance of kube-state-metrics,
+        # but it can be sharded across several endpoints
         instance = instances[0]
-        kubernetes_state_instance = self._create_kubernetes_state_prometheus_instance(instance)
+        generic_instances = [
+            self._create_kubernetes_state_prometheus_instance(instance, endpoint)
+            for endpoint in self._get_endpoints(instance)
+        ]
 
-        generic_instances = [kubernetes_state_instance]
         super(KubernetesState, self).__init__(name, init_config, agentConfig, instances=generic_instances)
 
         self.condition_to_status_positive = {'true': self.OK, 'false': self.CRITICAL, 'unknown': self.UNKNOWN}
@@ -100,20 +103,52 @@ class KubernetesState(OpenMetricsBaseCheck):
         self.failed_job_counts = defaultdict(KubernetesState.JobCount)
         self.succeeded_job_counts = defaultdict(KubernetesState.JobCount)
 
+        # Objects counted cluster-wide, by metric name and sorted tags. The samples of all
+        # the shards are counted together and submitted once all of them are processed.
+        self.object_counts = defaultdict(Counter)
+
     def check(self, instance):
-        endpoint = instance.get('kube_state_url')
+        scraper_configs = [self.config_map[endpoint] for endpoint in self._get_endpoints(instance)]
+        namespace = scraper_configs[0]['namespace']
+
+        self.object_counts.clear()
+        if len(scraper_configs) == 1:
+            self.process(scraper_configs[0], metric_transformers=self.METRIC_TRANSFORMERS)
+            errors = []
+        else:
+            errors = self._process_endpoints(instance, scraper_configs, metric_transformers=self.METRIC_TRANSFORMERS)
 
-        scraper_config = self.config_map[endpoint]
-        self.process(scraper_config, metric_transformers=self.METRIC_TRANSFORMERS)
+        # Counts missing the objects of a failed shard would look like objects disappeared
+        if not errors:
+            self._submit_object_counts()
+        self.object_counts.clear()
 
         for job_tags, job in iteritems(self.failed_job_counts):
-            self.monotonic_count(scraper_config['namespace'] + '.job.failed', job.count, list(job_tags))
+            self.monotonic_count(namespace + '.job.failed', job.count, list(job_tags))
             job.set_previous_and_reset_current_ts()
 
         for job_tags, job in iteritems(self.succeeded_job_counts):
-            self.monotonic_count(scraper_config['namespace'] + '.job.succeeded', job.count, list(job_tags))
+            self.monotonic_count(namespace + '.job.succeeded', job.count, list(job_tags))
             job.set_previous_and_reset_current_ts()
 
+        self._raise_for_scrape_errors(errors, scraper_configs)
+
+    def _get_endpoints(self, instance):
+        """
+        Return the endpoints of the kube-state-metrics shards: `kube_state_urls` if set, `kube_state_url` otherwise.
+        """
+        endpoints = instance.get('kube_state_urls') or [instance.get('kube_state_url')]
+        if None in endpoints:
+            raise CheckException("Unable to find kube_state_url in config file.")
+
+        # Every series must be submitted once, a shard listed twice is only processed once
+        return list(OrderedDict.fromkeys(endpoints))
+
+    def _submit_object_counts(self):
+        for metric_name, object_counter in iteritems(self.object_counts):
+            for tags, count in iteritems(object_counter):
+                self.gauge(metric_name, count, tags=list(tags))
+
     def _filter_metric(self, metric, scraper_config):
         if scraper_config['telemetry']:
             # name is like "kube_pod_execution_duration"
@@ -133,14 +168,11 @@ class KubernetesState(OpenMetricsBaseCheck):
         # do not filter
         return False
 
-    def _create_kubernetes_state_prometheus_instance(self, instance):
+    def _create_kubernetes_state_prometheus_instance(self, instance, endpoint):
         """
-        Set up the kubernetes_state instance so it can be used in OpenMetricsBaseCheck
+        Set up the kubernetes_state instance of a shard so it can be used in OpenMetricsBaseCheck
         """
         ksm_instance = deepcopy(instance)
-        endpoint = instance.get('kube_state_url')
-        if endpoint is None:
-            raise CheckException("Unable to find kube_state_url in config file.")
 
         extra_labels = ksm_instance.get('label_joins', {})
         hostname_override = is_affirmative(ksm_instance.get('hostname_override', True))
@@ -306,6 +338,9 @@ class KubernetesState(OpenMetricsBaseCheck):
                 # Defaults that were set when kubernetes_state was based on PrometheusCheck
                 'send_monotonic_counter': ksm_instance.get('send_monotonic_counter', False),
                 'health_service_check': ksm_instance.get('health_service_check', False),
+                # The counts of the jobs and objects are computed by the transformers, which replayed
+                # submissions would skip
+                'replay_unchanged_payloads': False,
             }
         )
 
@@ -451,7 +486,7 @@ class KubernetesState(OpenMetricsBaseCheck):
     def kube_pod_status_phase(self, metric, scraper_config):
         """ Phase a pod is in. """
         metric_name = scraper_config['namespace'] + '.pod.status_phase'
-        status_phase_counter = Counter()
+        status_phase_counter = self.object_counts[metric_name]
 
         for sample in metric.samples:
             # Counts aggregated cluster-wide to avoid no-data issues on pod churn,
@@ -462,9 +497,6 @@ class KubernetesState(OpenMetricsBaseCheck):
             ] + scraper_config['custom_tags']
             status_phase_counter[tuple(sorted(tags))] += sample[self.SAMPLE_VALUE]
 
-        for tags, count in iteritems(status_phase_counter):
-            self.gauge(metric_name, count, tags=list(tags))
-
     def _submit_metric_kube_pod_container_status_reason(
         self, metric, metric_suffix, whitelisted_status_reasons, scraper_config
     ):
@@ -585,7 +617,7 @@ class KubernetesState(OpenMetricsBaseCheck):
         """ The ready status of a cluster node. v1.0+"""
         base_check_name = scraper_config['namespace'] + '.node'
         metric_name = scraper_config['namespace'] + '.nodes.by_condition'
-        by_condition_counter = Counter()
+        by_condition_counter = self.object_counts[metric_name]
 
         for sample in metric.samples:
             node_tag = self._label_to_tag("node", sample[self.SAMPLE_LABELS], scraper_config)
@@ -605,9 +637,6 @@ class KubernetesState(OpenMetricsBaseCheck):
             ] + scraper_config['custom_tags']
             by_condition_counter[tuple(sorted(tags))] += sample[self.SAMPLE_VALUE]
 
-        for tags, count in iteritems(by_condition_counter):
-            self.gauge(metric_name, count, tags=list(tags))
-
     def kube_node_status_ready(self, metric, scraper_config):
         """ The ready status of a cluster node (legacy)"""
         service_check_name = scraper_config['namespace'] + '.node.ready'
@@ -734,16 +763,13 @@ class KubernetesState(OpenMetricsBaseCheck):
             self.log.error("Metric type %s unsupported for metric %s" % (metric.type, metric.name))
 
     def count_objects_by_tags(self, metric, scraper_config):
-        """ Count objects by whitelisted tags and submit counts as gauges. """
+        """ Count objects by whitelisted tags, the counts are submitted as gauges at the end of the run. """
         config = self.object_count_params[metric.name]
         metric_name = "{}.{}".format(scraper_config['namespace'], config['metric_name'])
-        object_counter = Counter()
+        object_counter = self.object_counts[metric_name]
 
         for sample in metric.samples:
             tags = [
                 self._label_to_tag(l, sample[self.SAMPLE_LABELS], scraper_config) for l in config['allowed_labels']
             ] + scraper_config['custom_tags']
             object_counter[tuple(sorted(tags))] += sample[self.SAMPLE_VALUE]
-
-        for tags, count in iteritems(object_counter):
-            self.gauge(metric_name, count, tags=list(tags))
@@ -2,6 +2,7 @@
 # All rights reserved
 # Licensed under Simplified BSD License (see LICENSE)
 import os
+import zlib
 
 import mock
 import pytest
@@ -481,3 +482,103 @@ def test_telemetry(aggregator, instance):
         tags=['resource_name:hpa', 'resource_namespace:ns1', 'optional:tag1'],
         value=8.0,
     )
+
+
+class MockShardResponse(MockResponse):
+    status_code = 200
+
+    def iter_content(self, **_):
+        yield self.content
+
+    def raise_for_status(self):
+        pass
+
+
+def split_payload(payload, shards):
+    """
+    Distribute the samples of the payload between shards by the value of their first label, which is the
+    namespace or the name of the object they describe: like with kube-state-metrics' own sharding, all the
+    samples of an object are exposed by the same shard.
+    """
+    payloads = [[] for _ in range(shards)]
+    for line in payload.split(b'\n'):
+        if line.startswith(b'#') or not line:
+            for shard_payload in payloads:
+                shard_payload.append(line)
+        else:
+            first_label_value = line.partition(b'"')[2].partition(b'"')[0]
+            payloads[zlib.crc32(first_label_value) % shards].append(line)
+
+    return [b'\n'.join(shard_payload) for shard_payload in payloads]
+
+
+@pytest.fixture
+def sharded_instance(instance):
+    instance = dict(instance)
+    instance['kube_state_urls'] = ['http://shard-0', 'http://shard-1', 'http://shard-0']
+    return instance
+
+
+def mock_shards(check, payloads):
+    endpoints = ['http://shard-0', 'http://shard-1']
+
+    def send_request(endpoint, *args, **kwargs):
+        payload = payloads[endpoints.index(endpoint)]
+        if isinstance(payload, Exception):
+            raise payload
+        return MockShardResponse(payload, 'text/plain')
+
+    check.send_request = mock.MagicMock(side_effect=send_request)
+
+
+def test_sharded_endpoints(aggregator, sharded_instance):
+    check = KubernetesState(CHECK_NAME, {}, {}, [sharded_instance])
+    assert sorted(check.config_map) == ['http://shard-0', 'http://shard-1']
+
+    payloads = split_payload(mock_from_file('prometheus.txt'), 2)
+    assert payloads[0] != payloads[1]
+    mock_shards(check, payloads)
+
+    # run check twice to have pod/node mapping
+    for _ in range(2):
+        check.check(sharded_instance)
+    aggregator.reset()
+    check.check(sharded_instance)
+
+    # Every shard was requested once per run
+    assert check.send_request.call_count == 6
+
+    # The objects of all the shards are counted together, and the counts submitted once per run
+    for metric_name, tags, value in (
+        ('.pod.status_phase', ['namespace:default', 'phase:Running', 'optional:tag1'], 3),
+        ('.pod.status_phase', ['namespace:default', 'phase:Failed', 'optional:tag1'], 2),
+        ('.nodes.by_condition', ['condition:Ready', 'status:true', 'optional:tag1'], 1),
+        ('.persistentvolumes.by_phase', ['storageclass:local-data', 'phase:Bound', 'optional:tag1'], 2),
+    ):
+        aggregator.assert_metric(NAMESPACE + metric_name, tags=tags, value=value, count=1)
+
+    aggregator.assert_metric(
+        NAMESPACE + '.job.succeeded', tags=['namespace:default', 'job:hello', 'optional:tag1'], value=3, count=1
+    )
+    aggregator.assert_service_check(NAMESPACE + '.node.ready', check.OK, count=1)
+
+    for metric in METRICS:
+        aggregator.assert_metric(metric)
+
+
+def test_sharded_endpoints_failure(aggregator, sharded_instance):
+    check = KubernetesState(CHECK_NAME, {}, {}, [sharded_instance])
+    payloads = split_payload(mock_from_file('prometheus.txt'), 2)
+    mock_shards(check, [payloads[0], IOError('Connection refused')])
+
+    # The first run only builds the label joins mapping
+    with pytest.raises(Exception):
+        check.check(sharded_instance)
+    with pytest.raises(Exception, match='Unable to scrape 1 of 2 endpoints: http://shard-1'):
+        check.check(sharded_instance)
+
+    # The other shard is processed, but partial counts are not submitted
+    aggregator.assert_metric(NAMESPACE + '.pod.ready')
+    aggregator.assert_metric(NAMESPACE + '.pod.status_phase', count=0)
+    aggregator.assert_metric(NAMESPACE + '.job.succeeded')
+    assert not check.object_counts
@@ -104,6 +104,9 @@ class Memcache(AgentCheck):
 
     SERVICE_CHECK = 'memcache.can_connect'
 
+    # The stats of every slab and item are submitted with the same few names
+    METRIC_NAME_CACHE_SIZE = 500
+
     @classmethod
     def get_library_versions(cls):
         return {"memcache": pkg_resources.get_distribution("python-binary-memcached").version}
@@ -370,6 +370,11 @@ class MongoDb(AgentCheck):
         'collection.indexSizes': GAUGE,
     }
 
+    """
+    The metrics above are normalized on every run, see `_resolve_metric`.
+    """
+    METRIC_NAME_CACHE_SIZE = 1000
+
     """
     Mapping for case-sensitive metric name suffixes.
 
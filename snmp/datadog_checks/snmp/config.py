@@ -3,7 +3,10 @@
 # Licensed under Simplified BSD License (see LICENSE)
 import ipaddress
 import os
+import threading
+import weakref
 from collections import defaultdict
+from contextlib import contextmanager
 
 import pysnmp_mibs
 from pyasn1.type.univ import OctetString
@@ -18,6 +21,8 @@ from pysnmp.smi.error import MibNotFoundError
 
 from datadog_checks.base import ConfigurationError, is_affirmative
 
+from .utils import OIDTrie, to_oid_tuple
+
 
 class InstanceConfig:
     """Parse and hold configuration about a single instance."""
@@ -26,11 +31,15 @@ class InstanceConfig:
     DEFAULT_TIMEOUT = 1
     DEFAULT_ALLOWED_FAILURES = 3
     DEFAULT_BULK_THRESHOLD = 5
+    DEFAULT_WORKERS = 5
+    # The default collection interval of checks
+    DEFAULT_POLLING_DEADLINE = 15
 
     def __init__(self, instance, warning, log, global_metrics, mibs_path, profiles, profiles_by_oid):
         self.instance = instance
-        self.tags = instance.get('tags', [])
-        self.metrics = instance.get('metrics', [])
+        self.tags = list(instance.get('tags', []))
+        # Copy the list, the instances of discovered hosts share it with the network one
+        self.metrics = list(instance.get('metrics', []))
         profile = instance.get('profile')
         if is_affirmative(instance.get('use_global_metrics', True)):
             self.metrics.extend(global_metrics)
@@ -39,13 +48,21 @@ class InstanceConfig:
                 raise ConfigurationError("Unknown profile '{}'".format(profile))
             self.metrics.extend(profiles[profile]['definition'])
         self.enforce_constraints = is_affirmative(instance.get('enforce_mib_constraints', True))
-        self.snmp_engine, self.mib_view_controller = self.create_snmp_engine(mibs_path)
+        self.mibs_path = mibs_path
+        # Borrowed from `engines` for the duration of a polling, see `use_engine`
+        self.snmp_engine = self.mib_view_controller = None
         self.ip_address = None
         self.ip_network = None
         self.discovered_instances = {}
         self.failing_instances = defaultdict(int)
         self.allowed_failures = int(instance.get('discovery_allowed_failures', self.DEFAULT_ALLOWED_FAILURES))
         self.bulk_threshold = int(instance.get('bulk_threshold', self.DEFAULT_BULK_THRESHOLD))
+        self.workers = max(int(instance.get('workers', self.DEFAULT_WORKERS)), 1)
+        self.polling_deadline = float(
+            instance.get('polling_deadline', instance.get('min_collection_interval', self.DEFAULT_POLLING_DEADLINE))
+        )
+        # Time after which the current polling of the device is aborted, if any
+        self.deadline = None
 
         timeout = int(instance.get('timeout', self.DEFAULT_TIMEOUT))
         retries = int(instance.get('retries', self.DEFAULT_RETRIES))
@@ -74,6 +91,8 @@ class InstanceConfig:
             raise ConfigurationError('Instance should specify at least one metric or profiles should be defined')
 
         self.table_oids, self.raw_oids, self.mibs_to_load = self.parse_metrics(self.metrics, warning, log)
+        self.raw_metrics, self.raw_metrics_by_oid = self.compile_raw_metrics(self.metrics, warning)
+        self.engines = SnmpEnginePool.get(mibs_path, self.mibs_to_load, log)
 
         self.auth_data = self.get_auth_data(instance)
         self.context_data = hlapi.ContextData(*self.get_context_data(instance))
@@ -81,6 +100,20 @@ class InstanceConfig:
     def refresh_with_profile(self, profile, warning, log):
         self.metrics.extend(profile['definition'])
         self.table_oids, self.raw_oids, self.mibs_to_load = self.parse_metrics(self.metrics, warning, log)
+        self.raw_metrics, self.raw_metrics_by_oid = self.compile_raw_metrics(self.metrics, warning)
+        self.engines = SnmpEnginePool.get(self.mibs_path, self.mibs_to_load, log)
+
+    @contextmanager
+    def use_engine(self):
+        """
+        Borrow an SNMP engine and its MIB view for the duration of the block,
+        as `snmp_engine` and `mib_view_controller`.
+        """
+        with self.engines.borrow() as (self.snmp_engine, self.mib_view_controller):
+            try:
+                yield
+            finally:
+                self.snmp_engine = self.mib_view_controller = None
 
     def call_cmd(self, cmd, *args, **kwargs):
         return cmd(self.snmp_engine, self.auth_data, self.transport, self.context_data, *args, **kwargs)
@@ -237,14 +270,29 @@ class InstanceConfig:
             else:
                 raise ConfigurationError('Unsupported metric in config file: {}'.format(metric))
 
-        for mib in mibs_to_load:
+        return dict(table_oids.values()), raw_oids, mibs_to_load
+
+    @staticmethod
+    def compile_raw_metrics(metrics, warning):
+        """Index the metrics specified by OID, to match them with the OIDs returned by the device.
+
+        `raw_metrics` is the list of the metrics specified by OID.
+        `raw_metrics_by_oid` is an `OIDTrie` of their positions in `raw_metrics`.
+        """
+        raw_metrics = []
+        raw_metrics_by_oid = OIDTrie()
+        for metric in metrics:
+            if 'OID' not in metric:
+                continue
             try:
-                self.mib_view_controller.mibBuilder.loadModule(mib)
-            except MibNotFoundError:
-                log.debug("Couldn't found mib %s, trying to fetch it", mib)
-                self.fetch_mib(mib)
+                oid = to_oid_tuple(metric['OID'])
+            except ValueError:
+                warning('Invalid OID %s, it must be numeric', metric['OID'])
+                continue
+            raw_metrics_by_oid.add(oid, len(raw_metrics))
+            raw_metrics.append(metric)
 
-        return dict(table_oids.values()), raw_oids, mibs_to_load
+        return raw_metrics, raw_metrics_by_oid
 
     @staticmethod
     def fetch_mib(mib):
@@ -256,3 +304,63 @@ class InstanceConfig:
         mibCompiler.addSources(reader)
 
         mibCompiler.compile(mib)
+
+
+class SnmpEnginePool(object):
+    """
+    SNMP engines sharing a custom MIBs folder and a set of loaded MIBs, used by the configurations
+    of all the devices that need them. An engine is used by a single device polling at a time: they
+    are created on demand, as many as devices polled at the same time rather than one per device.
+
+    Pools are kept as long as a configuration references them.
+    """
+
+    _pools = weakref.WeakValueDictionary()
+    _pools_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, mibs_path, mibs, log):
+        key = (mibs_path, frozenset(mibs))
+        with cls._pools_lock:
+            pool = cls._pools.get(key)
+            if pool is None:
+                pool = cls._pools[key] = cls(mibs_path, mibs, log)
+        return pool
+
+    def __init__(self, mibs_path, mibs, log):
+        self.mibs_path = mibs_path
+        self.mibs = sorted(mibs)
+        self.log = log
+        self._lock = threading.Lock()
+        # Load the MIBs right away, to fetch the missing ones
+        self._idle = [self._create_engine()]
+        self.size = 1
+
+    def _create_engine(self):
+        snmp_engine, mib_view_controller = InstanceConfig.create_snmp_engine(self.mibs_path)
+        for mib in self.mibs:
+            try:
+                mib_view_controller.mibBuilder.loadModule(mib)
+            except MibNotFoundError:
+                self.log.debug("Couldn't found mib %s, trying to fetch it", mib)
+                InstanceConfig.fetch_mib(mib)
+        return snmp_engine, mib_view_controller
+
+    @contextmanager
+    def borrow(self):
+        """
+        Yield an idle `(snmp_engine, mib_view_controller)`, created if there is none.
+        """
+        with self._lock:
+            engine = self._idle.pop() if self._idle else None
+
+        if engine is None:
+            engine = self._create_engine()
+            with self._lock:
+                self.size += 1
+
+        try:
+            yield engine
+        finally:
+            with self._lock:
+                self._idle.append(engine)
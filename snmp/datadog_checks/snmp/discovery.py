@@ -0,0 +1,130 @@
+# (C) Datadog, Inc. 2019
+# All rights reserved
+# Licensed under Simplified BSD License (see LICENSE)
+import time
+
+from pysnmp import hlapi
+from pysnmp.error import PySnmpError
+from pysnmp.hlapi.asyncore import cmdgen
+
+from .config import InstanceConfig
+
+# Reference sysObjectID directly, see http://oidref.com/1.3.6.1.2.1.1.2
+SYS_OBJECT_ID = (1, 3, 6, 1, 2, 1, 1, 2)
+
+
+class DiscoveryScanner(object):
+    """
+    Probe the hosts of a network for their sysObjectID, with many requests in flight on a
+    single asynchronous SNMP engine. A dead address only costs the probe timeout, which is
+    shorter than the polling one, and does not hold back the other hosts.
+    """
+
+    DEFAULT_CONCURRENCY = 64
+    DEFAULT_TIMEOUT = 1
+    DEFAULT_RETRIES = 1
+
+    def __init__(self, instance, log):
+        self.log = log
+        self.concurrency = max(int(instance.get('discovery_concurrency', self.DEFAULT_CONCURRENCY)), 1)
+        self.timeout = float(instance.get('discovery_timeout', self.DEFAULT_TIMEOUT))
+        self.retries = int(instance.get('discovery_retries', self.DEFAULT_RETRIES))
+        self.port = int(instance.get('port', 161))
+        self.auth_data = InstanceConfig.get_auth_data(instance)
+        self.context_data = hlapi.ContextData(*InstanceConfig.get_context_data(instance))
+
+        # Progress of the current scan, and duration of the last complete one
+        self.hosts = 0
+        self.hosts_scanned = 0
+        self.hosts_responsive = 0
+        self.scan_start = None
+        self.scan_end = None
+        self.last_scan_duration = None
+
+    def scan(self, hosts, running=None):
+        """
+        Probe the hosts, at most `concurrency` of them at the same time.
+
+        :param hosts: list of IP addresses
+        :param running: optional callable, the scan stops early when it returns false
+        :returns: dictionary of the sysObjectID of the hosts that responded
+        """
+        sys_object_oids = {}
+        pending = iter(hosts)
+
+        self.hosts = len(hosts)
+        self.hosts_scanned = 0
+        self.hosts_responsive = 0
+        self.scan_start = time.time()
+        self.scan_end = None
+
+        # A new engine for each scan, the engine keeps the configuration of every target it sent requests to
+        snmp_engine = hlapi.SnmpEngine()
+        object_type = hlapi.ObjectType(hlapi.ObjectIdentity(SYS_OBJECT_ID))
+
+        def probe_next():
+            for host in pending:
+                if running is not None and not running():
+                    return
+
+                try:
+                    transport = hlapi.UdpTransportTarget((host, self.port), timeout=self.timeout, retries=self.retries)
+                    cmdgen.nextCmd(
+                        snmp_engine,
+                        self.auth_data,
+                        transport,
+                        self.context_data,
+                        object_type,
+                        lookupMib=False,
+                        cbFun=on_response,
+                        cbCtx=host,
+                    )
+                except PySnmpError as e:
+                    self.hosts_scanned += 1
+                    self.log.debug('Error scanning host %s: %s', host, e)
+                    continue
+                return
+
+        def on_response(snmp_engine, send_request_handle, error_indication, error_status, error_index, var_binds, host):
+            self.hosts_scanned += 1
+            if error_indication or error_status:
+                self.log.debug('Error scanning host %s: %s', host, error_indication or error_status.prettyPrint())
+            elif var_binds:
+                self.hosts_responsive += 1
+                sys_object_oids[host] = var_binds[0][0][1].prettyPrint()
+
+            probe_next()
+            # Only the first row of the walk is needed
+            return False
+
+        for _ in range(self.concurrency):
+            probe_next()
+
+        dispatcher = snmp_engine.transportDispatcher
+        if dispatcher is not None:
+            try:
+                dispatcher.runDispatcher()
+            finally:
+                dispatcher.closeDispatcher()
+
+        self.scan_end = time.time()
+        self.last_scan_duration = self.scan_end - self.scan_start
+        return sys_object_oids
+
+    def get_telemetry(self):
+        """
+        Returns the progress of the current scan as a list of `(name, value)`.
+        """
+        if self.scan_start is None:
+            return []
+
+        elapsed = (self.scan_end or time.time()) - self.scan_start
+        telemetry = [
+            ('hosts', self.hosts),
+            ('hosts_scanned', self.hosts_scanned),
+            ('hosts_responsive', self.hosts_responsive),
+            ('scan_rate', self.hosts_scanned / elapsed if elapsed > 0 else 0),
+        ]
+        if self.last_scan_duration is not None:
+            telemetry.append(('scan_duration', self.last_scan_duration))
+        return telemetry
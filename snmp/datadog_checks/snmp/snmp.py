@@ -18,9 +18,11 @@ from pysnmp.smi.exval import noSuchInstance, noSuchObject
 from six import iteritems
 
 from datadog_checks.base import AgentCheck, ConfigurationError, is_affirmative
+from datadog_checks.base.checks.libs.thread_pool import Pool
 from datadog_checks.base.errors import CheckException
 
 from .config import InstanceConfig
+from .discovery import DiscoveryScanner
 
 try:
     from datadog_agent import get_config, read_persistent_cache, write_persistent_cache
@@ -64,8 +66,11 @@ def reply_invalid(oid):
 class SnmpCheck(AgentCheck):
 
     SC_STATUS = 'snmp.can_check'
+    # Every value of every device is submitted with one of the few names of the configured metrics
+    METRIC_NAME_CACHE_SIZE = 1000
     _running = True
     _thread = None
+    _scanner = None
     _NON_REPEATERS = 0
     _MAX_REPETITIONS = 25
 
@@ -100,6 +105,7 @@ class SnmpCheck(AgentCheck):
 
         self.instance['name'] = self._get_instance_key(self.instance)
         self._config = self._build_config(self.instance)
+        self._discovery_telemetry = is_affirmative(self.instance.get('discovery_telemetry', False))
 
     def _build_config(self, instance):
         return InstanceConfig(
@@ -131,20 +137,25 @@ class SnmpCheck(AgentCheck):
         discovery_interval = config.instance.get('discovery_interval', 3600)
         while self._running:
             start_time = time.time()
-            for host in config.ip_network.hosts():
-                host = str(host)
-                if host in config.discovered_instances:
-                    continue
+            hosts = [str(host) for host in config.ip_network.hosts()]
+            hosts = [host for host in hosts if host not in config.discovered_instances]
+            try:
+                sys_object_oids = self._scanner.scan(hosts, running=lambda: self._running)
+            except Exception as e:
+                self.log.warning("Error scanning network %s: %s", config.ip_network, e)
+                sys_object_oids = {}
+
+            if not self._running:
+                # The scan was interrupted
+                break
+
+            # Only build the configuration of the hosts that responded
+            for host, sys_object_oid in iteritems(sys_object_oids):
                 instance = config.instance.copy()
                 instance.pop('network_address')
                 instance['ip_address'] = host
 
                 host_config = self._build_config(instance)
-                try:
-                    sys_object_oid = self.fetch_sysobject_oid(host_config)
-                except Exception as e:
-                    self.log.debug("Error scanning host %s: %s", host, e)
-                    continue
                 if sys_object_oid not in self.profiles_by_oid:
                     if not (host_config.table_oids or host_config.raw_oids):
                         self.log.warn("Host %s didn't match a profile for sysObjectID %s", host, sys_object_oid)
@@ -165,6 +176,13 @@ class SnmpCheck(AgentCheck):
             message = '{} for instance {}'.format(error_indication, ip_address)
             raise CheckException(message)
 
+    def raise_on_deadline(self, config):
+        if config.deadline is not None and time.time() > config.deadline:
+            message = 'Polling deadline of {}s exceeded for instance {}'.format(
+                config.polling_deadline, config.ip_address
+            )
+            raise CheckException(message)
+
     def check_table(self, config, table_oids):
         """
         Perform a snmpwalk on the domain specified by the oids, on the device
@@ -192,6 +210,7 @@ class SnmpCheck(AgentCheck):
         all_binds, error = self.fetch_oids(config, oids, enforce_constraints=enforce_constraints)
 
         for oid in bulk_oids:
+            self.raise_on_deadline(config)
             try:
                 self.log.debug('Running SNMP command getBulk on OID %r', oid)
                 binds_iterator = config.call_cmd(
@@ -232,16 +251,14 @@ class SnmpCheck(AgentCheck):
         configured in instance.
 
         Returns a dictionary:
-        dict[oid/metric_name] = value
+        dict[oid tuple] = value
         In case of scalar objects, the row index is just 0
         """
         all_binds, error = self.fetch_oids(config, oids, enforce_constraints=False)
         results = {}
 
         for result_oid, value in all_binds:
-            oid = result_oid.asTuple()
-            matching = '.'.join(str(i) for i in oid)
-            results[matching] = value
+            results[result_oid.asTuple()] = value
         self.log.debug('Raw results: %s', results)
         return results, error
 
@@ -256,6 +273,7 @@ class SnmpCheck(AgentCheck):
         first_oid = 0
         all_binds = []
         while first_oid < len(oids):
+            self.raise_on_deadline(config)
             try:
                 oids_batch = oids[first_oid : first_oid + self.oid_batch_size]
                 self.log.debug('Running SNMP command get on OIDS %s', oids_batch)
@@ -318,6 +336,7 @@ class SnmpCheck(AgentCheck):
             self.log.debug('Returned vars: %s', var_binds_table)
 
             self.raise_on_error_indication(error_indication, config.ip_address)
+            self.raise_on_deadline(config)
 
             if error_status:
                 message = '{} for instance {}'.format(error_status.prettyPrint(), config.ip_address)
@@ -349,6 +368,7 @@ class SnmpCheck(AgentCheck):
                 host_config = self._build_config(instance)
                 self._config.discovered_instances[host] = host_config
 
+        self._scanner = DiscoveryScanner(self.instance, self.log)
         self._thread = threading.Thread(target=self.discover_instances, name=self.name)
         self._thread.daemon = True
         self._thread.start()
@@ -362,8 +382,8 @@ class SnmpCheck(AgentCheck):
         if self._config.ip_network:
             if self._thread is None:
                 self._start_discovery()
-            for host, discovered in list(config.discovered_instances.items()):
-                if self._check_with_config(discovered):
+            for host, error in self.check_discovered_instances(config):
+                if error:
                     config.failing_instances[host] += 1
                     if config.failing_instances[host] >= config.allowed_failures:
                         # Remove it from discovered instances, we'll re-discover it later if it reappears
@@ -373,30 +393,95 @@ class SnmpCheck(AgentCheck):
                 else:
                     # Reset the counter if not's failing
                     config.failing_instances.pop(host, None)
+            if self._discovery_telemetry:
+                self.submit_discovery_telemetry(config)
         else:
             self._check_with_config(config)
 
-    def _check_with_config(self, config):
-        # Reset errors
-        instance = config.instance
+    def submit_discovery_telemetry(self, config):
+        """
+        Report the progress of the network scan, and the number of devices monitored.
+        """
+        tags = config.tags + ['network_address:{}'.format(config.ip_network)]
+        for name, value in self._scanner.get_telemetry():
+            self.gauge('snmp.discovery.{}'.format(name), value, tags=tags)
+        self.gauge('snmp.discovery.devices', len(config.discovered_instances), tags=tags)
+
+    def check_discovered_instances(self, config):
+        """
+        Poll the discovered devices from a bounded pool of worker threads, and report the results
+        of each device from the check's thread as soon as they are received. Each device has its
+        own deadline, a slow device doesn't hold back the others.
+
+        Yields (host, error) for every device.
+        """
+        discovered = list(config.discovered_instances.items())
+        workers = min(config.workers, len(discovered))
+        if workers <= 1:
+            for host, discovered_config in discovered:
+                yield host, self._check_with_config(discovered_config, deadline=True)
+            return
+
+        pool = Pool(workers, name='{}-devices'.format(self.name))
+        try:
+            for host, discovered_config, results in pool.imap_unordered(self._poll_discovered_instance, discovered):
+                yield host, self._report_results(discovered_config, *results)
+        finally:
+            pool.terminate()
+
+    def _poll_discovered_instance(self, discovered):
+        host, config = discovered
+        return host, config, self._fetch_results(config, deadline=True)
+
+    def _check_with_config(self, config, deadline=False):
+        return self._report_results(config, *self._fetch_results(config, deadline))
+
+    def _fetch_results(self, config, deadline=False):
+        """
+        Query the device, within the polling deadline if `deadline` is set.
+
+        Returns a tuple (table_results, raw_results, error).
+        """
         error = table_results = raw_results = None
+        if deadline:
+            config.deadline = time.time() + config.polling_deadline
         try:
             if not (config.table_oids or config.raw_oids):
-                sys_object_oid = self.fetch_sysobject_oid(config)
+                with config.use_engine():
+                    sys_object_oid = self.fetch_sysobject_oid(config)
                 if sys_object_oid not in self.profiles_by_oid:
                     raise ConfigurationError('No profile matching sysObjectID {}'.format(sys_object_oid))
                 profile = self.profiles_by_oid[sys_object_oid]
                 config.refresh_with_profile(self.profiles[profile], self.warning, self.log)
 
-            if config.table_oids:
-                self.log.debug('Querying device %s for %s oids', config.ip_address, len(config.table_oids))
-                table_results, error = self.check_table(config, config.table_oids)
+            # The profile may have changed the engines to use
+            with config.use_engine():
+                if config.table_oids:
+                    self.log.debug('Querying device %s for %s oids', config.ip_address, len(config.table_oids))
+                    table_results, error = self.check_table(config, config.table_oids)
+
+                if config.raw_oids:
+                    self.log.debug('Querying device %s for %s oids', config.ip_address, len(config.raw_oids))
+                    raw_results, error = self.check_raw(config, config.raw_oids)
+        except CheckException as e:
+            error = str(e)
+            self.warning(error)
+        except Exception as e:
+            if not error:
+                error = 'Failed to collect metrics for {} - {}'.format(config.instance['name'], e)
+            self.warning(error)
+        finally:
+            config.deadline = None
+        return table_results, raw_results, error
+
+    def _report_results(self, config, table_results, raw_results, error):
+        instance = config.instance
+        try:
+            if table_results is not None:
                 self.report_table_metrics(config.metrics, table_results, config.tags)
 
-            if config.raw_oids:
-                self.log.debug('Querying device %s for %s oids', config.ip_address, len(config.raw_oids))
-                raw_results, error = self.check_raw(config, config.raw_oids)
-                self.report_raw_metrics(config.metrics, raw_results, config.tags)
+            if raw_results is not None:
+                self.report_raw_metrics(config.raw_metrics, config.raw_metrics_by_oid, raw_results, config.tags)
         except CheckException as e:
             error = str(e)
             self.warning(error)
@@ -416,33 +501,36 @@ class SnmpCheck(AgentCheck):
             self.service_check(self.SC_STATUS, status, tags=sc_tags, message=error)
         return error
 
-    def report_raw_metrics(self, metrics, results, tags):
+    def report_raw_metrics(self, metrics, metrics_by_oid, results, tags):
         """
         For all the metrics that are specified as oid,
         the conf oid is going to exactly match or be a prefix of the oid sent back by the device
         Use the instance configuration to find the name to give to the metric
 
         Submit the results to the aggregator.
+
+        :param metrics: the metrics specified as oid
+        :param metrics_by_oid: `OIDTrie` of the positions of the metrics in `metrics`
+        :param results: the values returned by the device, by oid tuple
         """
-        for metric in metrics:
-            if 'OID' in metric:
-                forced_type = metric.get('forced_type')
-                queried_oid = metric['OID'].lstrip('.')
-                if queried_oid in results:
-                    value = results[queried_oid]
-                else:
-                    for oid in results:
-                        if oid.startswith(queried_oid):
-                            value = results[oid]
-                            break
-                    else:
-                        self.log.warning('No matching results found for oid %s', queried_oid)
-                        continue
-                name = metric.get('name', 'unnamed_metric')
-                metric_tags = tags
-                if metric.get('metric_tags'):
-                    metric_tags = metric_tags + metric.get('metric_tags')
-                self.submit_metric(name, value, forced_type, metric_tags)
+        # Walk the trie once per returned oid, an exact match takes precedence over the first oid it prefixes
+        values = {}
+        for oid, value in iteritems(results):
+            for length, positions in metrics_by_oid.match(oid):
+                for position in positions:
+                    if length == len(oid) or position not in values:
+                        values[position] = value
+
+        for position, metric in enumerate(metrics):
+            if position not in values:
+                self.log.warning('No matching results found for oid %s', metric['OID'].lstrip('.'))
+                continue
+            forced_type = metric.get('forced_type')
+            name = metric.get('name', 'unnamed_metric')
+            metric_tags = tags
+            if metric.get('metric_tags'):
+                metric_tags = metric_tags + metric.get('metric_tags')
+            self.submit_metric(name, values[position], forced_type, metric_tags)
 
     def report_table_metrics(self, metrics, results, tags):
         """
@@ -465,9 +553,15 @@ class SnmpCheck(AgentCheck):
                     else:
                         self.log.warning('No indication on what value to use for this tag')
 
+                # The tags of a row are shared by all the symbols
+                row_tags = {}
                 for value_to_collect in metric.get('symbols', []):
                     for index, val in iteritems(results[value_to_collect]):
-                        metric_tags = tags + self.get_index_tags(index, results, index_based_tags, column_based_tags)
+                        metric_tags = row_tags.get(index)
+                        if metric_tags is None:
+                            metric_tags = row_tags[index] = tags + self.get_index_tags(
+                                index, results, index_based_tags, column_based_tags
+                            )
                         self.submit_metric(value_to_collect, val, forced_type, metric_tags)
 
             elif 'symbol' in metric:
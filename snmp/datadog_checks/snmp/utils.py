@@ -0,0 +1,48 @@
+# (C) Datadog, Inc. 2019
+# All rights reserved
+# Licensed under Simplified BSD License (see LICENSE)
+
+
+def to_oid_tuple(oid):
+    """
+    Convert an OID string like `1.3.6.1.2.1.1.3.0` or `.1.3.6.1.2.1.1.3.0` to a tuple of integers.
+    Raises ValueError for an OID that is not numeric.
+    """
+    return tuple(int(part) for part in oid.lstrip('.').split('.'))
+
+
+class OIDTrie(object):
+    """
+    Values indexed by OID, to find the values of all the OIDs that an OID starts with
+    in a single walk of its parts.
+    """
+
+    __slots__ = ('children', 'values')
+
+    def __init__(self):
+        self.children = {}
+        self.values = []
+
+    def add(self, oid, value):
+        """
+        :param oid: tuple of integers
+        """
+        node = self
+        for part in oid:
+            child = node.children.get(part)
+            if child is None:
+                child = node.children[part] = OIDTrie()
+            node = child
+        node.values.append(value)
+
+    def match(self, oid):
+        """
+        Yield `(length, values)` for the OIDs that are a prefix of `oid`, or `oid` itself, shortest first.
+        """
+        node = self
+        for length, part in enumerate(oid, 1):
+            node = node.children.get(part)
+            if node is None:
+                return
+            if node.values:
+                yield length, node.values
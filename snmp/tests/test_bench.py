@@ -6,6 +6,9 @@ import pytest
 
 from .common import BULK_TABULAR_OBJECTS, TABULAR_OBJECTS, create_check, generate_instance_config
 
+# Number of devices of a /24
+DISCOVERED_DEVICES = 254
+
 pytestmark = pytest.mark.usefixtures("dd_environment")
 
 
@@ -38,3 +41,21 @@ def test_tabular_no_bulk(benchmark):
     check = create_check(instance)
 
     benchmark(check.check, instance)
+
+
+def test_discovered_configs(benchmark):
+    """
+    Build the configurations of the devices of a /24 network, which share their SNMP engines.
+    """
+    instance = generate_instance_config(TABULAR_OBJECTS)
+    instance.pop('ip_address')
+    instance['network_address'] = '192.168.0.0/24'
+    check = create_check(instance)
+
+    def build():
+        for i in range(1, DISCOVERED_DEVICES + 1):
+            discovered_instance = dict(instance, ip_address='192.168.0.{}'.format(i))
+            discovered_instance.pop('network_address')
+            check._build_config(discovered_instance)
+
+    benchmark(build)
@@ -31,7 +31,8 @@ def test_command_generator():
     config = check._config
 
     # Test command generator MIB source
-    mib_folders = config.snmp_engine.getMibBuilder().getMibSources()
+    with config.use_engine():
+        mib_folders = config.snmp_engine.getMibBuilder().getMibSources()
     full_path_mib_folders = [f.fullPath() for f in mib_folders]
     assert check.ignore_nonincreasing_oid is False  # Default value
 
@@ -3,15 +3,19 @@
 # Licensed under Simplified BSD License (see LICENSE)
 
 import os
+import threading
 import time
 
 import mock
 import pytest
+from pysnmp import hlapi
 
 from datadog_checks.base import ConfigurationError
 from datadog_checks.dev import temp_dir
 from datadog_checks.snmp import SnmpCheck
-from datadog_checks.snmp.config import InstanceConfig
+from datadog_checks.snmp.config import InstanceConfig, SnmpEnginePool
+from datadog_checks.snmp.discovery import DiscoveryScanner
+from datadog_checks.snmp.utils import OIDTrie, to_oid_tuple
 
 from . import common
 
@@ -187,7 +191,10 @@ def test_cache_discovered_host(read_mock):
 
     read_mock.return_value = '["192.168.0.1"]'
     check = SnmpCheck('snmp', {}, [instance])
-    check.check(instance)
+    try:
+        check.check(instance)
+    finally:
+        check._running = False
 
     assert '192.168.0.1' in check._config.discovered_instances
 
@@ -200,7 +207,10 @@ def test_cache_corrupted(write_mock, read_mock):
     instance['network_address'] = '192.168.0.0/24'
     read_mock.return_value = '["192.168.0."]'
     check = SnmpCheck('snmp', {}, [instance])
-    check.check(instance)
+    try:
+        check.check(instance)
+    finally:
+        check._running = False
 
     assert not check._config.discovered_instances
     write_mock.assert_called_once_with('', '[]')
@@ -233,3 +243,276 @@ def test_cache_building(write_mock, read_mock):
         check._running = False
 
     write_mock.assert_called_once_with('', '["192.168.0.1"]')
+
+
+def mock_scan_requests(responses):
+    """
+    Replace the SNMP engine of a discovery scan, the requests are answered from `responses`,
+    a dictionary of sysObjectID by host, one at a time in the order they were sent.
+    Returns the list of the numbers of requests in flight at each response.
+    """
+    requests = []
+    in_flight = []
+
+    def next_cmd(snmp_engine, auth_data, transport, context_data, object_type, **options):
+        requests.append(options)
+
+    def run_dispatcher():
+        while requests:
+            in_flight.append(len(requests))
+            options = requests.pop(0)
+            host = options['cbCtx']
+            if host in responses:
+                var_binds = [[(hlapi.ObjectIdentity('1.3.6.1.2.1.1.2.0'), hlapi.ObjectIdentifier(responses[host]))]]
+                options['cbFun'](None, 0, None, 0, 0, var_binds, host)
+            else:
+                options['cbFun'](None, 0, 'No SNMP response received before timeout', 0, 0, [], host)
+
+    snmp_engine = mock.MagicMock()
+    snmp_engine.transportDispatcher.runDispatcher.side_effect = run_dispatcher
+    return (
+        mock.patch('datadog_checks.snmp.discovery.cmdgen.nextCmd', side_effect=next_cmd),
+        mock.patch('datadog_checks.snmp.discovery.hlapi.SnmpEngine', return_value=snmp_engine),
+        in_flight,
+    )
+
+
+def test_discovery_scanner():
+    instance = common.generate_instance_config([])
+    instance['discovery_concurrency'] = 4
+    scanner = DiscoveryScanner(instance, common.log)
+    hosts = ['192.168.0.{}'.format(i) for i in range(1, 11)]
+    assert scanner.get_telemetry() == []
+
+    patch_cmd, patch_engine, in_flight = mock_scan_requests({'192.168.0.3': '1.3.6.1.4.1.8072.3.2.10'})
+    with patch_cmd as next_cmd, patch_engine:
+        assert scanner.scan(hosts) == {'192.168.0.3': '1.3.6.1.4.1.8072.3.2.10'}
+
+    # The concurrency is bounded, and every host is probed once with the discovery timeout
+    assert max(in_flight) == 4
+    assert len(in_flight) == 10
+    for (_, _, transport, _, _), _ in next_cmd.call_args_list:
+        assert (transport.timeout, transport.retries) == (1, 1)
+
+    telemetry = dict(scanner.get_telemetry())
+    assert telemetry['hosts'] == 10
+    assert telemetry['hosts_scanned'] == 10
+    assert telemetry['hosts_responsive'] == 1
+    assert 'scan_rate' in telemetry
+    assert 'scan_duration' in telemetry
+
+
+def test_discovery_scanner_stopped():
+    instance = common.generate_instance_config([])
+    instance['discovery_concurrency'] = 2
+    scanner = DiscoveryScanner(instance, common.log)
+    hosts = ['192.168.0.{}'.format(i) for i in range(1, 11)]
+
+    patch_cmd, patch_engine, in_flight = mock_scan_requests({})
+    with patch_cmd, patch_engine:
+        running = iter([True, True, True, False])
+        assert scanner.scan(hosts, running=lambda: next(running, False)) == {}
+
+    # No new probe once stopped, those in flight are completed
+    assert len(in_flight) == 3
+
+
+def test_discover_instances(aggregator):
+    instance = common.generate_instance_config([])
+    instance.pop('ip_address')
+    instance['network_address'] = '192.168.0.0/29'
+    instance['discovery_telemetry'] = True
+    init_config = {
+        'profiles': {
+            'profile1': {'definition': common.SUPPORTED_METRIC_TYPES, 'sysobjectid': '1.3.6.1.4.1.8072.3.2.10'}
+        }
+    }
+    check = SnmpCheck('snmp', init_config, [instance])
+    check._scanner = DiscoveryScanner(instance, check.log)
+    sys_object_oids = {'192.168.0.2': '1.3.6.1.4.1.8072.3.2.10', '192.168.0.3': '1.3.6.1.4.1.1'}
+
+    def stop(interval):
+        # Stop the discovery after a single scan
+        check._running = False
+
+    with mock.patch.object(check._scanner, 'scan', return_value=sys_object_oids) as scan:
+        with mock.patch('datadog_checks.snmp.snmp.time.sleep', side_effect=stop):
+            check.discover_instances()
+
+    scan.assert_called_once_with(['192.168.0.{}'.format(i) for i in range(1, 7)], running=mock.ANY)
+    # Only the responsive hosts matching a profile are monitored
+    assert list(check._config.discovered_instances) == ['192.168.0.2']
+    assert check._config.discovered_instances['192.168.0.2'].raw_oids
+
+    check._thread = mock.MagicMock()
+    with mock.patch.object(check, '_check_with_config', return_value=None):
+        check.check(instance)
+    aggregator.assert_metric('snmp.discovery.devices', value=1, tags=['network_address:192.168.0.0/29'], count=1)
+
+
+def test_check_discovered_instances():
+    instance = common.generate_instance_config(common.SUPPORTED_METRIC_TYPES)
+    hosts = ['192.168.0.{}'.format(i) for i in range(1, 5)]
+    instance.pop('ip_address')
+    instance['network_address'] = '192.168.0.0/29'
+    instance['workers'] = 4
+    check = SnmpCheck('snmp', {}, [instance])
+    check._thread = mock.MagicMock()
+    for host in hosts:
+        discovered_instance = dict(instance, ip_address=host)
+        discovered_instance.pop('network_address')
+        check._config.discovered_instances[host] = check._build_config(discovered_instance)
+
+    threads = set()
+
+    def fetch_results(config, deadline=False):
+        assert deadline
+        threads.add(threading.current_thread().name)
+        time.sleep(0.5)
+        error = 'timeout' if config.ip_address == '192.168.0.1' else None
+        return None, None, error
+
+    with mock.patch.object(check, '_fetch_results', side_effect=fetch_results):
+        start = time.time()
+        check.check(instance)
+        # The devices are polled concurrently
+        assert time.time() - start < 1.5
+        assert len(threads) == 4
+
+        # Failing devices are removed after `discovery_allowed_failures` runs
+        assert check._config.failing_instances == {'192.168.0.1': 1}
+        check.check(instance)
+        check.check(instance)
+        assert check._config.failing_instances == {}
+        assert sorted(check._config.discovered_instances) == hosts[1:]
+
+
+def test_polling_deadline():
+    instance = common.generate_instance_config(common.SUPPORTED_METRIC_TYPES)
+    instance['polling_deadline'] = 10
+    check = SnmpCheck('snmp', {}, [instance])
+    config = check._config
+    warnings = []
+    check.warning = warnings.append
+
+    with mock.patch('datadog_checks.snmp.snmp.time.time', side_effect=[0, 20]):
+        with mock.patch.object(config, 'call_cmd') as call_cmd:
+            table_results, raw_results, error = check._fetch_results(config, deadline=True)
+
+    call_cmd.assert_not_called()
+    assert raw_results is None
+    assert error == 'Polling deadline of 10.0s exceeded for instance {}'.format(config.ip_address)
+    assert warnings == [error]
+    assert config.deadline is None
+
+
+def test_shared_engines():
+    instance = common.generate_instance_config(common.SUPPORTED_METRIC_TYPES)
+    instance.pop('ip_address')
+    instance['network_address'] = '192.168.0.0/29'
+    check = SnmpCheck('snmp', {}, [instance])
+
+    configs = []
+    for host in ('192.168.0.1', '192.168.0.2'):
+        discovered_instance = dict(instance, ip_address=host)
+        discovered_instance.pop('network_address')
+        configs.append(check._build_config(discovered_instance))
+
+    # Devices needing the same MIBs share the engines, but not their transport
+    engines = configs[0].engines
+    assert configs[1].engines is engines
+    assert configs[0].transport is not configs[1].transport
+    assert configs[0].tags == ['snmp_device:192.168.0.1']
+
+    with configs[0].use_engine():
+        first_engine = configs[0].snmp_engine
+        assert first_engine is not None
+        # A device polled at the same time gets another engine
+        with configs[1].use_engine():
+            second_engine = configs[1].snmp_engine
+            assert second_engine not in (None, first_engine)
+    assert configs[0].snmp_engine is None
+    assert engines.size == 2
+
+    # Idle engines are reused
+    with configs[1].use_engine():
+        assert configs[1].snmp_engine in (first_engine, second_engine)
+    assert engines.size == 2
+
+    # Other MIBs need other engines
+    configs[1].refresh_with_profile({'definition': common.CONSTRAINED_OID}, check.warning, check.log)
+    assert configs[1].engines is not engines
+    assert configs[1].engines is SnmpEnginePool.get(None, {'RFC1213-MIB'}, check.log)
+    with configs[1].use_engine():
+        assert configs[1].mib_view_controller.mibBuilder.mibSymbols['RFC1213-MIB']
+
+
+def test_oid_trie():
+    trie = OIDTrie()
+    trie.add(to_oid_tuple('1.3.6.1'), 'a')
+    trie.add(to_oid_tuple('.1.3.6.1.2.1'), 'b')
+    trie.add(to_oid_tuple('1.3.6.1.2.1'), 'c')
+
+    assert list(trie.match((1, 3, 6, 1, 2, 1, 0))) == [(4, ['a']), (6, ['b', 'c'])]
+    assert list(trie.match((1, 3, 6, 1))) == [(4, ['a'])]
+    assert list(trie.match((1, 3, 6, 10))) == []
+
+    with pytest.raises(ValueError):
+        to_oid_tuple('IF-MIB::ifDescr')
+
+
+def test_report_raw_metrics(aggregator):
+    metrics = [
+        {'OID': '1.3.6.1.2.1.7.1', 'name': 'prefixed'},
+        {'OID': '1.3.6.1.2.1.7.2.0', 'name': 'exact', 'metric_tags': ['foo:bar']},
+        {'OID': '1.3.6.1.2.1.7.3', 'name': 'missing'},
+        {'OID': '.1.3.6.1.2.1.7', 'name': 'parent'},
+    ]
+    instance = common.generate_instance_config(metrics)
+    check = SnmpCheck('snmp', {}, [instance])
+    config = check._config
+    results = {
+        # Doesn't start with 1.3.6.1.2.1.7.3, even though its string does
+        (1, 3, 6, 1, 2, 1, 7, 30): hlapi.Gauge32(1),
+        (1, 3, 6, 1, 2, 1, 7, 1, 0): hlapi.Gauge32(2),
+        (1, 3, 6, 1, 2, 1, 7, 2, 0): hlapi.Gauge32(3),
+        (1, 3, 6, 1, 2, 1, 7): hlapi.Gauge32(4),
+    }
+
+    check.report_raw_metrics(config.raw_metrics, config.raw_metrics_by_oid, results, ['tag:value'])
+
+    aggregator.assert_metric('snmp.prefixed', value=2, tags=['tag:value'], count=1)
+    aggregator.assert_metric('snmp.exact', value=3, tags=['tag:value', 'foo:bar'], count=1)
+    # The exact match is reported rather than the first oid it prefixes
+    aggregator.assert_metric('snmp.parent', value=4, tags=['tag:value'], count=1)
+    aggregator.assert_all_metrics_covered()
+
+
+def test_report_table_metrics(aggregator):
+    metrics = [
+        {
+            'MIB': 'IF-MIB',
+            'table': 'ifTable',
+            'symbols': ['ifInOctets', 'ifOutOctets'],
+            'metric_tags': [{'tag': 'interface', 'column': 'ifDescr'}, {'tag': 'index', 'index': 1}],
+        }
+    ]
+    instance = common.generate_instance_config(metrics)
+    check = SnmpCheck('snmp', {}, [instance])
+    rows = [(hlapi.Integer(1),), (hlapi.Integer(2),)]
+    results = {
+        'ifInOctets': {row: hlapi.Counter32(10 * i) for i, row in enumerate(rows)},
+        'ifOutOctets': {row: hlapi.Counter32(20 * i) for i, row in enumerate(rows)},
+        'ifDescr': {row: hlapi.OctetString('eth{}'.format(i)) for i, row in enumerate(rows)},
+    }
+
+    with mock.patch.object(check, 'get_index_tags', wraps=check.get_index_tags) as get_index_tags:
+        check.report_table_metrics(metrics, results, ['tag:value'])
+
+    # The tags are computed once per row
+    assert get_index_tags.call_count == 2
+    for i in range(2):
+        tags = ['tag:value', 'interface:eth{}'.format(i), 'index:{}'.format(i + 1)]
+        aggregator.assert_metric('snmp.ifInOctets', tags=tags, count=1)
+        aggregator.assert_metric('snmp.ifOutOctets', tags=tags, count=1)
+    aggregator.assert_all_metrics_covered()